@@ -6,6 +6,19 @@ def create_app():
     app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), "..", "templates"))
     app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "change-me-in-prod")
 
+    # Request metrics first: its after_request hook then runs last (after the
+    # commit), so latency covers the whole request. /metrics, see app.metrics
+    from . import metrics
+    metrics.init_app(app)
+
+    # Per-worker DB pool; request-scoped connections are returned at teardown
+    from . import db
+    db.init_app(app)
+
+    # Server-side sessions: g.session from the `sessions` table
+    from . import sessions
+    sessions.init_app(app)
+
     # --- Register blueprints (keep names/paths) ---
     from .auth import bp as auth_bp
     app.register_blueprint(auth_bp)
@@ -18,6 +31,14 @@ def create_app():
     from .mfa import bp as mfa_bp
     app.register_blueprint(mfa_bp)
 
+    # superadmin peer management (needs g.session)
+    from .wg_admin import bp as wgadmin_bp
+    app.register_blueprint(wgadmin_bp)
+
+    # superadmin log listing / CSV export
+    from .logs import bp as logs_bp
+    app.register_blueprint(logs_bp)
+
     return app
 
 # Gunicorn/wsgi entrypoint convenience
@@ -0,0 +1,271 @@
+# app/audit.py
+# Asynchronous writer for audit_log, login_events and peer_events.
+#
+# Recording an event only appends a tuple to a bounded in-process queue
+# (a few microseconds on /login and /mfa). A daemon thread per worker drains
+# it with one multi-row INSERT per table whenever AUDIT_BATCH events are
+# waiting or AUDIT_FLUSH_SECONDS have passed, on its own pooled connection.
+#
+# Nothing is dropped silently: if MariaDB is unavailable the batch is
+# appended (and fsynced) to a per-process JSONL spill file under
+# AUDIT_SPILL_DIR, and so is anything enqueued while the queue is full. The
+# next successful flush -- in any worker -- claims spill files by renaming
+# them and replays them first. atexit and gunicorn's worker_exit hook
+# (gunicorn.conf.py) flush what is left on shutdown.
+#
+# created_at is stamped at enqueue time in local time, like the column's
+# current_timestamp() default, so batching doesn't shift event times.
+
+import atexit, datetime, glob, json, logging, os, threading, time
+from collections import deque
+
+import pymysql
+from flask import has_request_context, request
+
+from . import db
+
+log = logging.getLogger(__name__)
+
+AUDIT_BATCH         = int(os.getenv("AUDIT_BATCH", "200"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2"))
+AUDIT_QUEUE_MAX     = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+AUDIT_SPILL_DIR     = os.getenv("AUDIT_SPILL_DIR", "/var/lib/vpn-portal/audit-spill")
+SPILL_RETRY_SECONDS = 30
+
+COLUMNS = {
+    "audit_log": ("user_id", "action", "target_type", "target_id", "ip_address",
+                  "user_agent", "details_json", "created_at"),
+    "login_events": ("user_id", "username_attempted", "success", "reason", "ip_address",
+                     "user_agent", "created_at"),
+    "peer_events": ("user_id", "peer_id", "action", "details_json", "created_at"),
+}
+SQL_INSERT = {t: f"INSERT INTO {t} ({', '.join(c)}) VALUES ({', '.join(['%s'] * len(c))})"
+              for t, c in COLUMNS.items()}
+
+_queue = deque()
+_lock = threading.Lock()
+_wake = threading.Event()
+_flush_lock = threading.Lock()      # one flush at a time per process
+_flusher = None                     # (pid, thread)
+_retry_at = 0.0                     # no spill replay before this (DB was down)
+_stats = {"enqueued": 0, "written": 0, "flushes": 0, "spilled": 0, "replayed": 0,
+          "rejected": 0, "last_flush_ms": 0.0}
+
+
+def _now():
+    return datetime.datetime.now().replace(microsecond=0)
+
+def _client():
+    if not has_request_context():
+        return None, None
+    ip = request.headers.get("X-Real-IP") or request.remote_addr
+    return ip, (request.headers.get("User-Agent") or "")[:255] or None
+
+def _details(d):
+    return None if d is None else json.dumps(d, separators=(",", ":"), default=str)
+
+
+# ---- recording (request path) ----
+def _put(table, row):
+    with _lock:
+        full = len(_queue) >= AUDIT_QUEUE_MAX
+        if not full:
+            _queue.append((table, row))
+            n = len(_queue)
+        _stats["enqueued"] += 1
+    if full:
+        _spill([(table, row)])
+        return
+    _ensure_flusher()
+    if n >= AUDIT_BATCH:
+        _wake.set()
+
+def audit(action, user_id=None, target_type=None, target_id=None, details=None):
+    ip, ua = _client()
+    _put("audit_log", (user_id, action, target_type, target_id, ip, ua, _details(details), _now()))
+
+def login_event(username, success, user_id=None, reason=None):
+    ip, ua = _client()
+    _put("login_events", (user_id, (username or "")[:64] or None, 1 if success else 0,
+                          reason, ip, ua, _now()))
+
+def peer_event(action, peer_id=None, user_id=None, details=None):
+    _put("peer_events", (user_id, peer_id, action, _details(details), _now()))
+
+
+# ---- flushing ----
+def _ensure_flusher():
+    global _flusher
+    pid = os.getpid()
+    if _flusher is not None and _flusher[0] == pid and _flusher[1].is_alive():
+        return
+    with _lock:
+        if _flusher is None or _flusher[0] != pid or not _flusher[1].is_alive():
+            t = threading.Thread(target=_flush_loop, name="audit-flush", daemon=True)
+            _flusher = (pid, t)
+            t.start()
+
+def _flush_loop():
+    while True:
+        _wake.wait(AUDIT_FLUSH_SECONDS)
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            log.exception("audit flush failed")
+
+def _insert(batch):
+    by_table = {}
+    for table, row in batch:
+        by_table.setdefault(table, []).append(row)
+    pool = db.get_pool()
+    conn = pool.checkout(autocommit=False)
+    broken = False
+    try:
+        with conn.cursor() as cur:
+            for table, rows in by_table.items():
+                try:
+                    cur.executemany(SQL_INSERT[table], rows)    # folded into one multi-row INSERT
+                except (pymysql.err.IntegrityError, pymysql.err.DataError):
+                    # One bad row (e.g. a user deleted meanwhile) must not keep
+                    # the whole batch in the spill file forever.
+                    _insert_each(cur, table, rows)
+        conn.commit()
+    except Exception:
+        broken = True
+        raise
+    finally:
+        pool.checkin(conn, discard=broken)
+
+def _insert_each(cur, table, rows):
+    for row in rows:
+        try:
+            cur.execute(SQL_INSERT[table], row)
+        except (pymysql.err.IntegrityError, pymysql.err.DataError) as e:
+            _stats["rejected"] += 1
+            log.error("audit: %s row dropped: %s %r", table, e, row)
+
+def flush():
+    """Write everything queued, then replay spill files; returns rows written."""
+    global _retry_at
+    with _flush_lock:
+        with _lock:
+            batch = list(_queue)
+            _queue.clear()
+        written = 0
+        if batch:
+            t0 = time.perf_counter()
+            try:
+                _insert(batch)
+            except Exception as e:
+                log.warning("audit: DB unavailable (%s); spilling %d events", e, len(batch))
+                _spill(batch)
+                _retry_at = time.time() + SPILL_RETRY_SECONDS
+                return 0
+            written = len(batch)
+            _stats["flushes"] += 1
+            _stats["last_flush_ms"] = round((time.perf_counter() - t0) * 1000.0, 3)
+        if time.time() >= _retry_at:
+            written += _replay()
+        _stats["written"] += written
+        return written
+
+def _replay():
+    global _retry_at
+    paths, rows = _claim_spills()
+    if not rows:
+        _drop(paths)
+        return 0
+    try:
+        _insert(rows)
+    except Exception:
+        # Fold claimed files into our own spill file rather than renaming
+        # them back over a file another worker may be appending to.
+        if _spill(rows):
+            _drop(paths)
+        _retry_at = time.time() + SPILL_RETRY_SECONDS
+        return 0
+    _drop(paths)
+    _stats["replayed"] += len(rows)
+    return len(rows)
+
+
+# ---- spill files ----
+def _spill_path():
+    return os.path.join(AUDIT_SPILL_DIR, f"spill-{os.getpid()}.jsonl")
+
+def _spill(batch):
+    if not batch:
+        return True
+    lines = "".join(json.dumps([t, list(r)], default=str) + "\n" for t, r in batch)
+    try:
+        os.makedirs(AUDIT_SPILL_DIR, exist_ok=True)
+        fd = os.open(_spill_path(), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o640)
+        try:
+            os.write(fd, lines.encode("utf-8"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        _stats["spilled"] += len(batch)
+        return True
+    except OSError:
+        log.exception("audit: could not spill %d events", len(batch))
+        return False
+
+def _claim_spills():
+    """Rename spill files to *.replay (atomic claim) and load their rows."""
+    paths, rows = [], []
+    candidates = glob.glob(os.path.join(AUDIT_SPILL_DIR, "spill-*.jsonl"))
+    # Claims left behind by a worker that died mid-replay.
+    candidates += [p for p in glob.glob(os.path.join(AUDIT_SPILL_DIR, "*.replay"))
+                   if not _alive(int(p.rsplit(".", 2)[1]))]
+    for path in candidates:
+        claimed = f"{path.split('.jsonl')[0]}.jsonl.{os.getpid()}.replay"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            continue                     # another worker got it first
+        paths.append(claimed)
+        with open(claimed, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    table, row = json.loads(line)
+                    if table in COLUMNS:
+                        rows.append((table, tuple(row)))
+    return paths, rows
+
+def _alive(pid):
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def _drop(paths):
+    for p in paths:
+        try:
+            os.unlink(p)
+        except OSError:
+            pass
+
+
+def shutdown():
+    """Final flush; spill whatever can't be written. Safe to call twice."""
+    try:
+        flush()
+    except Exception:
+        with _lock:
+            batch = list(_queue)
+            _queue.clear()
+        _spill(batch)
+
+atexit.register(shutdown)
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats, queued=len(_queue))
@@ -1,16 +1,6 @@
 # app/auth.py
 from __future__ import annotations
 
-import base64
-import hmac
-import os
-import struct
-import time
-from hashlib import sha1
-from io import BytesIO
-from typing import Any, Optional
-from urllib.parse import urlparse, unquote
-
 from flask import (
     Blueprint,
     render_template,
@@ -18,21 +8,10 @@ from flask import (
     redirect,
     url_for,
     session,
-    abort,
-    send_file,
-    current_app,
 )
-from werkzeug.security import check_password_hash
-
-# Import project db module; we'll still be resilient if it lacks helpers.
+from . import audit, data, limiter, pwhash, sessions
 from . import db as db
 
-# Optional QR generator. If not present, we fallback to showing the otpauth URI.
-try:
-    import qrcode  # type: ignore
-except Exception:  # pragma: no cover
-    qrcode = None  # type: ignore
-
 bp = Blueprint("auth", __name__)
 
 # --------------------
@@ -40,11 +19,62 @@ bp = Blueprint("auth", __name__)
 # --------------------
 def _conn():
     """
-    Prefer a connection from app.db; otherwise open one from DATABASE_URL.
-    Checked, in order:
-      - db.get_db()
-      - db.connect()
-      - db.connect_db()
-      - db.db()                (callable)
-      - db.connection         (connection handle)
-      - os.environ["DATABASE_URL"] or
+    The request's pooled connection from app.db. Kept for callers that
+    still want a raw handle; prefer the query functions in app.data.
+    """
+    return db.get_conn()
+
+# --------------------
+# Login (step 1 of 2; TOTP follows at /mfa)
+# --------------------
+@bp.route("/login", methods=["GET", "POST"])
+def login():
+    if request.method == "GET":
+        return render_template("login.html", title="CITS VPN Portal — Sign in")
+
+    username = (request.form.get("username") or "").strip()
+    password = request.form.get("password") or ""
+
+    # Lockout check first: no DB lookup or hash for a locked user/IP.
+    keys = (limiter.user_key(username), limiter.ip_key(limiter.client_ip(request)))
+    if limiter.locked_for(*keys):
+        audit.login_event(username, False, reason="locked")
+        return render_template("login.html", title="CITS VPN Portal — Sign in",
+                               error="Too many attempts. Please wait a few minutes and try again."), 429
+
+    # Admission control: with the hashing queue full, refuse before any DB
+    # work rather than queue behind it (app.pwhash).
+    if pwhash.saturated():
+        return _busy()
+
+    user = data.get_user_for_login(username) if username else None
+
+    ok = False
+    if user and int(user.get("is_active") or 0):
+        try:
+            ok, upgraded = pwhash.verify(user["password_bcrypt"], password)
+        except pwhash.Busy:
+            return _busy()
+        if upgraded:
+            data.set_password_hash(user["id"], upgraded)
+    if not ok:
+        limiter.fail(*keys)
+        audit.login_event(username, False, user_id=user["id"] if user else None,
+                          reason="bad_password" if user else "unknown_user")
+        return render_template("login.html", title="CITS VPN Portal — Sign in",
+                               error="Invalid username or password."), 401
+
+    audit.login_event(username, True, user_id=user["id"], reason="password_ok")
+    session.clear()
+    session["pending_user_id"] = user["id"]
+    return redirect(url_for("mfa.mfa"))
+
+def _busy():
+    return (render_template("login.html", title="CITS VPN Portal — Sign in",
+                            error="The server is busy. Please try again in a moment."),
+            429, {"Retry-After": "2"})
+
+@bp.route("/logout", methods=["POST"])
+def logout():
+    sessions.end()
+    return redirect(url_for("auth.login"))
@@ -0,0 +1,98 @@
+# app/cache.py
+# Small in-process caches. Each gunicorn worker has its own copy, so anything
+# cached here must tolerate being up to `ttl` seconds stale in other workers.
+
+import os, threading, time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU with a per-entry time-to-live."""
+
+    def __init__(self, maxsize=1024, ttl=10.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()    # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or item[0] <= now:
+                if item is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def discard_if(self, pred):
+        """Drop every entry whose key satisfies pred(key)."""
+        with self._lock:
+            for key in [k for k in self._data if pred(k)]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class SharedTTLCache(TTLCache):
+    """
+    TTLCache whose whole contents can be invalidated across workers: bump()
+    touches `stamp_path` and every worker clears its copy the next time it
+    sees the file's mtime change (one stat per lookup). Meant for rarely
+    written data where a global flush on write is cheaper than coordination.
+    """
+
+    def __init__(self, stamp_path, maxsize=1024, ttl=10.0):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.stamp_path = stamp_path
+        self._stamp = self._read_stamp()
+
+    def _read_stamp(self):
+        try:
+            return os.stat(self.stamp_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def get(self, key, default=None):
+        stamp = self._read_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self.clear()
+            return default
+        return super().get(key, default)
+
+    def bump(self):
+        self.clear()
+        try:
+            with open(self.stamp_path, "a"):
+                pass
+            os.utime(self.stamp_path, None)
+        except OSError:
+            # No shared dir: other workers fall back to the TTL.
+            pass
+        self._stamp = self._read_stamp()
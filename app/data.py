@@ -0,0 +1,273 @@
+# app/data.py
+# Data-access layer: every query the web app runs goes through here, on the
+# request's single pooled connection (app.db.get_conn). Writes become visible
+# when app.db commits the request transaction after the view returns.
+#
+# PyMySQL has no server-side prepared statements; statements are kept as
+# module constants so each is built once and reused verbatim.
+
+from __future__ import annotations
+
+import os
+from typing import Any, Optional
+
+import pymysql
+from flask import g, has_app_context
+
+from . import db, sites, totp
+from .cache import SharedTTLCache
+
+# User rows are read on every /mfa, /mfa/qr.png and admin request but change
+# rarely. Lookups go per-request memo -> per-worker LRU (USER_CACHE_TTL) ->
+# DB; any write to a user bumps a stamp file so every worker drops its copy
+# once the write has committed.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+_users = SharedTTLCache(
+    os.path.join(os.getenv("WG_SNAPSHOT_DIR", "/run/vpn-portal"), "users.stamp"),
+    maxsize=1024, ttl=USER_CACHE_TTL)
+
+# ---- users ----
+SQL_USER_BY_ID = (
+    "SELECT id, username, email, is_active, is_superadmin, mfa_enabled, totp_secret "
+    "FROM users WHERE id=%s"
+)
+SQL_USER_LOGIN = (
+    "SELECT id, username, password_bcrypt, is_active, is_superadmin, mfa_enabled "
+    "FROM users WHERE username=%s"
+)
+SQL_USER_SET_SECRET = "UPDATE users SET totp_secret=%s WHERE id=%s"
+SQL_USER_SET_SECRET_ENABLE = "UPDATE users SET totp_secret=%s, mfa_enabled=1 WHERE id=%s"
+SQL_USER_DISABLE_MFA = "UPDATE users SET mfa_enabled=0, totp_secret=NULL WHERE id=%s"
+SQL_USER_SET_PASSWORD = "UPDATE users SET password_bcrypt=%s WHERE id=%s"
+SQL_USER_LAST_LOGIN = "UPDATE users SET last_login_at=UTC_TIMESTAMP() WHERE id=%s"
+SQL_USER_IDS = "SELECT id FROM users WHERE id IN %s"
+
+# ---- peers ----
+SQL_PEERS_LIST = """
+    SELECT p.id, p.site_id, p.label, p.public_key, p.address_cidr, p.allowed_ips, p.enabled,
+           u.username, s.name AS site_name,
+           (p.config_issued_at IS NULL OR p.config_issued_at < s.updated_at) AS config_stale
+    FROM peers p LEFT JOIN users u ON p.user_id=u.id JOIN sites s ON s.id=p.site_id
+    ORDER BY p.id DESC
+"""
+SQL_PEER_KEY = "SELECT public_key, site_id FROM peers WHERE id=%s"
+# All-placeholder VALUES so executemany() folds rows into one multi-row INSERT.
+SQL_PEER_INSERT = """
+    INSERT INTO peers (site_id, user_id, label, public_key, preshared_key, address_cidr, allowed_ips, dns_servers, persistent_keepalive_s, enabled, private_key_enc)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+SQL_PEER_DELETE = "DELETE FROM peers WHERE id=%s"
+SQL_PEER_IDS_BY_PUBKEY = "SELECT id, public_key FROM peers WHERE public_key IN %s"
+SQL_PEER_KEYS_BY_ID = "SELECT id, public_key, site_id FROM peers WHERE id IN %s"
+SQL_PEER_DELETE_MANY = "DELETE FROM peers WHERE id IN %s"
+_PEER_CONFIG_COLS = (
+    "id, site_id, user_id, label, public_key, preshared_key, private_key_enc, "
+    "address_cidr, dns_servers, persistent_keepalive_s, config_issued_at"
+)
+SQL_PEER_CONFIG = f"SELECT {_PEER_CONFIG_COLS} FROM peers WHERE id=%s"
+SQL_PEERS_CONFIG_BY_SITE = f"SELECT {_PEER_CONFIG_COLS} FROM peers WHERE site_id=%s ORDER BY id"
+# Pin updated_at: issuing a config is not a config change for app.reconcile.
+# CURRENT_TIMESTAMP, not UTC_TIMESTAMP(): config_stale compares against
+# sites.updated_at, which is on the session clock.
+SQL_PEER_CONFIG_ISSUED = (
+    "UPDATE peers SET config_issued_at=CURRENT_TIMESTAMP, updated_at=updated_at WHERE id=%s"
+)
+SQL_SITE_CONFIGS_ISSUED = (
+    "UPDATE peers SET config_issued_at=CURRENT_TIMESTAMP, updated_at=updated_at WHERE site_id=%s"
+)
+
+# ---- sessions ----
+SQL_SESSION_GET = (
+    "SELECT s.id, s.user_id, s.issued_at, s.expires_at, s.last_active_at, "
+    "s.idle_timeout_seconds, s.absolute_timeout_seconds, s.revoked, "
+    "u.username, u.is_superadmin, u.is_active "
+    "FROM sessions s JOIN users u ON u.id=s.user_id WHERE s.id=%s"
+)
+SQL_SESSION_INSERT = (
+    "INSERT INTO sessions (id, user_id, issued_at, expires_at, last_active_at, "
+    "idle_timeout_seconds, absolute_timeout_seconds, ip_address, user_agent) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)"
+)
+SQL_SESSION_REVOKE = "UPDATE sessions SET revoked=1 WHERE id=%s"
+# Run by app.sessions' write-behind flusher on its own pooled connection.
+SQL_SESSION_TOUCH = (
+    "UPDATE sessions SET last_active_at=GREATEST(last_active_at, %s) "
+    "WHERE id=%s AND revoked=0"
+)
+
+
+def _one(sql: str, args: Any = None) -> Optional[dict]:
+    with db.get_conn().cursor() as cur:
+        cur.execute(sql, args)
+        return cur.fetchone()
+
+def _all(sql: str, args: Any = None) -> list[dict]:
+    with db.get_conn().cursor() as cur:
+        cur.execute(sql, args)
+        return list(cur.fetchall())
+
+def _exec(sql: str, args: Any = None) -> int:
+    with db.get_conn().cursor() as cur:
+        cur.execute(sql, args)
+        return cur.lastrowid if sql.lstrip().upper().startswith("INSERT") else cur.rowcount
+
+
+# --------------------
+# users
+# --------------------
+def get_user(uid) -> Optional[dict]:
+    uid = int(uid)
+    memo = g.setdefault("_users", {}) if has_app_context() else {}
+    row = memo.get(uid)
+    if row is None:
+        row = _users.get(uid)
+        if row is None:
+            row = _one(SQL_USER_BY_ID, (uid,))
+            if row is None:
+                return None
+            # Not while this request has an uncommitted user write pending.
+            if not (has_app_context() and g.get("_db_on_commit")):
+                _users.put(uid, row)
+        memo[uid] = row
+    return dict(row)
+
+def invalidate_user(uid=None) -> None:
+    """Drop cached user rows (all workers) after the current write commits."""
+    if has_app_context():
+        memo = g.get("_users")
+        if memo is not None:
+            memo.pop(int(uid), None) if uid is not None else memo.clear()
+    db.on_commit(_users.bump)
+
+def user_cache_stats() -> dict:
+    return _users.stats()
+
+def existing_user_ids(user_ids) -> set:
+    """The subset of user_ids that exist (one query)."""
+    user_ids = tuple(set(user_ids))
+    if not user_ids:
+        return set()
+    return {r["id"] for r in _all(SQL_USER_IDS, (user_ids,))}
+
+def get_user_for_login(username: str) -> Optional[dict]:
+    return _one(SQL_USER_LOGIN, (username,))
+
+def set_totp_secret(uid, secret: str, enable: bool = False) -> None:
+    _exec(SQL_USER_SET_SECRET_ENABLE if enable else SQL_USER_SET_SECRET, (secret, uid))
+    invalidate_user(uid)
+    totp.forget(int(uid))     # drop verifiers of the previous secret
+
+def disable_mfa(uid) -> None:
+    _exec(SQL_USER_DISABLE_MFA, (uid,))
+    invalidate_user(uid)
+    totp.forget(int(uid))
+
+def set_password_hash(uid, password_hash: str) -> None:
+    _exec(SQL_USER_SET_PASSWORD, (password_hash, uid))
+    invalidate_user(uid)
+
+def mark_login(uid) -> None:
+    _exec(SQL_USER_LAST_LOGIN, (uid,))
+
+def is_superadmin(uid) -> bool:
+    row = get_user(uid)
+    return bool(row) and int(row.get("is_superadmin") or 0) == 1
+
+
+# --------------------
+# peers
+# --------------------
+def list_peers() -> list[dict]:
+    return _all(SQL_PEERS_LIST)
+
+def peer_key(peer_id: int) -> Optional[dict]:
+    """{public_key, site_id} or None."""
+    return _one(SQL_PEER_KEY, (peer_id,))
+
+def insert_peer(site_id, user_id, label, public_key, preshared_key, address_cidr,
+                allowed_ips, keepalive, private_key_enc=None) -> int:
+    return _exec(SQL_PEER_INSERT, (site_id, user_id, label, public_key, preshared_key,
+                                   address_cidr, allowed_ips, None, keepalive, 1,
+                                   private_key_enc))
+
+def insert_peers(rows: list[tuple]) -> int:
+    """
+    Multi-row insert; rows are (site_id, user_id, label, public_key,
+    preshared_key, address_cidr, allowed_ips, keepalive[, private_key_enc]).
+    """
+    if not rows:
+        return 0
+    with db.get_conn().cursor() as cur:
+        return cur.executemany(SQL_PEER_INSERT,
+                               [r[:7] + (None, r[7], 1, r[8] if len(r) > 8 else None)
+                                for r in rows])
+
+def peer_ids_by_pubkey(public_keys: list[str]) -> dict:
+    if not public_keys:
+        return {}
+    with db.get_conn().cursor() as cur:
+        cur.execute(SQL_PEER_IDS_BY_PUBKEY, (tuple(public_keys),))
+        return {r["public_key"]: r["id"] for r in cur.fetchall()}
+
+def peer_keys_by_id(peer_ids: list[int]) -> dict:
+    """peer id -> (public_key, site_id)."""
+    if not peer_ids:
+        return {}
+    with db.get_conn().cursor() as cur:
+        cur.execute(SQL_PEER_KEYS_BY_ID, (tuple(peer_ids),))
+        return {r["id"]: (r["public_key"], r["site_id"]) for r in cur.fetchall()}
+
+def delete_peer(peer_id: int) -> None:
+    _exec(SQL_PEER_DELETE, (peer_id,))
+
+def delete_peers(peer_ids: list[int]) -> int:
+    if not peer_ids:
+        return 0
+    with db.get_conn().cursor() as cur:
+        return cur.execute(SQL_PEER_DELETE_MANY, (tuple(peer_ids),))
+
+def peer_for_config(peer_id: int) -> Optional[dict]:
+    return _one(SQL_PEER_CONFIG, (peer_id,))
+
+def iter_site_peer_configs(site_id):
+    """Unbuffered: rows arrive as the zip export consumes them."""
+    with db.get_conn().cursor(pymysql.cursors.SSDictCursor) as cur:
+        cur.execute(SQL_PEERS_CONFIG_BY_SITE, (site_id,))
+        yield from cur
+
+def mark_config_issued(peer_id: int) -> None:
+    _exec(SQL_PEER_CONFIG_ISSUED, (peer_id,))
+
+def mark_site_configs_issued(site_id) -> int:
+    return _exec(SQL_SITE_CONFIGS_ISSUED, (site_id,))
+
+
+# --------------------
+# sites (in-memory registry, app.sites)
+# --------------------
+def default_site() -> Optional[dict]:
+    return sites.default()
+
+def get_site(site_id) -> Optional[dict]:
+    return sites.get(site_id)
+
+
+# --------------------
+# sessions
+# --------------------
+def get_session(sid: str) -> Optional[dict]:
+    return _one(SQL_SESSION_GET, (sid,))
+
+def insert_session(sid, user_id, issued_at, expires_at, idle_s, absolute_s,
+                   ip_address=None, user_agent=None) -> None:
+    _exec(SQL_SESSION_INSERT, (sid, user_id, issued_at, expires_at, issued_at,
+                               idle_s, absolute_s, ip_address, (user_agent or "")[:255] or None))
+
+def revoke_session(sid: str) -> None:
+    _exec(SQL_SESSION_REVOKE, (sid,))
+
+
+def request_stats() -> dict:
+    """Per-request SQL statement count and cumulative time (ms)."""
+    n, secs = db.request_stats()
+    return {"queries": n, "ms": round(secs * 1000.0, 3)}
@@ -0,0 +1,324 @@
+# app/enforcer.py
+# Deadline-driven enforcement for vpn-portal-worker (PROJECT_SCOPE 5 and 8).
+#
+# Instead of scanning every 30 s, upcoming deadlines sit in a heap:
+#   ("session", sid)  idle / absolute expiry of a live `sessions` row
+#   ("schedule",)     the next deny_schedules boundary (app.schedule)
+#   ("tick",)         the periodic reconcile + telemetry pass (safety net)
+# An asyncio loop sleeps until the earliest one and handles it as soon as it
+# passes. Re-arming is lazy: `armed` holds the current deadline per key and
+# heap entries that no longer match it are skipped when popped.
+#
+# Change notifications (app.notify, unix datagram socket) re-read the
+# affected table right away; the tick re-reads everything as a fallback when
+# a notification is lost.
+#
+# Session gating is desired state, like schedules: with ENFORCE_SESSIONS the
+# reconciler only keeps a user's peers on wg while the user has a live
+# portal session (SessionGate; peers without an owner are not gated), and
+# peers.enabled -- the admin's switch -- is never touched. When a session
+# ends -- timeout, logout or revoke -- and it was the user's last one, this
+# loop reconciles right away, so the peers leave wg at the deadline, and a
+# peer_events row records why; the next login (a "sessions" notification)
+# reconciles again and brings them back. Idle
+# deadlines add the same slack app.sessions allows for its write-behind
+# last_active_at, and are re-checked against the row before acting.
+# Sessions that had already expired when the worker started are not acted
+# on (their peers are simply not desired).
+#
+# DB and wg calls are blocking, so they run on one executor thread: the
+# worker's single connection is never used concurrently.
+
+import asyncio, datetime, heapq, itertools, json, logging, os, socket, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import notify
+from .sessions import IDLE_SLACK
+
+log = logging.getLogger(__name__)
+
+ENFORCE_SESSIONS = os.getenv("WORKER_ENFORCE_SESSIONS", "1") == "1"
+
+SQL_LIVE_SESSIONS = (
+    "SELECT id, user_id, issued_at, expires_at, last_active_at, idle_timeout_seconds, "
+    "absolute_timeout_seconds FROM sessions WHERE revoked=0"
+)
+SQL_SESSION_ROW = SQL_LIVE_SESSIONS + " AND id=%s"
+SQL_SESSION_REVOKE = "UPDATE sessions SET revoked=1 WHERE id=%s"
+SQL_GATE_SESSIONS = (
+    "SELECT user_id, issued_at, expires_at, last_active_at, idle_timeout_seconds, "
+    "absolute_timeout_seconds FROM sessions WHERE revoked=0 AND expires_at > UTC_TIMESTAMP()"
+)
+SQL_USER_PEERS_ON = "SELECT id FROM peers WHERE user_id=%s AND enabled=1"
+SQL_EVENT = ("INSERT INTO peer_events (user_id, peer_id, action, details_json) "
+             "VALUES (%s, %s, %s, %s)")
+
+
+def _epoch(dt):
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp() if dt else 0.0
+
+def session_deadline(row):
+    """(when, reason) the session stops being valid, given its row."""
+    issued = _epoch(row["issued_at"])
+    absolute = min(_epoch(row["expires_at"]), issued + int(row["absolute_timeout_seconds"]))
+    idle = _epoch(row["last_active_at"]) + int(row["idle_timeout_seconds"]) + IDLE_SLACK
+    return (idle, "idle") if idle < absolute else (absolute, "absolute")
+
+
+class SessionGate:
+    """Users with a live portal session, for Reconciler(sessions=...)."""
+
+    def __init__(self):
+        self.rows = []
+
+    def refresh(self, conn):
+        with conn.cursor() as cur:
+            cur.execute(SQL_GATE_SESSIONS)
+            self.rows = cur.fetchall()
+
+    def live_users(self, now=None):
+        now = time.time() if now is None else now
+        return {r["user_id"] for r in self.rows if session_deadline(r)[0] > now}
+
+
+class Enforcer:
+    def __init__(self, worker):
+        self.w = worker            # app.worker.Worker: conn(), tick(), reconciler, schedules, sessions
+        self.heap = []
+        self.armed = {}            # key -> deadline currently in force
+        self.sessions = {}         # sid -> user_id, for sessions we are watching
+        self.stream = None         # app.peerstream.PeerStream, told about peer changes
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wake = None
+        self._stop = None
+        self._db = ThreadPoolExecutor(max_workers=1, thread_name_prefix="enforcer-db")
+        self._started = time.time()
+        self.metrics = {"fired": 0, "sessions_ended": 0, "peers_deactivated": 0,
+                        "notifications": 0, "queue": 0, "armed": 0,
+                        "lag_ms_last": 0.0, "lag_ms_max": 0.0}
+
+    # ---- heap (armed from the DB thread, popped on the loop) ----
+    def arm(self, key, when):
+        with self._lock:
+            if self.armed.get(key) == when:
+                return
+            self.armed[key] = when
+            heapq.heappush(self.heap, (when, next(self._seq), key))
+            if len(self.heap) > 4 * len(self.armed) + 64:
+                # Drop superseded entries (idle deadlines move every touch).
+                self.heap = [e for e in self.heap if self.armed.get(e[2]) == e[0]]
+                heapq.heapify(self.heap)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def disarm(self, key):
+        with self._lock:
+            self.armed.pop(key, None)
+
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while self.heap and self.heap[0][0] <= now:
+                when, _, key = heapq.heappop(self.heap)
+                if self.armed.get(key) == when:     # else superseded or disarmed
+                    del self.armed[key]
+                    due.append((when, key))
+        return due
+
+    def _next_deadline(self):
+        with self._lock:
+            return self.heap[0][0] if self.heap else None
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db, fn, *args)
+
+    # ---- sources ----
+    def _load_sessions(self):
+        """Re-read live sessions; returns ([(sid, uid)] that disappeared
+        (logout/revoke), {uid} whose first live session just appeared)."""
+        with self.w.conn().cursor() as cur:
+            cur.execute(SQL_LIVE_SESSIONS)
+            rows = cur.fetchall()
+        live = {}
+        for r in rows:
+            when = session_deadline(r)[0]
+            if when <= self._started:
+                continue         # stale row from before we started: nothing to enforce
+            live[r["id"]] = r["user_id"]
+            self.arm(("session", r["id"]), when)
+        gone = [(sid, uid) for sid, uid in self.sessions.items() if sid not in live]
+        for sid, _ in gone:
+            self.disarm(("session", sid))
+        joined = set(live.values()) - set(self.sessions.values())
+        self.sessions = live
+        return gone, joined
+
+    def _arm_schedule(self):
+        self.w.schedules.refresh(self.w.conn())
+        nb = self.w.schedules.next_boundary()
+        if nb is None:
+            self.disarm(("schedule",))
+        else:
+            self.arm(("schedule",), nb + 1.0)    # +1 s: the new minute has begun
+
+    # ---- actions ----
+    def _end_session(self, sid, uid, reason, revoke):
+        """Revoke/forget the session; True when the user's peers must leave wg now."""
+        conn = self.w.conn()
+        conn.begin()             # revoke + events land together
+        with conn.cursor() as cur:
+            if revoke:
+                cur.execute(SQL_SESSION_REVOKE, (sid,))
+            gone = []
+            gate = self.w.sessions
+            if gate is not None and uid is not None:
+                gate.refresh(conn)          # sees our revoke
+                if uid not in gate.live_users():
+                    cur.execute(SQL_USER_PEERS_ON, (uid,))
+                    gone = [r["id"] for r in cur.fetchall()]
+                    if gone:
+                        cur.executemany(SQL_EVENT, [
+                            (uid, pid, "deactivated",
+                             json.dumps({"reason": f"session_{reason}", "session": sid[:8]}))
+                            for pid in gone])
+        conn.commit()
+        self.sessions.pop(sid, None)
+        self.metrics["sessions_ended"] += 1
+        self.metrics["peers_deactivated"] += len(gone)
+        return bool(gone)
+
+    def _fire_session(self, sid, now):
+        with self.w.conn().cursor() as cur:
+            cur.execute(SQL_SESSION_ROW, (sid,))
+            row = cur.fetchone()
+        if row is None:          # revoked meanwhile: treat like a logout
+            return self._end_session(sid, self.sessions.get(sid), "revoked", revoke=False)
+        when, reason = session_deadline(row)
+        if when > now:           # activity moved the idle deadline: re-arm
+            self.arm(("session", sid), when)
+            return False
+        return self._end_session(sid, row["user_id"], reason, revoke=True)
+
+    def _handle(self, due, now):
+        """Run in the DB thread: act on due keys; reconcile once if needed."""
+        reconcile = False
+        for _, key in due:
+            kind = key[0]
+            try:
+                if kind == "session":
+                    reconcile |= self._fire_session(key[1], now)
+                elif kind == "schedule":
+                    reconcile = True
+                    self._arm_schedule()
+                elif kind == "tick":
+                    for sid, uid in self._load_sessions()[0]:
+                        reconcile |= self._end_session(sid, uid, "revoked", revoke=False)
+                    self._arm_schedule()
+                    self.w.tick()
+                    reconcile = False
+                    self.arm(("tick",), time.time() + self.w.interval)
+            except Exception:
+                log.exception("enforcer: %s failed", kind)
+                self.w._conn = None
+                if kind == "tick":
+                    self.arm(("tick",), time.time() + self.w.interval)
+        if reconcile:
+            self.w.reconciler.tick(self.w.conn(), dry_run=self.w.dry_run)
+
+    def _on_notify(self, topics):
+        reconcile = False
+        if "sessions" in topics:
+            gone, joined = self._load_sessions()
+            for sid, uid in gone:
+                reconcile |= self._end_session(sid, uid, "revoked", revoke=False)
+            # A login: put the user's gated peers back now, not at the next tick.
+            reconcile |= self.w.sessions is not None and bool(joined)
+        if "schedules" in topics:
+            self._arm_schedule()
+            reconcile = True
+        if "peers" in topics and self.stream is not None:
+            self.stream.reload = True
+        if reconcile or "peers" in topics:
+            self.w.reconciler.tick(self.w.conn(), dry_run=self.w.dry_run)
+
+    # ---- loop ----
+    async def _timers(self):
+        while not self._stop.is_set():
+            self._wake.clear()     # before popping: a later arm() wakes us again
+            now = time.time()
+            due = self._pop_due(now)
+            if due:
+                lag = max(now - when for when, _ in due) * 1000.0
+                self.metrics["fired"] += len(due)
+                self.metrics["lag_ms_last"] = round(lag, 3)
+                self.metrics["lag_ms_max"] = round(max(self.metrics["lag_ms_max"], lag), 3)
+                await self._call(self._handle, due, now)
+            self.metrics["queue"] = len(self.heap)
+            self.metrics["armed"] = len(self.armed)
+            nxt = self._next_deadline()
+            timeout = max(0.0, nxt - time.time()) if nxt is not None else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _bind(self):
+        path = notify.WORKER_NOTIFY_SOCK
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        s.bind(path)
+        os.chmod(path, 0o660)
+        s.setblocking(False)
+        return s
+
+    async def _listen(self):
+        try:
+            sock = self._bind()
+        except OSError as e:
+            log.warning("enforcer: no notify socket (%s); polling only", e)
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            while not self._stop.is_set():
+                msg = (await loop.sock_recv(sock, 64)).decode("ascii", "replace")
+                topics = {msg}
+                # Coalesce a burst into one reload.
+                while True:
+                    try:
+                        topics.add(sock.recv(64).decode("ascii", "replace"))
+                    except BlockingIOError:
+                        break
+                self.metrics["notifications"] += len(topics)
+                try:
+                    await self._call(self._on_notify, topics & set(notify.TOPICS))
+                except Exception:
+                    log.exception("enforcer: notification %s failed", sorted(topics))
+                    self.w._conn = None
+        finally:
+            sock.close()
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self.arm(("tick",), time.time())
+        listener = asyncio.create_task(self._listen())
+        try:
+            await self._timers()
+        finally:
+            listener.cancel()
+            self._db.shutdown(wait=True)
+
+    def stop(self, *_):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.metrics, queue=len(self.heap), armed=len(self.armed))
@@ -0,0 +1,232 @@
+# app/ipalloc.py
+# Peer address allocator.
+#
+# Each site's pool is indexed in-process as a bytearray (one byte per address,
+# 1 = taken), so picking a free address is a C-speed bytearray.find() instead
+# of parsing every peers.address_cidr and walking net.hosts(). Pools too large
+# for a dense map (IPv6 /64) fall back to a sparse set with random probing.
+#
+# Consistency with the peers table: allocate() locks the site row
+# (SELECT ... FOR UPDATE), so concurrent allocations for one site serialize on
+# the DB until the caller's transaction ends, then compares a cheap fingerprint
+# of the site's addresses -- (COUNT(*), SUM(CRC32(address_cidr))), answered
+# from the uq_peers_site_addr index -- with the one the cached index was built
+# for. Any insert/delete/edit by another worker changes the fingerprint and
+# forces a rebuild; our own allocation updates it in place. If the caller's
+# transaction rolls back the fingerprint no longer matches and the next call
+# rebuilds, so a rolled-back address is never leaked. In-process locking is
+# per site too: a thread waiting on one site's row lock never holds up
+# allocations for another site.
+#
+# Each site has its own pool: sites.pool_range ("first-last") when set, else
+# derived from the site's wg_interface_ip network. Defaults follow
+# PROJECT_SCOPE 2: addresses are picked at random from host offset
+# WG_POOL_OFFSET (10) up to the last host, i.e. 10.88.0.10-10.88.0.254 on
+# 10.88.0.1/24.
+
+import ipaddress, os, random, socket, threading, zlib
+
+STRATEGY   = os.getenv("WG_ALLOC_STRATEGY", "random").strip().lower()   # random | sequential
+POOL_OFFSET = int(os.getenv("WG_POOL_OFFSET", "10"))  # default range starts at this host offset
+DENSE_MAX  = 1 << 22   # addresses; larger pools use the sparse index
+_RANDOM_PROBES = 8
+
+_rng = random.SystemRandom()
+
+
+class AddressPool:
+    """Allocatable range [first, last] inside `network`, as integers."""
+
+    def __init__(self, network, first, last, reserved=()):
+        self.network = network
+        self.reserved = tuple(int(r) for r in reserved)
+        self.first = int(first)
+        self.last = int(last)
+        if self.last < self.first:
+            raise RuntimeError(f"Empty address pool for {network}")
+        self.size = self.last - self.first + 1
+        self.host_prefix = network.max_prefixlen   # /32 or /128 per peer
+
+    @classmethod
+    def for_interface(cls, wg_interface_ip, range_spec=None):
+        """Pool for an interface address such as '10.88.0.1/24', optionally
+        narrowed to range_spec ("10.88.0.10-10.88.0.254", a site's pool_range)."""
+        iface = ipaddress.ip_interface(wg_interface_ip)
+        net = iface.network
+        if range_spec:
+            lo, _, hi = range_spec.partition("-")
+            first, last = ipaddress.ip_address(lo.strip()), ipaddress.ip_address(hi.strip())
+            if first not in net or last not in net:
+                raise RuntimeError(f"pool range {range_spec} is outside {net}")
+            return cls(net, first, last, reserved=(iface.ip,))
+        # Default: from POOL_OFFSET (never below the gateway + 1) to the last
+        # host; networks too small for the offset start right after the gateway.
+        last = int(net.broadcast_address) - (1 if net.version == 4 and net.prefixlen < 31 else 0)
+        first = max(int(net.network_address) + POOL_OFFSET, int(iface.ip) + 1)
+        if first > last:
+            first = int(iface.ip) + 1
+        return cls(net, first, last, reserved=(iface.ip,))
+
+    def key(self):
+        return (str(self.network), self.first, self.last)
+
+    def cidr(self, ip_int):
+        return f"{ipaddress.ip_address(ip_int)}/{self.host_prefix}"
+
+
+class PoolIndex:
+    """Free/used index over an AddressPool."""
+
+    def __init__(self, pool, used=()):
+        self.pool = pool
+        self.fingerprint = None
+        self.dense = pool.size <= DENSE_MAX
+        if self.dense:
+            self.bits = bytearray(pool.size)
+        else:
+            self.used = set()
+        self.used_count = 0
+        for ip in pool.reserved:
+            self.mark(ip)
+        for ip in used:
+            self.mark(ip)
+
+    def _off(self, ip_int):
+        off = int(ip_int) - self.pool.first
+        return off if 0 <= off < self.pool.size else None
+
+    def mark(self, ip_int):
+        off = self._off(ip_int)
+        if off is None:
+            return
+        if self.dense:
+            if not self.bits[off]:
+                self.bits[off] = 1
+                self.used_count += 1
+        elif off not in self.used:
+            self.used.add(off)
+            self.used_count += 1
+
+    def release(self, ip_int):
+        off = self._off(ip_int)
+        if off is None:
+            return
+        if self.dense:
+            if self.bits[off]:
+                self.bits[off] = 0
+                self.used_count -= 1
+        elif off in self.used:
+            self.used.discard(off)
+            self.used_count -= 1
+
+    @property
+    def free(self):
+        return self.pool.size - self.used_count
+
+    def pick(self, strategy=STRATEGY, rng=_rng):
+        """Reserve and return a free address (int); RuntimeError when full."""
+        if self.free <= 0:
+            raise RuntimeError("No free addresses left in pool")
+        size = self.pool.size
+        if self.dense:
+            bits = self.bits
+            if strategy == "random":
+                for _ in range(_RANDOM_PROBES):
+                    off = rng.randrange(size)
+                    if not bits[off]:
+                        break
+                else:
+                    start = rng.randrange(size)
+                    off = bits.find(0, start)
+                    if off < 0:
+                        off = bits.find(0, 0, start)
+            else:
+                off = bits.find(0)
+        else:
+            used = self.used
+            if strategy == "random":
+                off = rng.randrange(size)
+                while off in used:
+                    off = rng.randrange(size)
+            else:
+                off = (max(used) + 1) if used else 0
+                if off >= size:
+                    off = next(i for i in range(size) if i not in used)
+        ip = self.pool.first + off
+        self.mark(ip)
+        return ip
+
+
+def _parse_ip(address_cidr):
+    # inet_pton is ~20x cheaper than ipaddress.ip_interface on index rebuilds
+    host = address_cidr.partition("/")[0].strip()
+    try:
+        return int.from_bytes(
+            socket.inet_pton(socket.AF_INET6 if ":" in host else socket.AF_INET, host), "big")
+    except (OSError, ValueError):
+        return None
+
+def crc32(address_cidr):
+    # Same polynomial as MariaDB CRC32(), so fingerprints can be updated locally.
+    return zlib.crc32(address_cidr.encode("utf-8"))
+
+
+_indexes = {}      # site_id -> PoolIndex
+_site_locks = {}   # site_id -> Lock
+_index_lock = threading.Lock()   # guards both dicts
+
+def _site_lock(site_id):
+    lock = _site_locks.get(site_id)
+    if lock is None:
+        with _index_lock:
+            lock = _site_locks.setdefault(site_id, threading.Lock())
+    return lock
+
+def _fingerprint(cur, site_id):
+    cur.execute(
+        "SELECT COUNT(*) AS n, COALESCE(SUM(CRC32(address_cidr)), 0) AS s "
+        "FROM peers WHERE site_id=%s",
+        (site_id,),
+    )
+    row = cur.fetchone()
+    return int(row["n"]), int(row["s"])
+
+def _index_for(cur, site_id, pool):
+    fp = _fingerprint(cur, site_id)
+    idx = _indexes.get(site_id)
+    if idx is None or idx.fingerprint != fp or idx.pool.key() != pool.key():
+        cur.execute("SELECT address_cidr FROM peers WHERE site_id=%s", (site_id,))
+        idx = PoolIndex(pool, (ip for ip in (_parse_ip(r["address_cidr"]) for r in cur.fetchall())
+                               if ip is not None))
+        idx.fingerprint = fp
+        _indexes[site_id] = idx
+    return idx
+
+def allocate(conn, site_id, wg_interface_ip, strategy=None, count=1, range_spec=None):
+    """
+    Reserve `count` addresses for a site and return them as CIDR strings.
+    Call inside the transaction that inserts the peers: the site row lock
+    is held until it commits or rolls back.
+    """
+    pool = AddressPool.for_interface(wg_interface_ip, range_spec)
+    with _site_lock(site_id), conn.cursor() as cur:
+        cur.execute("SELECT id FROM sites WHERE id=%s FOR UPDATE", (site_id,))
+        idx = _index_for(cur, site_id, pool)
+        if idx.free < count:
+            raise RuntimeError("No free addresses left in pool")
+        n, s = idx.fingerprint
+        out = []
+        for _ in range(count):
+            cidr = pool.cidr(idx.pick(strategy or STRATEGY))
+            n, s = n + 1, s + crc32(cidr)
+            out.append(cidr)
+        idx.fingerprint = (n, s)
+    return out
+
+def forget(site_id=None):
+    """Drop cached indexes (all sites when site_id is None)."""
+    with _index_lock:
+        if site_id is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(site_id, None)
@@ -0,0 +1,169 @@
+# app/limiter.py
+# Login/MFA attempt limiter and TOTP replay guard shared by all gunicorn
+# workers.
+#
+# State lives in a small SQLite file on tmpfs (LIMITER_DB, default
+# /run/vpn-portal/limiter.sqlite3): WAL mode, no fsync, primary-key lookups
+# only, so every check is O(1) and a few tens of microseconds. A per-process
+# LRU of known lockouts sits in front so a locked-out client hammering /login
+# or /mfa is turned away without touching the file at all. Losing the file
+# on reboot only forgets in-flight counters, which is acceptable.
+#
+# Policy (PROJECT_SCOPE 4): LOCKOUT_THRESHOLD failures per user within
+# LOCKOUT_WINDOW seconds -> locked for LOCKOUT_SECONDS. Per-IP counters use
+# the higher LOCKOUT_IP_THRESHOLD so one NATed office can't lock itself out.
+# Counting uses a two-bucket sliding window (previous bucket weighted by how
+# much of it still overlaps the window).
+
+import os, sqlite3, tempfile, threading, time
+from collections import OrderedDict
+
+LIMITER_DB            = os.getenv("LIMITER_DB", "/run/vpn-portal/limiter.sqlite3")
+LOCKOUT_THRESHOLD     = int(os.getenv("LOCKOUT_THRESHOLD", "5"))
+LOCKOUT_IP_THRESHOLD  = int(os.getenv("LOCKOUT_IP_THRESHOLD", "20"))
+LOCKOUT_WINDOW        = int(os.getenv("LOCKOUT_WINDOW", "900"))
+LOCKOUT_SECONDS       = int(os.getenv("LOCKOUT_SECONDS", "900"))
+_FRONT_MAX = 4096
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    key TEXT PRIMARY KEY,
+    bucket INTEGER NOT NULL,       -- window index (time // LOCKOUT_WINDOW)
+    cur INTEGER NOT NULL,
+    prev INTEGER NOT NULL,
+    locked_until REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS totp_used (
+    user_id INTEGER PRIMARY KEY,
+    counter INTEGER NOT NULL
+);
+"""
+
+_local = threading.local()
+_front = OrderedDict()     # key -> locked_until (only keys known to be locked)
+_front_lock = threading.Lock()
+
+
+def _path():
+    d = os.path.dirname(LIMITER_DB)
+    if d and not os.access(d, os.W_OK):
+        return os.path.join(tempfile.gettempdir(), "vpn-portal-limiter.sqlite3")
+    return LIMITER_DB
+
+def _db():
+    c = getattr(_local, "conn", None)
+    if c is None or getattr(_local, "pid", None) != os.getpid():
+        c = sqlite3.connect(_path(), timeout=2.0, isolation_level=None)
+        c.execute("PRAGMA journal_mode=WAL")
+        c.execute("PRAGMA synchronous=OFF")
+        c.executescript(_SCHEMA)
+        _local.conn, _local.pid = c, os.getpid()
+    return c
+
+
+def user_key(username):
+    return f"user:{(username or '').strip().lower()}"
+
+def ip_key(ip):
+    return f"ip:{ip or '-'}"
+
+def _threshold(key):
+    return LOCKOUT_IP_THRESHOLD if key.startswith("ip:") else LOCKOUT_THRESHOLD
+
+
+def _front_get(key, now):
+    with _front_lock:
+        until = _front.get(key)
+        if until is None:
+            return 0.0
+        if until <= now:
+            del _front[key]
+            return 0.0
+        _front.move_to_end(key)
+        return until
+
+def _front_put(key, until):
+    with _front_lock:
+        _front[key] = until
+        _front.move_to_end(key)
+        while len(_front) > _FRONT_MAX:
+            _front.popitem(last=False)
+
+
+def locked_for(*keys, now=None):
+    """Seconds until every key is unlocked (0 when none is locked)."""
+    now = now or time.time()
+    until = max((_front_get(k, now) for k in keys), default=0.0)
+    if until:
+        return until - now
+    rows = _db().execute(
+        f"SELECT key, locked_until FROM attempts WHERE key IN ({','.join('?' * len(keys))}) "
+        "AND locked_until > ?", (*keys, now)).fetchall()
+    for key, lu in rows:
+        _front_put(key, lu)
+        until = max(until, lu)
+    return max(0.0, until - now)
+
+def fail(*keys, now=None):
+    """Record one failure against each key; returns seconds locked (0 if not)."""
+    now = now or time.time()
+    bucket = int(now // LOCKOUT_WINDOW)
+    frac = (now % LOCKOUT_WINDOW) / LOCKOUT_WINDOW
+    db = _db()
+    locked = 0.0
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for key in keys:
+            row = db.execute("SELECT bucket, cur, prev FROM attempts WHERE key=?", (key,)).fetchone()
+            if row is None:
+                cur, prev = 1, 0
+            elif row[0] == bucket:
+                cur, prev = row[1] + 1, row[2]
+            elif row[0] == bucket - 1:
+                cur, prev = 1, row[1]
+            else:
+                cur, prev = 1, 0
+            until = 0.0
+            if prev * (1.0 - frac) + cur >= _threshold(key):
+                until = now + LOCKOUT_SECONDS
+                cur, prev = 0, 0     # fresh count once the lockout ends
+            db.execute(
+                "INSERT INTO attempts (key, bucket, cur, prev, locked_until) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET bucket=excluded.bucket, cur=excluded.cur, "
+                "prev=excluded.prev, locked_until=MAX(locked_until, excluded.locked_until)",
+                (key, bucket, cur, prev, until))
+            if until:
+                _front_put(key, until)
+                locked = max(locked, until - now)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return locked
+
+def succeed(*keys):
+    """Clear counters (and any expired lock) for keys after a good login."""
+    _db().execute(
+        f"DELETE FROM attempts WHERE key IN ({','.join('?' * len(keys))})", keys)
+    with _front_lock:
+        for k in keys:
+            _front.pop(k, None)
+
+
+def accept_totp_counter(user_id, counter):
+    """
+    Atomically record `counter` as the user's last accepted TOTP step.
+    False if this step (or a later one) was already used -- a replay.
+    """
+    db = _db()
+    db.execute(
+        "INSERT INTO totp_used (user_id, counter) VALUES (?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET counter=excluded.counter "
+        "WHERE excluded.counter > totp_used.counter",
+        (int(user_id), int(counter)))
+    return db.execute("SELECT changes()").fetchone()[0] == 1
+
+
+def client_ip(request):
+    # nginx -> unix socket: the peer address is empty; nginx sets X-Real-IP.
+    return request.headers.get("X-Real-IP") or request.remote_addr or "-"
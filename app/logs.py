@@ -0,0 +1,283 @@
+# app/logs.py
+# Log retention, filtered listing and CSV export for audit_log, login_events
+# and peer_events (PROJECT_SCOPE 7 and 9: 90-day retention, filters, CSV export).
+#
+# Retention is a chunked keyset delete rather than one big DELETE: each round
+# selects up to PURGE_CHUNK ids past the last one deleted (a primary-key range,
+# so purged rows are never rescanned), deletes them and commits. Locks are held
+# for milliseconds and no multi-million-row transaction builds up undo. Range
+# partitioning would turn the purge into DROP PARTITION, but InnoDB cannot
+# partition tables with foreign keys and audit_log/login_events reference users.
+#
+# Listing is keyset-paginated on (created_at, id) descending, served by the
+# composite (filter column, created_at) indexes in
+# db/migrations/002_log_indexes.sql, so page 500 costs what page 1 does. The
+# CSV export reads through an unbuffered cursor and yields ~64 KiB chunks.
+#
+#   python -m app.logs purge [--days 90] [--dry-run]
+
+import csv, datetime, io, logging, os, sys, time
+
+import pymysql
+from flask import Blueprint, Response, abort, g, jsonify, request, stream_with_context
+
+from . import db
+
+log = logging.getLogger(__name__)
+
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "90"))
+LOG_PAGE_SIZE = int(os.getenv("LOG_PAGE_SIZE", "100"))
+PURGE_CHUNK = int(os.getenv("LOG_PURGE_CHUNK", "5000"))
+PURGE_PAUSE = float(os.getenv("LOG_PURGE_PAUSE", "0.05"))     # s between chunks
+CSV_CHUNK = 64 * 1024
+
+
+def _int(v):
+    return int(v)
+
+def _bool(v):
+    v = str(v).strip().lower()
+    if v in ("1", "true", "yes", "ok"):
+        return 1
+    if v in ("0", "false", "no", "fail"):
+        return 0
+    raise ValueError(f"bad boolean {v!r}")
+
+def _str(v):
+    return str(v)[:255]
+
+# Per table: exported columns, equality filters (query arg -> (SQL, converter))
+# and the columns `q` searches. since/until/q apply to every table.
+TABLES = {
+    "audit_log": {
+        "columns": ("id", "created_at", "user_id", "action", "target_type", "target_id",
+                    "ip_address", "user_agent", "details_json"),
+        "filters": {"user_id": ("user_id = %s", _int), "action": ("action = %s", _str),
+                    "target_type": ("target_type = %s", _str),
+                    "target_id": ("target_id = %s", _int), "ip": ("ip_address = %s", _str)},
+        "search": ("action", "details_json"),
+    },
+    "login_events": {
+        "columns": ("id", "created_at", "user_id", "username_attempted", "success", "reason",
+                    "ip_address", "user_agent"),
+        "filters": {"user_id": ("user_id = %s", _int),
+                    "username": ("username_attempted = %s", _str),
+                    "success": ("success = %s", _bool), "reason": ("reason = %s", _str),
+                    "ip": ("ip_address = %s", _str)},
+        "search": ("username_attempted", "reason"),
+    },
+    "peer_events": {
+        "columns": ("id", "created_at", "user_id", "peer_id", "action", "details_json"),
+        "filters": {"user_id": ("user_id = %s", _int), "peer_id": ("peer_id = %s", _int),
+                    "action": ("action = %s", _str)},
+        "search": ("action", "details_json"),
+    },
+}
+
+
+# ---- query building ----
+def _ts(v):
+    if isinstance(v, datetime.datetime):
+        return v
+    v = str(v).strip()
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(v, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"bad timestamp {v!r}")
+
+def encode_cursor(row) -> str:
+    return f"{row['created_at']:%Y%m%d%H%M%S}.{row['id']}"
+
+def decode_cursor(cursor: str):
+    ts, _, rid = str(cursor).partition(".")
+    return datetime.datetime.strptime(ts, "%Y%m%d%H%M%S"), int(rid)
+
+def _like(q):
+    return "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def build(table, filters, cursor=None, limit=None):
+    """(sql, args) for `table` filtered by `filters`, newest first.
+
+    Raises KeyError for an unknown table and ValueError for a bad filter.
+    """
+    spec = TABLES[table]
+    where, args = [], []
+    for name, value in (filters or {}).items():
+        if value is None or value == "":
+            continue
+        if name == "since":
+            where.append("created_at >= %s")
+            args.append(_ts(value))
+        elif name == "until":
+            where.append("created_at < %s")
+            args.append(_ts(value))
+        elif name == "q":
+            # Substring search can't use an index; pair it with a time range.
+            where.append("(" + " OR ".join(f"{c} LIKE %s" for c in spec["search"]) + ")")
+            args.extend([_like(str(value))] * len(spec["search"]))
+        elif name in spec["filters"]:
+            clause, conv = spec["filters"][name]
+            where.append(clause)
+            args.append(conv(value))
+        else:
+            raise ValueError(f"unknown filter {name!r}")
+    if cursor:
+        ts, rid = decode_cursor(cursor)
+        # Written as a range on created_at plus a residual test so the
+        # (…, created_at) index range still applies.
+        where.append("created_at <= %s AND (created_at < %s OR id < %s)")
+        args.extend([ts, ts, rid])
+    sql = f"SELECT {', '.join(spec['columns'])} FROM {table}"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT %s"
+        args.append(int(limit))
+    return sql, args
+
+
+# ---- listing / export ----
+def page(table, filters, cursor=None, limit=LOG_PAGE_SIZE):
+    """One page of rows and the cursor for the next one (None at the end)."""
+    limit = max(1, min(int(limit), 1000))
+    sql, args = build(table, filters, cursor, limit + 1)
+    with db.get_conn().cursor() as cur:
+        cur.execute(sql, args)
+        rows = cur.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (encode_cursor(rows[-1]) if more else None)
+
+def _cell(v):
+    if v is None:
+        return ""
+    if isinstance(v, str) and v[:1] in ("=", "+", "-", "@", "\t", "\r"):
+        return "'" + v       # keep spreadsheets from evaluating attacker text
+    return v
+
+def iter_csv(table, filters, conn=None):
+    """CSV bytes for every matching row, streamed in CSV_CHUNK pieces."""
+    sql, args = build(table, filters)
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(TABLES[table]["columns"])
+    conn = conn or db.get_conn()
+    with conn.cursor(pymysql.cursors.SSCursor) as cur:
+        cur.execute(sql, args)
+        for row in cur:
+            w.writerow([_cell(v) for v in row])
+            if buf.tell() >= CSV_CHUNK:
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+# ---- retention ----
+SQL_PURGE_HEAD = "SELECT id FROM {t} WHERE created_at < %s ORDER BY created_at DESC, id DESC LIMIT 1"
+SQL_PURGE_IDS = ("SELECT id FROM {t} WHERE id > %s AND id <= %s AND created_at < %s "
+                 "ORDER BY id LIMIT %s")
+SQL_PURGE_DELETE = "DELETE FROM {t} WHERE id IN %s"
+
+def purge(conn, days=LOG_RETENTION_DAYS, chunk=PURGE_CHUNK, pause=PURGE_PAUSE,
+          dry_run=False, now=None) -> dict:
+    """Delete rows older than `days` from every log table; {table: rows}.
+
+    `conn` should be autocommit (each chunk commits on its own). Rows
+    whose id is past the newest expired id (batched writes can land slightly
+    out of order) are left for the next run.
+    """
+    cutoff = (now or datetime.datetime.now()).replace(microsecond=0) - datetime.timedelta(days=days)
+    out = {}
+    for table in TABLES:
+        with conn.cursor() as cur:
+            cur.execute(SQL_PURGE_HEAD.format(t=table), (cutoff,))
+            head = cur.fetchone()
+        deleted, last = 0, 0
+        t0 = time.perf_counter()
+        while head is not None:
+            with conn.cursor() as cur:
+                cur.execute(SQL_PURGE_IDS.format(t=table), (last, head["id"], cutoff, chunk))
+                ids = [r["id"] for r in cur.fetchall()]
+                if not ids:
+                    break
+                if not dry_run:
+                    cur.execute(SQL_PURGE_DELETE.format(t=table), (tuple(ids),))
+            deleted += len(ids)
+            last = ids[-1]
+            if len(ids) < chunk:
+                break
+            if pause:
+                time.sleep(pause)    # let replication and purge threads catch up
+        out[table] = deleted
+        if deleted:
+            log.info("logs: %s %d rows older than %s from %s in %.1f s",
+                     "would delete" if dry_run else "deleted", deleted, cutoff, table,
+                     time.perf_counter() - t0)
+    return out
+
+
+# ---- admin routes ----
+bp = Blueprint("logs", __name__, url_prefix="/logs")
+
+def _require_superadmin():
+    # Same check as app.wg_admin: the role comes with the cached session row.
+    if not getattr(g, "session", None) or not int(g.session.get("is_superadmin") or 0):
+        abort(403)
+
+def _filters():
+    return {k: v for k, v in request.args.items() if k not in ("cursor", "limit")}
+
+@bp.get("/<table>")
+def list_logs(table):
+    _require_superadmin()
+    if table not in TABLES:
+        abort(404)
+    try:
+        rows, nxt = page(table, _filters(), request.args.get("cursor"),
+                         request.args.get("limit", LOG_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(rows=rows, next=nxt)
+
+@bp.get("/<table>/export.csv")
+def export_logs(table):
+    _require_superadmin()
+    if table not in TABLES:
+        abort(404)
+    filters = _filters()
+    try:
+        build(table, filters)        # reject bad filters before streaming starts
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return Response(stream_with_context(iter_csv(table, filters)), mimetype="text/csv", headers={
+        "Content-Disposition": f'attachment; filename="{table}.csv"',
+        "Cache-Control": "no-store",
+    })
+
+
+def _main(argv=None):
+    import argparse
+
+    ap = argparse.ArgumentParser(prog="python -m app.logs")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("purge", help="delete log rows past the retention period")
+    p.add_argument("--days", type=int, default=LOG_RETENTION_DAYS)
+    p.add_argument("--chunk", type=int, default=PURGE_CHUNK)
+    p.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    conn = db.connect(autocommit=True)
+    try:
+        out = purge(conn, days=args.days, chunk=args.chunk, dry_run=args.dry_run)
+    finally:
+        conn.close()
+    print(" ".join(f"{t}={n}" for t, n in out.items()), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    _main()
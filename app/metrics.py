@@ -0,0 +1,294 @@
+# app/metrics.py
+# In-process metrics with a Prometheus text endpoint at /metrics.
+#
+# Recording is a dict update under an uncontended lock (~1 us per request,
+# see bench/bench_metrics.py); nothing leaves the process on the hot path.
+# Each process (gunicorn workers and vpn-portal-worker) writes its numbers
+# to METRICS_DIR/<pid>.json every METRICS_FLUSH_SECONDS and at exit, and
+# /metrics merges every file, so whichever worker answers reports them all.
+# Counters and histograms of processes that have exited are folded into
+# dead.json (gunicorn recycles workers; totals must not go backwards); their
+# gauges are dropped.
+#
+# Series:
+#   vpnportal_http_requests_total{endpoint,method,status}
+#   vpnportal_http_request_duration_seconds{endpoint}        histogram
+#   vpnportal_db_queries_total{endpoint} / _db_seconds_total{endpoint}
+#                                   (app.db.TimedCursor's per-request tally)
+#   vpnportal_wg_calls_total{cmd,ok} / _wg_call_duration_seconds{cmd}
+#   vpnportal_totp_verify_duration_seconds                  histogram
+#   vpnportal_worker_info{pid,role} plus per-pid gauges (pool, queues)
+#
+# /metrics answers a request carrying "Authorization: Bearer METRICS_TOKEN"
+# or, without a token, a direct TCP peer in METRICS_ALLOW. Client headers
+# (X-Real-IP) are never trusted, and requests relayed by nginx over the
+# gunicorn unix socket have no peer address, so there a token is required.
+
+import atexit, bisect, fcntl, glob, hmac, json, logging, os, threading, time
+
+log = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv("METRICS_DIR", "/run/vpn-portal/metrics")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+METRICS_ALLOW = {a.strip() for a in os.getenv("METRICS_ALLOW", "127.0.0.1,::1").split(",") if a.strip()}
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+PREFIX = "vpnportal_"
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}      # (name, labels) -> value; labels is a tuple of (key, value)
+_hists = {}         # (name, labels) -> [bucket counts..., +Inf count, sum]
+_gauges = {}        # name -> fn() -> number, evaluated at flush
+_role = "web"
+_started = time.time()
+_flusher = None     # (pid, thread)
+
+
+# ---- recording ----
+def inc(name, labels=(), value=1):
+    key = (name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+    _ensure_flusher()
+
+def observe(name, labels, seconds):
+    i = bisect.bisect_left(BUCKETS, seconds)
+    key = (name, labels)
+    with _lock:
+        h = _hists.get(key)
+        if h is None:
+            h = _hists[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        h[i] += 1
+        h[-1] += seconds
+    _ensure_flusher()
+
+def record_request(endpoint, method, status, seconds, queries=0, db_seconds=0.0):
+    """Everything the after_request hook records, in one lock hold."""
+    i = bisect.bisect_left(BUCKETS, seconds)
+    ep = (("endpoint", endpoint),)
+    rkey = ("http_requests_total", (("endpoint", endpoint), ("method", method), ("status", status)))
+    hkey = ("http_request_duration_seconds", ep)
+    with _lock:
+        _counters[rkey] = _counters.get(rkey, 0) + 1
+        h = _hists.get(hkey)
+        if h is None:
+            h = _hists[hkey] = [0] * (len(BUCKETS) + 1) + [0.0]
+        h[i] += 1
+        h[-1] += seconds
+        if queries:
+            q, s = ("db_queries_total", ep), ("db_seconds_total", ep)
+            _counters[q] = _counters.get(q, 0) + queries
+            _counters[s] = _counters.get(s, 0.0) + db_seconds
+    _ensure_flusher()
+
+def gauge(name, fn):
+    """Report fn() as a per-process gauge (called at flush, not per request)."""
+    _gauges[name] = fn
+
+def set_role(role):
+    global _role
+    _role = role
+
+
+# ---- per-process files ----
+def _path(pid=None):
+    return os.path.join(METRICS_DIR, f"{pid or os.getpid()}.json")
+
+def _snapshot():
+    with _lock:
+        counters = [[n, list(map(list, l)), v] for (n, l), v in _counters.items()]
+        hists = [[n, list(map(list, l)), list(h)] for (n, l), h in _hists.items()]
+    gauges = {}
+    for name, fn in list(_gauges.items()):
+        try:
+            gauges[name] = float(fn())
+        except Exception:
+            pass
+    return {"pid": os.getpid(), "role": _role, "started": _started,
+            "counters": counters, "hists": hists, "gauges": gauges}
+
+def flush():
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        tmp = _path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(_snapshot(), f, separators=(",", ":"))
+        os.replace(tmp, _path())
+    except OSError as e:
+        log.debug("metrics: cannot write %s: %s", METRICS_DIR, e)
+
+def _ensure_flusher():
+    global _flusher
+    pid = os.getpid()
+    if _flusher is not None and _flusher[0] == pid:
+        return
+    with _lock:
+        if _flusher is None or _flusher[0] != pid:
+            t = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+            _flusher = (pid, t)
+            t.start()
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush()
+
+atexit.register(flush)
+
+
+# ---- aggregation ----
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def _merge(into, snap):
+    for name, labels, v in snap.get("counters", ()):
+        key = (name, tuple(map(tuple, labels)))
+        into["counters"][key] = into["counters"].get(key, 0) + v
+    for name, labels, h in snap.get("hists", ()):
+        key = (name, tuple(map(tuple, labels)))
+        cur = into["hists"].get(key)
+        into["hists"][key] = list(h) if cur is None else [a + b for a, b in zip(cur, h)]
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _reap(dead_paths):
+    # Fold exited processes into dead.json under a lock; each file once.
+    lock_path = os.path.join(METRICS_DIR, "dead.lock")
+    with open(lock_path, "a") as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
+        dead_file = os.path.join(METRICS_DIR, "dead.json")
+        acc = {"counters": {}, "hists": {}}
+        _merge(acc, _load(dead_file) or {})
+        merged = False
+        for p in dead_paths:
+            snap = _load(p)
+            if snap is not None:
+                _merge(acc, snap)
+                merged = True
+        if merged:
+            out = {"counters": [[n, list(map(list, l)), v] for (n, l), v in acc["counters"].items()],
+                   "hists": [[n, list(map(list, l)), h] for (n, l), h in acc["hists"].items()]}
+            tmp = dead_file + f".{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(out, f, separators=(",", ":"))
+            os.replace(tmp, dead_file)
+        for p in dead_paths:
+            try:
+                os.unlink(p)
+            except OSError:
+                pass
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+def render() -> str:
+    """Prometheus text format for every process that has written a file."""
+    flush()
+    live, dead = [], []
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        base = os.path.basename(path)[:-5]
+        if not base.isdigit():
+            continue
+        (live if _alive(int(base)) else dead).append(path)
+    if dead:
+        try:
+            _reap(dead)
+        except OSError as e:
+            log.debug("metrics: reap failed: %s", e)
+
+    acc = {"counters": {}, "hists": {}}
+    _merge(acc, _load(os.path.join(METRICS_DIR, "dead.json")) or {})
+    procs = []
+    for path in live:
+        snap = _load(path)
+        if snap is not None:
+            _merge(acc, snap)
+            procs.append(snap)
+    if not any(s["pid"] == os.getpid() for s in procs):
+        snap = _snapshot()                 # METRICS_DIR unwritable: at least report ourselves
+        _merge(acc, snap)
+        procs.append(snap)
+
+    out = []
+    typed = set()
+    def head(name, kind):
+        if name not in typed:
+            typed.add(name)
+            out.append(f"# TYPE {PREFIX}{name} {kind}")
+    for (name, labels), v in sorted(acc["counters"].items()):
+        head(name, "counter")
+        out.append(f"{PREFIX}{name}{_fmt_labels(labels)} {v:g}")
+    for (name, labels), h in sorted(acc["hists"].items()):
+        head(name, "histogram")
+        cum = 0
+        for le, n in zip(BUCKETS, h):
+            cum += n
+            out.append(f"{PREFIX}{name}_bucket{_fmt_labels(labels, [('le', f'{le:g}')])} {cum}")
+        cum += h[len(BUCKETS)]
+        out.append(f"{PREFIX}{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {cum}")
+        out.append(f"{PREFIX}{name}_sum{_fmt_labels(labels)} {h[-1]:.6f}")
+        out.append(f"{PREFIX}{name}_count{_fmt_labels(labels)} {cum}")
+    head("worker_info", "gauge")
+    for s in sorted(procs, key=lambda s: s["pid"]):
+        out.append(f'{PREFIX}worker_info{{pid="{s["pid"]}",role="{s["role"]}"}} 1')
+    for s in sorted(procs, key=lambda s: s["pid"]):
+        for name, v in sorted(s.get("gauges", {}).items()):
+            head(name, "gauge")
+            out.append(f'{PREFIX}{name}{{pid="{s["pid"]}"}} {v:g}')
+        head("worker_start_time_seconds", "gauge")
+        out.append(f'{PREFIX}worker_start_time_seconds{{pid="{s["pid"]}"}} {s["started"]:.0f}')
+    return "\n".join(out) + "\n"
+
+
+# ---- Flask wiring ----
+def init_app(app):
+    from flask import Response, abort, g, request
+    from . import db
+
+    def _start():
+        g._t0 = time.perf_counter()
+
+    def _finish(response):
+        t0 = g.get("_t0")
+        if t0 is not None:
+            n, secs = db.request_stats()
+            record_request(request.endpoint or "unmatched", request.method,
+                           response.status_code, time.perf_counter() - t0, n, secs)
+        return response
+
+    def metrics_view():
+        auth = request.headers.get("Authorization", "")
+        if METRICS_TOKEN and auth.startswith("Bearer "):
+            ok = hmac.compare_digest(auth[7:].strip().encode(), METRICS_TOKEN.encode())
+        else:
+            ok = bool(request.remote_addr) and request.remote_addr in METRICS_ALLOW
+        if not ok:
+            abort(404)
+        return Response(render(), mimetype="text/plain; version=0.0.4")
+
+    # Registered before the DB hooks so the timing includes the commit.
+    app.before_request(_start)
+    app.after_request(_finish)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+
+    from . import audit, pwhash
+    gauge("db_pool_in_use", lambda: db.pool_stats()["in_use"])
+    gauge("db_pool_open", lambda: db.pool_stats()["open"])
+    gauge("pwhash_pending", lambda: pwhash.stats()["pending"])
+    gauge("audit_queued", lambda: audit.stats()["queued"])
@@ -1,114 +1,46 @@
 # app/mfa.py
-from flask import Blueprint, render_template, request, redirect, url_for, session, abort, send_file, Response
-from io import BytesIO
 import time
 
-from .totp import generate_base32_secret, verify_totp, build_otpauth_uri
-from . import db as db  # import module; we add the same fallback as auth.py
+from flask import Blueprint, render_template, request, redirect, url_for, session, abort, Response, g
 
-# --- Fallback connector (DATABASE_URL -> PyMySQL) ---
-import os
-from urllib.parse import urlparse, unquote
-import pymysql
-from pymysql.cursors import DictCursor
+from .totp import generate_base32_secret, get_verifier, build_otpauth_uri
+from . import audit, data, limiter, metrics, qr, sessions
 
 bp = Blueprint("mfa", __name__)
 
-# Simple per-session attempt throttling
-MAX_ATTEMPTS_WINDOW = 5   # attempts
-WINDOW_SECONDS = 300      # 5 minutes
-
-def _conn():
-    # Try project-provided helpers first
-    if hasattr(db, "get_db"):
-        return db.get_db()
-    if hasattr(db, "connect"):
-        return db.connect()
-    if hasattr(db, "connect_db"):
-        return db.connect_db()
-    if hasattr(db, "db") and callable(getattr(db, "db")):
-        return db.db()
-    if hasattr(db, "connection"):
-        return getattr(db, "connection")
-
-    # Fallback via env
-    dsn = os.getenv("DATABASE_URL", "").strip()
-    if not dsn:
-        raise RuntimeError(
-            "No database connector found in app.db and DATABASE_URL is not set."
-        )
-    u = urlparse(dsn)
-    if u.scheme not in ("mysql", "mysql+pymysql"):
-        raise RuntimeError(f"Unsupported DATABASE_URL scheme: {u.scheme}")
-
-    user = unquote(u.username or "")
-    pwd = unquote(u.password or "")
-    host = u.hostname or "localhost"
-    port = u.port or 3306
-    dbname = (u.path or "/").lstrip("/") or None
-
-    return pymysql.connect(
-        host=host,
-        port=port,
-        user=user,
-        password=pwd,
-        database=dbname,
-        charset="utf8mb4",
-        cursorclass=DictCursor,
-        autocommit=False,
-    )
-
-def _rate_check():
-    now = int(time.time())
-    bucket = session.get("mfa_attempt_bucket", {"t": now, "n": 0})
-    if now - bucket.get("t", now) > WINDOW_SECONDS:
-        bucket = {"t": now, "n": 0}
-    bucket["n"] = int(bucket.get("n", 0)) + 1
-    session["mfa_attempt_bucket"] = bucket
-    session.modified = True
-    return bucket["n"] <= MAX_ATTEMPTS_WINDOW
+# Attempt throttling is server-side (app.limiter): failures count per user and
+# per client IP across all workers, so dropping the session cookie no longer
+# resets it.
+def _limit_keys(user):
+    return limiter.user_key(user["username"]), limiter.ip_key(limiter.client_ip(request))
+
+def _match_code(uid, secret, code):
+    """Accepted time-step counter, or None (bad code or undecodable secret)."""
+    t0 = time.perf_counter()
+    try:
+        return get_verifier(secret, window=1, user_id=uid).match(code)  # tolerate +/-1 step drift
+    except (ValueError, TypeError):
+        return None
+    finally:
+        metrics.observe("totp_verify_duration_seconds", (), time.perf_counter() - t0)
 
 def _require_pending_login():
     return "pending_user_id" in session
 
 def _fetch_user(uid):
-    conn = _conn()
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT id, username, email, mfa_enabled, totp_secret "
-            "FROM users WHERE id=%s",
-            (uid,),
-        )
-        row = cur.fetchone()
-    return row
+    return data.get_user(uid)
 
 def _update_user_secret(uid, secret, enable=False):
-    conn = _conn()
-    with conn.cursor() as cur:
-        if enable:
-            cur.execute(
-                "UPDATE users SET totp_secret=%s, mfa_enabled=1 WHERE id=%s",
-                (secret, uid),
-            )
-        else:
-            cur.execute(
-                "UPDATE users SET totp_secret=%s WHERE id=%s",
-                (secret, uid),
-            )
-    conn.commit()
+    data.set_totp_secret(uid, secret, enable=enable)
 
 def _disable_mfa(uid):
-    conn = _conn()
-    with conn.cursor() as cur:
-        cur.execute(
-            "UPDATE users SET mfa_enabled=0, totp_secret=NULL WHERE id=%s",
-            (uid,),
-        )
-    conn.commit()
+    data.disable_mfa(uid)
 
 def _finalize_login(uid):
-    session["user_id"] = uid
     session.pop("pending_user_id", None)
+    session["user_id"] = uid
+    sessions.start(uid)
+    data.mark_login(uid)
     return redirect(url_for("web.home"))
 
 @bp.route("/mfa", methods=["GET", "POST"])
@@ -138,7 +70,9 @@ def mfa():
                                    username=user["username"], secret=secret, otpauth_uri=otpauth_uri)
 
     # POST: verify code for setup or verify
-    if not _rate_check():
+    keys = _limit_keys(user)
+    if limiter.locked_for(*keys):
+        audit.login_event(user["username"], False, user_id=uid, reason="mfa_locked")
         return render_template("mfa_verify.html", title="CITS VPN Portal — MFA",
                                username=user["username"],
                                error="Too many attempts. Please wait a few minutes and try again."), 429
@@ -157,8 +91,13 @@ def mfa():
         secret = generate_base32_secret()
         _update_user_secret(uid, secret, enable=False)
 
-    ok = verify_totp(secret, code, window=1)  # tolerate +/-1 step drift
-    if not ok:
+    # A code is single-use: its counter must be newer than the last accepted
+    # one for this user, or it's a replay and counts as a failure.
+    counter = _match_code(uid, secret, code)
+    if counter is None or not limiter.accept_totp_counter(uid, counter):
+        limiter.fail(*keys)
+        audit.login_event(user["username"], False, user_id=uid,
+                          reason="mfa_bad_code" if counter is None else "mfa_replay")
         if user["mfa_enabled"]:
             return render_template("mfa_verify.html", title="CITS VPN Portal — MFA",
                                    username=user["username"], error="Invalid code."), 401
@@ -169,10 +108,12 @@ def mfa():
     if not user["mfa_enabled"]:
         _update_user_secret(uid, secret, enable=True)
 
+    limiter.succeed(keys[0])
+    audit.login_event(user["username"], True, user_id=uid,
+                      reason="mfa_ok" if user["mfa_enabled"] else "mfa_enrolled")
     return _finalize_login(uid)
 
-@bp.route("/mfa/qr.png")
-def mfa_qr_png():
+def _qr(fmt):
     if not _require_pending_login():
         return redirect(url_for("auth.login"))
     uid = session["pending_user_id"]
@@ -188,19 +129,24 @@ def mfa_qr_png():
     uri = build_otpauth_uri(secret, account_label, issuer)
 
     try:
-        import qrcode  # optional dependency
-        img = qrcode.make(uri)
-        buf = BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        return send_file(buf, mimetype="image/png", max_age=0)
-    except Exception:
+        return qr.response(uri, fmt)
+    except qr.QRUnavailable:
         # Fallback: return otpauth:// URI as plain text (mobile copy/tap)
         return Response(uri, mimetype="text/plain")
 
+@bp.route("/mfa/qr.png")
+def mfa_qr_png():
+    return _qr("png")
+
+@bp.route("/mfa/qr.svg")
+def mfa_qr_svg():
+    return _qr("svg")
+
 @bp.route("/mfa/disable", methods=["POST"])
 def mfa_disable():
-    current_uid = session.get("user_id")
+    if not g.session:
+        return redirect(url_for("auth.login"))
+    current_uid = g.session["user_id"]
     if not current_uid:
         return redirect(url_for("auth.login"))
 
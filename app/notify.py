@@ -0,0 +1,38 @@
+# app/notify.py
+# Change notifications from the web workers to vpn-portal-worker.
+#
+# MariaDB has no LISTEN/NOTIFY, so the worker binds a unix datagram socket
+# (WORKER_NOTIFY_SOCK) and the web app sends a one-word topic to it once a
+# write has committed ("sessions", "peers", "schedules"). Delivery is best
+# effort: if the worker is down or the socket is full the message is dropped
+# and the worker's periodic poll picks the change up instead.
+
+import os, socket, threading
+
+from . import db
+
+WORKER_NOTIFY_SOCK = os.getenv("WORKER_NOTIFY_SOCK", "/run/vpn-portal/worker.sock")
+TOPICS = ("sessions", "peers", "schedules")
+
+_local = threading.local()
+
+
+def _sock():
+    s = getattr(_local, "sock", None)
+    if s is None or getattr(_local, "pid", None) != os.getpid():
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        s.setblocking(False)
+        _local.sock, _local.pid = s, os.getpid()
+    return s
+
+def send(topic: str) -> bool:
+    """Send now; False if nobody is listening."""
+    try:
+        _sock().sendto(topic.encode("ascii"), WORKER_NOTIFY_SOCK)
+        return True
+    except OSError:
+        return False
+
+def after_commit(topic: str) -> None:
+    """Send once the current request's transaction has committed."""
+    db.on_commit(lambda: send(topic))
@@ -0,0 +1,278 @@
+# app/peerstream.py
+# Live peer status over Server-Sent Events, replacing 5 s page polling.
+#
+# The stream is served by vpn-portal-worker's asyncio loop, not by gunicorn:
+# an open browser tab is one socket in the worker's event loop rather than a
+# pinned gthread. nginx routes the stream path to LIVE_SOCK:
+#
+#   location /live/stream {
+#       proxy_pass http://unix:/run/vpn-portal/live.sock;
+#       proxy_buffering off; proxy_read_timeout 1h;
+#   }
+#
+# The Flask app authenticates the browser and hands out a short-lived HMAC
+# token (web.live_token) carrying user id and role. The stream server checks
+# it without touching the DB, and closes the stream after LIVE_MAX_SECONDS so a
+# logout or revoke takes effect; the page then asks for a fresh token.
+#
+# One sampler task reads the shared wg snapshot (app.wg_live, so no extra
+# `wg show` beyond its TTL) every LIVE_INTERVAL while anybody is connected,
+# diffs it per peer and publishes only what changed: handshake time, rx/tx
+# and online/offline. Superadmins get every peer; users get their own
+# (one serialisation per audience, not per client). Each client has a
+# bounded queue; a client that falls behind has its backlog dropped and is
+# sent a full snapshot instead once it catches up, and one that stops
+# reading for LIVE_SEND_TIMEOUT is disconnected.
+
+import asyncio, base64, hashlib, hmac, json, logging, os, time, urllib.parse
+
+from . import sites, wg, wg_live
+
+log = logging.getLogger(__name__)
+
+LIVE_SOCK = os.getenv("LIVE_SOCK", "/run/vpn-portal/live.sock")
+LIVE_PATH = "/live/stream"
+LIVE_INTERVAL = float(os.getenv("LIVE_INTERVAL", "5"))
+LIVE_QUEUE = int(os.getenv("LIVE_QUEUE", "8"))              # events per client
+LIVE_MAX_SECONDS = int(os.getenv("LIVE_MAX_SECONDS", "300"))
+LIVE_SEND_TIMEOUT = float(os.getenv("LIVE_SEND_TIMEOUT", "15"))
+LIVE_HEARTBEAT = 20.0
+TOKEN_TTL = 60                                              # to connect, not to stay
+
+SQL_PEER_OWNERS = "SELECT id, user_id, public_key FROM peers"
+
+
+# ---- tokens (issued by the web app, checked by the stream server) ----
+def _key():
+    master = os.getenv("SECRET_KEY", "change-me-in-prod").encode()
+    return hmac.new(master, b"peerstream-token", hashlib.sha256).digest()
+
+def _b64(b):
+    return base64.urlsafe_b64encode(b).rstrip(b"=").decode("ascii")
+
+def issue_token(user_id, is_superadmin, now=None) -> str:
+    now = int(now or time.time())
+    body = _b64(json.dumps([int(user_id), int(bool(is_superadmin)), now + TOKEN_TTL],
+                           separators=(",", ":")).encode())
+    return body + "." + _b64(hmac.new(_key(), body.encode(), hashlib.sha256).digest()[:16])
+
+def verify_token(token, now=None):
+    """(user_id, is_superadmin) for a valid, unexpired token, else None."""
+    body, _, sig = str(token or "").partition(".")
+    want = _b64(hmac.new(_key(), body.encode(), hashlib.sha256).digest()[:16])
+    if not body or not hmac.compare_digest(sig, want):
+        return None
+    try:
+        uid, admin, exp = json.loads(base64.urlsafe_b64decode(body + "=" * (-len(body) % 4)))
+    except ValueError:
+        return None
+    if (now or time.time()) > exp:
+        return None
+    return int(uid), bool(admin)
+
+
+# ---- stream server (runs in vpn-portal-worker) ----
+def _event(name, payload) -> bytes:
+    return f"event: {name}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n".encode()
+
+_RESYNC = object()     # queue marker: backlog was dropped, send a full snapshot
+
+
+class _Client:
+    __slots__ = ("user_id", "admin", "writer", "task", "queue", "until")
+
+    def __init__(self, user_id, admin, writer):
+        self.user_id = user_id
+        self.admin = admin
+        self.writer = writer
+        self.task = asyncio.current_task()
+        self.queue = asyncio.Queue(LIVE_QUEUE)
+        self.until = time.time() + LIVE_MAX_SECONDS
+
+
+class PeerStream:
+    def __init__(self, call, conn, iface=None, interval=LIVE_INTERVAL):
+        # `call(fn)` runs fn on the worker's DB thread (Enforcer._call) and
+        # `conn()` is that thread's connection (Worker.conn).
+        self.call = call
+        self.conn = conn
+        self.iface = iface                     # None: every site's interface
+        self.ifaces = [iface or wg.WG_IF]      # refreshed with the owners
+        self.interval = interval
+        self.clients = set()
+        self.owners = {}       # public_key -> (peer_id, user_id)
+        self.state = {}        # peer_id -> {"id", "hs", "rx", "tx", "on"}
+        self.owner_of = {}     # peer_id -> user_id, for peers in `state`
+        self.reload = True     # set on "peers" notifications
+        self._loaded_at = 0.0
+        self._active = None
+        self._server = None
+        self.metrics = {"clients": 0, "samples": 0, "deltas": 0, "resyncs": 0,
+                        "dropped_slow": 0, "rejected": 0}
+
+    # ---- sampling ----
+    def _load_owners(self):
+        conn = self.conn()
+        with conn.cursor() as cur:
+            cur.execute(SQL_PEER_OWNERS)
+            owners = {r["public_key"]: (r["id"], r["user_id"]) for r in cur.fetchall()}
+        return owners, ([self.iface] if self.iface else sites.interfaces(conn))
+
+    def _diff(self, snap, now):
+        """Rows for peers whose status changed; {"id", "gone": true} for removed ones."""
+        changed, seen = [], set()
+        for pub, (pid, uid) in self.owners.items():
+            p = snap.peers.get(pub)
+            row = {"id": pid, "hs": p.latest_handshake if p else 0,
+                   "rx": p.rx_bytes if p else 0, "tx": p.tx_bytes if p else 0,
+                   "on": bool(p) and p.online(now)}
+            seen.add(pid)
+            if self.state.get(pid) != row:
+                self.state[pid] = row
+                self.owner_of[pid] = uid
+                changed.append((uid, row))
+        for pid in [pid for pid in self.state if pid not in seen]:
+            del self.state[pid]
+            changed.append((self.owner_of.pop(pid, None), {"id": pid, "gone": True}))
+        return changed
+
+    def _visible(self, client):
+        if client.admin:
+            return list(self.state.values())
+        return [row for pid, row in self.state.items() if self.owner_of.get(pid) == client.user_id]
+
+    def _publish(self, changed):
+        if not changed or not self.clients:
+            return
+        admin_msg = None
+        per_user = {}
+        for uid, row in changed:
+            per_user.setdefault(uid, []).append(row)
+        msgs = {}
+        for c in self.clients:
+            if c.admin:
+                msg = admin_msg = admin_msg or _event("delta", [r for _, r in changed])
+            else:
+                rows = per_user.get(c.user_id)
+                if not rows:
+                    continue
+                msg = msgs.get(c.user_id)
+                if msg is None:
+                    msg = msgs[c.user_id] = _event("delta", rows)
+            self._offer(c, msg)
+        self.metrics["deltas"] += len(changed)
+
+    def _offer(self, client, msg):
+        try:
+            client.queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            # Slow reader: its deltas are superseded by one full snapshot.
+            while not client.queue.empty():
+                client.queue.get_nowait()
+            client.queue.put_nowait(_RESYNC)
+            self.metrics["resyncs"] += 1
+
+    async def _sampler(self):
+        while True:
+            await self._active.wait()
+            try:
+                now = time.time()
+                snap = await asyncio.to_thread(wg_live.merged, self.ifaces, self.interval)
+                # Unknown keys (a peer added elsewhere) reload at most once a minute.
+                if self.reload or (now - self._loaded_at > 60
+                                   and any(pub not in self.owners for pub in snap.peers)):
+                    self.reload = False
+                    self.owners, self.ifaces = await self.call(self._load_owners)
+                    self._loaded_at = now
+                self._publish(self._diff(snap, now))
+                self.metrics["samples"] += 1
+            except Exception:
+                log.exception("peerstream: sample failed")
+            await asyncio.sleep(self.interval)
+
+    # ---- HTTP ----
+    async def _reply(self, writer, status, body=b""):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\n"
+                     "Connection: close\r\n\r\n".encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            method, target, _ = head.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ValueError):
+            writer.close()
+            return
+        url = urllib.parse.urlsplit(target)
+        if method != "GET" or url.path != LIVE_PATH:
+            return await self._reply(writer, "404 Not Found")
+        claims = verify_token(urllib.parse.parse_qs(url.query).get("token", [""])[0])
+        if claims is None:
+            self.metrics["rejected"] += 1
+            return await self._reply(writer, "401 Unauthorized")
+
+        client = _Client(*claims, writer)
+        self.clients.add(client)
+        self.metrics["clients"] = len(self.clients)
+        self._active.set()
+        client.queue.put_nowait(_RESYNC)       # first message: current state
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-store\r\nX-Accel-Buffering: no\r\n"
+                     b"Connection: close\r\n\r\nretry: 5000\n\n")
+        try:
+            while True:
+                left = client.until - time.time()
+                if left <= 0:
+                    writer.write(b"event: expired\ndata: {}\n\n")
+                    break
+                try:
+                    msg = await asyncio.wait_for(client.queue.get(), min(LIVE_HEARTBEAT, left))
+                except asyncio.TimeoutError:
+                    msg = b": ping\n\n"
+                if msg is _RESYNC:
+                    msg = _event("snapshot", self._visible(client))
+                writer.write(msg)
+                await asyncio.wait_for(writer.drain(), LIVE_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.metrics["dropped_slow"] += 1
+        except (ConnectionError, OSError, asyncio.CancelledError):
+            pass                               # client went away / worker stopping
+        finally:
+            self.clients.discard(client)
+            self.metrics["clients"] = len(self.clients)
+            if not self.clients:
+                self._active.clear()           # sampler idles with nobody watching
+            writer.close()
+
+    async def run(self):
+        self._active = asyncio.Event()
+        try:
+            os.unlink(LIVE_SOCK)
+        except FileNotFoundError:
+            pass
+        try:
+            self._server = await asyncio.start_unix_server(self._handle, path=LIVE_SOCK)
+        except OSError as e:
+            log.warning("peerstream: cannot listen on %s (%s); live status disabled", LIVE_SOCK, e)
+            return
+        os.chmod(LIVE_SOCK, 0o660)
+        sampler = asyncio.create_task(self._sampler())
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            sampler.cancel()
+            for c in list(self.clients):
+                c.task.cancel()            # browsers reconnect once we are back
+
+    def stop(self):
+        if self._server is not None:
+            self._server.close()
+
+    def stats(self):
+        return dict(self.metrics, peers=len(self.state))
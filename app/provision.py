@@ -0,0 +1,221 @@
+# app/provision.py
+# Bulk peer provisioning: many devices in one transaction and one `wg set`.
+#
+#   python -m app.provision create peers.csv   [--format csv|json] [--out keys.csv] [--site ID]
+#   python -m app.provision delete 12 13 14
+#
+# Input rows (CSV header or JSON objects): label, allowed_ips, keepalive, user_id.
+# Every row is validated before anything is written -- allowed_ips must be
+# comma-separated networks and user_id an existing user -- and any bad row
+# rejects the whole batch with BulkError.
+# Private keys are returned once (HTTP response / --out file); the DB only keeps
+# them sealed for later .conf downloads (app.wgconf). Every peer gets its own
+# preshared key, stored in peers.preshared_key and applied with the peer.
+
+from __future__ import annotations
+
+import csv
+import io
+import ipaddress
+import json
+import sys
+import time
+
+from . import audit, data, db, ipalloc, notify, wg, wg_live, wgconf
+
+DEFAULT_ALLOWED = "0.0.0.0/0, ::/0"
+MAX_BULK = 4096
+
+
+class BulkError(ValueError):
+    pass
+
+
+def normalize_allowed_ips(value: str) -> str:
+    """'10.0.0.0/8,192.168.1.0/24' -> normalized list; ValueError on anything
+    that is not a network (it is stored and ends up in wg/.conf text)."""
+    nets = [x.strip() for x in str(value).split(",")]
+    if not all(nets):
+        raise ValueError("empty network")
+    return ", ".join(str(ipaddress.ip_network(n, strict=False)) for n in nets)
+
+
+def parse_specs(text: str, fmt: str = "csv") -> list[dict]:
+    """CSV (with header) or JSON list -> normalized peer specs."""
+    if fmt == "json":
+        rows = json.loads(text or "[]")
+        if isinstance(rows, dict):
+            rows = rows.get("peers", [])
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+    if not isinstance(rows, list):
+        raise BulkError("expected a list of peers")
+    if len(rows) > MAX_BULK:
+        raise BulkError(f"at most {MAX_BULK} peers per request")
+
+    specs = []
+    for i, r in enumerate(rows, 1):
+        if not isinstance(r, dict):
+            raise BulkError(f"row {i}: expected an object")
+        ka = str(r.get("keepalive") or "").strip()
+        if ka and not ka.isdigit():
+            raise BulkError(f"row {i}: keepalive must be a number of seconds")
+        uid = str(r.get("user_id") or "").strip()
+        if uid and not uid.isdigit():
+            raise BulkError(f"row {i}: user_id must be numeric")
+        try:
+            allowed = normalize_allowed_ips(str(r.get("allowed_ips") or "").strip() or DEFAULT_ALLOWED)
+        except ValueError as e:
+            raise BulkError(f"row {i}: allowed_ips: {e}") from None
+        specs.append({
+            "label": (str(r.get("label") or "").strip() or "Device")[:100],
+            "allowed_ips": allowed,
+            "keepalive": int(ka) if ka else None,
+            "user_id": int(uid) if uid else None,
+        })
+    return specs
+
+
+def bulk_create(specs: list[dict], site=None) -> dict:
+    """
+    Create peers for `specs` on `site` (default: the default site, see
+    app.sites) and its wg interface. Runs on the request
+    connection: the caller's transaction commit makes the rows durable, and
+    any exception leaves both the DB (rolled back) and wg0 untouched.
+    """
+    t0 = time.perf_counter()
+    if not specs:
+        return {"created": [], "count": 0, "seconds": 0.0, "peers_per_sec": 0.0}
+    site = site or data.default_site()
+    if not site:
+        raise RuntimeError("No site configured in 'sites' table")
+    iface = site["wg_interface"]
+    missing = {s["user_id"] for s in specs if s["user_id"] is not None}
+    missing -= data.existing_user_ids(missing)
+    if missing:
+        raise BulkError(f"unknown user_id: {', '.join(map(str, sorted(missing)))}")
+
+    keys = wg.genkeypairs(len(specs), psk=True)    # (private, public, psk)
+    addrs = ipalloc.allocate(db.get_conn(), site["id"], site["wg_interface_ip"], count=len(specs),
+                             range_spec=site.get("pool_range"))
+    data.insert_peers([
+        (site["id"], s["user_id"], s["label"], pub, psk, addr, s["allowed_ips"], s["keepalive"],
+         wgconf.seal(priv))
+        for s, (priv, pub, psk), addr in zip(specs, keys, addrs)
+    ])
+
+    live = [{"public_key": pub, "allowed_ips": addr, "preshared_key": psk, "keepalive": s["keepalive"]}
+            for s, (_, pub, psk), addr in zip(specs, keys, addrs)]
+    try:
+        wg.add_peers(live, iface=iface)
+    except Exception:
+        # Some chunks may have landed before the failure; take them all back out.
+        try:
+            wg.remove_peers([p["public_key"] for p in live], iface=iface)
+        except Exception:
+            pass
+        raise
+    finally:
+        wg_live.invalidate(iface)
+
+    ids = data.peer_ids_by_pubkey([pub for _, pub, _ in keys])
+    created = [{"id": ids.get(pub), "label": s["label"], "address_cidr": addr,
+                "public_key": pub, "private_key": priv, "preshared_key": psk}
+               for s, (priv, pub, psk), addr in zip(specs, keys, addrs)]
+    dt = time.perf_counter() - t0
+    return {"created": created, "count": len(created), "seconds": round(dt, 4),
+            "peers_per_sec": round(len(created) / dt, 1) if dt else None}
+
+
+def bulk_delete(peer_ids: list[int]) -> dict:
+    """Remove peers live (one batched call per interface) and then from the DB."""
+    t0 = time.perf_counter()
+    found = data.peer_keys_by_id(peer_ids)
+    by_iface = {}
+    for pub, site_id in found.values():
+        site = data.get_site(site_id)
+        by_iface.setdefault(site["wg_interface"] if site else wg.WG_IF, []).append(pub)
+    # Live first: if wg refuses, keep the DB rows so the delete can be retried.
+    for iface, keys in by_iface.items():
+        try:
+            wg.remove_peers(keys, iface=iface)
+        finally:
+            wg_live.invalidate(iface)
+    if found:
+        data.delete_peers(list(found))
+    dt = time.perf_counter() - t0
+    return {"deleted": sorted(found), "count": len(found),
+            "missing": sorted(set(peer_ids) - set(found)),
+            "seconds": round(dt, 4),
+            "peers_per_sec": round(len(found) / dt, 1) if dt and found else None}
+
+
+def _record(action, peer_ids):
+    # The CLI's counterpart of wg_admin._audit + notify, run by db.commit().
+    if not peer_ids:
+        return
+    def record():
+        audit.audit(f"peer_{action}", target_type="peer",
+                    target_id=peer_ids[0] if len(peer_ids) == 1 else None,
+                    details={"count": len(peer_ids), "source": "cli"})
+        for pid in peer_ids:
+            audit.peer_event(action, peer_id=pid)
+    db.on_commit(record)
+    notify.after_commit("peers")
+
+
+def _main(argv=None):
+    import argparse
+    from . import create_app
+
+    ap = argparse.ArgumentParser(prog="python -m app.provision")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("create", help="create peers from a CSV/JSON file ('-' for stdin)")
+    c.add_argument("file")
+    c.add_argument("--format", choices=("csv", "json"))
+    c.add_argument("--out", help="write id,label,address,public_key,private_key,preshared_key CSV here")
+    c.add_argument("--site", type=int, help="site id (default: the default site)")
+    d = sub.add_parser("delete", help="delete peers by id")
+    d.add_argument("ids", nargs="+", type=int)
+    args = ap.parse_args(argv)
+
+    with create_app().app_context():
+        if args.cmd == "create":
+            try:
+                text = sys.stdin.read() if args.file == "-" else open(args.file, encoding="utf-8-sig").read()
+            except UnicodeDecodeError as e:
+                sys.exit(f"{args.file}: not UTF-8 ({e})")
+            fmt = args.format or ("json" if args.file.endswith(".json") else "csv")
+            site = None
+            if args.site is not None:
+                site = data.get_site(args.site)
+                if not site:
+                    sys.exit(f"no site {args.site}")
+            try:
+                result = bulk_create(parse_specs(text, fmt), site=site)
+            except ValueError as e:   # BulkError, bad JSON
+                sys.exit(str(e))
+            except wgconf.SealUnavailable as e:
+                sys.exit(f"cannot store client keys: {e}")
+            _record("created", [p["id"] for p in result["created"] if p["id"]])
+            db.commit()
+            out = open(args.out, "w", newline="") if args.out else sys.stdout
+            w = csv.writer(out)
+            w.writerow(["id", "label", "address_cidr", "public_key", "private_key", "preshared_key"])
+            for p in result["created"]:
+                w.writerow([p["id"], p["label"], p["address_cidr"], p["public_key"], p["private_key"],
+                            p["preshared_key"]])
+            if args.out:
+                out.close()
+        else:
+            result = bulk_delete(args.ids)
+            _record("deleted", result["deleted"])
+            db.commit()
+            if result["missing"]:
+                print(f"not found: {result['missing']}", file=sys.stderr)
+        print(f"{args.cmd}: {result['count']} peers in {result['seconds']}s "
+              f"({result['peers_per_sec']} peers/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    _main()
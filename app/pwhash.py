@@ -0,0 +1,187 @@
+# app/pwhash.py
+# Password verification off the request thread, with a hard concurrency cap.
+#
+# bcrypt/scrypt are deliberately CPU-bound; done inline, a login burst on a
+# 4-core Pi runs (2*cores+1) workers x 2 threads of hashing at once and
+# starves /healthz and the admin pages. Here each gunicorn worker has one
+# hashing thread with a short queue (PWHASH_QUEUE), and the threads of all
+# workers share PWHASH_SLOTS flock slot files, so at most that many hashes run
+# machine-wide (default: cores - 1, leaving a core for everything else).
+# A login that finds the local queue full is rejected with 429 before the
+# user row is even read; one that waits longer than PWHASH_TIMEOUT for a
+# slot is rejected the same way.
+#
+# users.password_bcrypt holds bcrypt ($2b$, via the optional `bcrypt`
+# package) or werkzeug hashes. After a successful check the hash is upgraded
+# to bcrypt at PWHASH_BCRYPT_ROUNDS when it is weaker or not bcrypt; werkzeug's
+# own formats don't fit the varchar(100) column, so without `bcrypt`
+# installed hashes are verified but never rewritten.
+
+import fcntl, os, threading, time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from werkzeug.security import check_password_hash
+
+try:
+    import bcrypt
+except ImportError:     # optional: werkzeug hashes still verify
+    bcrypt = None
+
+PWHASH_SLOTS = int(os.getenv("PWHASH_SLOTS", str(max(1, (os.cpu_count() or 2) - 1))))
+PWHASH_QUEUE = int(os.getenv("PWHASH_QUEUE", "2"))           # waiting per worker
+PWHASH_TIMEOUT = float(os.getenv("PWHASH_TIMEOUT", "2"))
+PWHASH_BCRYPT_ROUNDS = int(os.getenv("PWHASH_BCRYPT_ROUNDS", "12"))
+PWHASH_LOCK_DIR = os.getenv("PWHASH_LOCK_DIR",
+                            os.path.join(os.getenv("WG_SNAPSHOT_DIR", "/run/vpn-portal"), "pwhash"))
+
+
+class Busy(Exception):
+    """Hashing capacity exhausted; the caller should answer 429."""
+
+
+_lock = threading.Lock()
+_executor = None            # (pid, ThreadPoolExecutor)
+_pending = 0                # submitted, not finished (this process)
+_stats = {"verified": 0, "rejected_queue": 0, "rejected_timeout": 0, "upgraded": 0,
+          "slot_wait_ms_max": 0.0, "hash_ms_last": 0.0}
+
+
+# ---- hash formats ----
+def _is_bcrypt(h):
+    return h.startswith(("$2a$", "$2b$", "$2y$"))
+
+def _check(stored, password):
+    if _is_bcrypt(stored):
+        if bcrypt is None:
+            return False
+        return bcrypt.checkpw(password.encode("utf-8"), stored.encode("ascii"))
+    try:
+        return check_password_hash(stored, password)
+    except ValueError:      # unknown method string
+        return False
+
+def needs_rehash(stored) -> bool:
+    if bcrypt is None:
+        return False
+    if not _is_bcrypt(stored):
+        return True
+    try:
+        return int(stored.split("$")[2]) < PWHASH_BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+def hash_password(password) -> str:
+    if bcrypt is None:
+        raise RuntimeError("password hashing needs the bcrypt package")
+    return bcrypt.hashpw(password.encode("utf-8"),
+                         bcrypt.gensalt(PWHASH_BCRYPT_ROUNDS)).decode("ascii")
+
+
+# ---- machine-wide slots ----
+_slot_files = None          # (pid, [file]); only the hashing thread touches these
+
+def _slots():
+    global _slot_files
+    if _slot_files is None or _slot_files[0] != os.getpid():
+        try:
+            os.makedirs(PWHASH_LOCK_DIR, exist_ok=True)
+            files = [open(os.path.join(PWHASH_LOCK_DIR, f"slot-{i}.lock"), "a")
+                     for i in range(PWHASH_SLOTS)]
+        except OSError:
+            files = []              # no shared dir: the per-worker cap still applies
+        _slot_files = (os.getpid(), files)
+    return _slot_files[1]
+
+
+class _Slot:
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.f = None
+
+    def __enter__(self):
+        files = _slots()
+        if not files:
+            return self
+        t0 = time.monotonic()
+        while True:
+            for f in files:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                self.f = f
+                waited = (time.monotonic() - t0) * 1000.0
+                if waited > _stats["slot_wait_ms_max"]:
+                    _stats["slot_wait_ms_max"] = round(waited, 3)
+                return self
+            if time.monotonic() >= self.deadline:
+                raise Busy("no hashing slot free")
+            time.sleep(0.005)
+
+    def __exit__(self, *exc):
+        if self.f is not None:
+            fcntl.flock(self.f, fcntl.LOCK_UN)
+
+
+def _job(stored, password, deadline):
+    global _pending
+    try:
+        if time.monotonic() >= deadline:
+            raise Busy("timed out in queue")     # the request gave up already
+        with _Slot(deadline):
+            t0 = time.perf_counter()
+            ok = _check(stored, password)
+            upgraded = hash_password(password) if ok and needs_rehash(stored) else None
+            _stats["hash_ms_last"] = round((time.perf_counter() - t0) * 1000.0, 3)
+        return ok, upgraded
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+def _pool():
+    global _executor
+    pid = os.getpid()
+    if _executor is None or _executor[0] != pid:
+        with _lock:
+            if _executor is None or _executor[0] != pid:
+                _executor = (pid, ThreadPoolExecutor(max_workers=1, thread_name_prefix="pwhash"))
+    return _executor[1]
+
+
+# ---- API ----
+def saturated() -> bool:
+    """Cheap admission check: True when a new login would be queued past the cap."""
+    return _pending > PWHASH_QUEUE
+
+def verify(stored, password, timeout=PWHASH_TIMEOUT):
+    """(ok, upgraded_hash_or_None). Raises Busy when over capacity."""
+    global _pending
+    with _lock:
+        if _pending > PWHASH_QUEUE:
+            _stats["rejected_queue"] += 1
+            raise Busy("hash queue full")
+        _pending += 1
+    deadline = time.monotonic() + timeout
+    try:
+        fut = _pool().submit(_job, stored or "", password, deadline)
+    except BaseException:
+        with _lock:
+            _pending -= 1
+        raise
+    try:
+        ok, upgraded = fut.result(timeout=timeout + 0.5)
+    except (Busy, FutureTimeout):
+        if fut.cancel():                         # never started: _job won't decrement
+            with _lock:
+                _pending -= 1
+        _stats["rejected_timeout"] += 1
+        raise Busy("hashing timed out")
+    _stats["verified"] += 1
+    if upgraded:
+        _stats["upgraded"] += 1
+    return ok, upgraded
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats, pending=_pending, slots=PWHASH_SLOTS, queue=PWHASH_QUEUE)
@@ -0,0 +1,134 @@
+# app/qr.py
+# QR rendering for the MFA setup page and per-device client configs.
+#
+# The expensive part of a QR image is encoding the module matrix (Reed-Solomon
+# + mask selection in pure Python); rasterising it is cheap if it skips PIL.
+# So images are rendered straight from the matrix -- SVG as one <path> of
+# horizontal runs, PNG as a 1-bit greyscale image written with zlib -- and
+# cached by content: key = sha256(format, scale, payload), bounded LRU of
+# QR_CACHE_SIZE entries. The same hash is the ETag, so a reload of the setup
+# page is a 304 with no rendering at all.
+#
+# Payloads carry secrets (otpauth:// keys, WireGuard private keys): responses
+# are `Cache-Control: private, no-cache` and the cache lives only in worker
+# memory.
+
+import hashlib, os, struct, threading, zlib
+from collections import OrderedDict
+
+from flask import Response, request
+
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "128"))
+QR_SCALE      = int(os.getenv("QR_SCALE", "8"))     # PNG pixels per module
+QR_BORDER     = 4                                   # quiet zone, in modules
+
+MIMETYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+class QRUnavailable(RuntimeError):
+    """The optional `qrcode` package is not installed."""
+
+
+_lock = threading.Lock()
+_cache = OrderedDict()     # key -> bytes
+_stats = {"hits": 0, "renders": 0}
+
+
+def matrix(payload: str) -> list:
+    """Module matrix (rows of bools, quiet zone included)."""
+    try:
+        import qrcode  # optional dependency
+    except Exception:
+        raise QRUnavailable("python package 'qrcode' is not installed")
+    q = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=QR_BORDER)
+    q.add_data(payload)
+    q.make(fit=True)
+    return q.get_matrix()
+
+
+def to_svg(m) -> bytes:
+    n = len(m)
+    runs = []
+    for y, row in enumerate(m):
+        x = 0
+        while x < n:
+            if row[x]:
+                start = x
+                while x < n and row[x]:
+                    x += 1
+                runs.append(f"M{start} {y}h{x - start}v1h-{x - start}z")
+            else:
+                x += 1
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {n} {n}" '
+        f'shape-rendering="crispEdges"><rect width="{n}" height="{n}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(runs)}"/></svg>'
+    ).encode("ascii")
+
+
+def _png_chunk(kind: bytes, body: bytes) -> bytes:
+    return (struct.pack(">I", len(body)) + kind + body
+            + struct.pack(">I", zlib.crc32(kind + body) & 0xFFFFFFFF))
+
+def to_png(m, scale=QR_SCALE) -> bytes:
+    # 1-bit greyscale: 0 = black module, 1 = white. Each scanline is built as
+    # a bit string (scale bits per module), packed once and repeated `scale`
+    # times.
+    n = len(m)
+    size = n * scale
+    pad = -size % 8
+    dark_bits, light_bits = "0" * scale, "1" * scale
+    raw = bytearray()
+    for row in m:
+        bits = "".join([dark_bits if dark else light_bits for dark in row]) + "0" * pad
+        line = b"\x00" + int(bits, 2).to_bytes((size + pad) // 8, "big")
+        raw += line * scale
+    return (b"\x89PNG\r\n\x1a\n"
+            + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(bytes(raw), 6))
+            + _png_chunk(b"IEND", b""))
+
+
+def etag(payload: str, fmt: str = "svg", scale=QR_SCALE) -> str:
+    return hashlib.sha256(f"{fmt}:{scale}:{payload}".encode("utf-8")).hexdigest()[:32]
+
+def render(payload: str, fmt: str = "svg", scale=QR_SCALE) -> tuple[bytes, str]:
+    """(image bytes, etag); served from the LRU when the payload was seen."""
+    if fmt not in MIMETYPES:
+        raise ValueError(f"unsupported QR format: {fmt}")
+    key = etag(payload, fmt, scale)
+    with _lock:
+        body = _cache.get(key)
+        if body is not None:
+            _cache.move_to_end(key)
+            _stats["hits"] += 1
+            return body, key
+    m = matrix(payload)
+    body = to_svg(m) if fmt == "svg" else to_png(m, scale)
+    with _lock:
+        _cache[key] = body
+        while len(_cache) > QR_CACHE_SIZE:
+            _cache.popitem(last=False)
+        _stats["renders"] += 1
+    return body, key
+
+def stats() -> dict:
+    with _lock:
+        return {"size": len(_cache), **_stats}
+
+
+def response(payload: str, fmt: str = "svg", download_name: str = None) -> Response:
+    """
+    QR image response with ETag revalidation. The ETag is computed from the
+    payload alone, so a matching If-None-Match is answered before rendering.
+    Raises QRUnavailable when qrcode isn't installed (caller picks a fallback).
+    """
+    tag = etag(payload, fmt)
+    headers = {"Cache-Control": "private, no-cache", "ETag": f'"{tag}"'}
+    if download_name:
+        headers["Content-Disposition"] = f'attachment; filename="{download_name}"'
+    if tag in {t.strip().removeprefix("W/").strip('"')
+               for t in (request.headers.get("If-None-Match") or "").split(",")}:
+        return Response(status=304, headers=headers)
+    body, _ = render(payload, fmt)
+    return Response(body, mimetype=MIMETYPES[fmt], headers=headers)
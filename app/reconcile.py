@@ -0,0 +1,171 @@
+# app/reconcile.py
+# Desired-state reconciler: make each site's wg interface (app.sites) match
+# the enabled rows of `peers` for the sites on it.
+#
+# The DB side is kept in memory and refreshed incrementally: each tick reads
+# only rows whose updated_at is at or past the last watermark minus
+# RECONCILE_OVERLAP_SECONDS -- a transaction that commits late carries an
+# updated_at older than rows we already saw -- then checks the row count to
+# notice deletes (which leave no updated_at trace) and falls back to a full
+# reload when it disagrees. Every RECONCILE_FULL_EVERY refreshes reload in
+# full anyway, bounding anything that slipped past both. The live side is a
+# wg snapshot. The diff is two sets per interface -- peers to (re)apply and
+# peers to remove -- applied with one batched call each, so a steady-state
+# tick is two cheap queries (plus the sites registry's occasional check) and
+# one dump per interface. Interfaces are independent: an error on one is
+# logged and counted, and the rest are still reconciled.
+#
+# With a ScheduleBook (app.schedule), peers whose (site, user) is inside a
+# denied window are left out of the desired state, so they are removed at the
+# boundary and re-added when it ends without touching `enabled`. With a
+# SessionGate (app.enforcer), peers owned by a user without a live portal
+# session are left out the same way.
+
+import logging, os, time
+from datetime import timedelta
+
+from . import sites, wg, wg_live
+
+log = logging.getLogger(__name__)
+
+RECONCILE_OVERLAP_SECONDS = int(os.getenv("RECONCILE_OVERLAP_SECONDS", "30"))
+RECONCILE_FULL_EVERY = int(os.getenv("RECONCILE_FULL_EVERY", "120"))   # refreshes; 0: never
+
+SQL_PEERS_SINCE = (
+    "SELECT id, site_id, user_id, public_key, preshared_key, address_cidr, persistent_keepalive_s, "
+    "enabled, updated_at FROM peers WHERE updated_at >= %s"
+)
+SQL_PEERS_ALL = (
+    "SELECT id, site_id, user_id, public_key, preshared_key, address_cidr, persistent_keepalive_s, "
+    "enabled, updated_at FROM peers"
+)
+SQL_PEERS_COUNT = "SELECT COUNT(*) AS n FROM peers"
+
+
+def _norm_ips(s):
+    return ",".join(sorted(x.strip() for x in (s or "").split(",") if x.strip()))
+
+
+class Reconciler:
+    def __init__(self, iface=None, prune=True, schedules=None, sessions=None):
+        self.iface = iface          # None: every site's interface
+        self.prune = prune          # remove live peers that have no enabled row
+        self.schedules = schedules  # app.schedule.ScheduleBook or None
+        self.sessions = sessions    # app.enforcer.SessionGate or None
+        self.rows = {}              # peer id -> row dict
+        self.site_iface = {}        # site id -> wg interface
+        self.watermark = None
+        self._refreshes = 0
+        self.metrics = {"ticks": 0, "full_loads": 0, "rows_read": 0, "added": 0,
+                        "removed": 0, "errors": 0, "last_tick_ms": 0.0,
+                        "max_tick_ms": 0.0, "last_plan": {"add": 0, "remove": 0}}
+
+    # ---- desired state ----
+    def _load(self, cur, full):
+        if full or self.watermark is None:
+            cur.execute(SQL_PEERS_ALL)
+            self.rows = {}
+            self.metrics["full_loads"] += 1
+        else:
+            cur.execute(SQL_PEERS_SINCE,
+                        (self.watermark - timedelta(seconds=RECONCILE_OVERLAP_SECONDS),))
+        fetched = cur.fetchall()
+        self.metrics["rows_read"] += len(fetched)
+        for r in fetched:
+            self.rows[r["id"]] = r
+            if self.watermark is None or r["updated_at"] > self.watermark:
+                self.watermark = r["updated_at"]
+
+    def refresh(self, conn):
+        self.site_iface = {s["id"]: s["wg_interface"] for s in sites.all_sites(conn)}
+        if self.sessions is not None:
+            self.sessions.refresh(conn)
+        self._refreshes += 1
+        with conn.cursor() as cur:
+            if RECONCILE_FULL_EVERY and self._refreshes % RECONCILE_FULL_EVERY == 0:
+                self._load(cur, full=True)
+                return
+            self._load(cur, full=False)
+            cur.execute(SQL_PEERS_COUNT)
+            if int(cur.fetchone()["n"]) != len(self.rows):
+                self._load(cur, full=True)
+
+    def interfaces(self):
+        if self.iface:
+            return [self.iface]
+        return list(dict.fromkeys(self.site_iface.values())) or [wg.WG_IF]
+
+    def desired(self, now=None):
+        """{iface: {public_key: {public_key, allowed_ips, preshared_key, keepalive}}} for
+        enabled, allowed peers. The PSK is applied but never compared (snapshots
+        don't carry it)."""
+        enabled = [r for r in self.rows.values() if int(r.get("enabled") or 0)]
+        denied = set()
+        if self.schedules is not None:
+            denied = self.schedules.denied_set(
+                {(r["site_id"], r["user_id"]) for r in enabled}, now)
+        live = self.sessions.live_users(now) if self.sessions is not None else None
+        out = {}
+        for r in enabled:
+            if live is not None and r["user_id"] is not None and r["user_id"] not in live:
+                continue
+            if (r["site_id"], r["user_id"]) not in denied:
+                iface = self.site_iface.get(r["site_id"], wg.WG_IF)
+                out.setdefault(iface, {})[r["public_key"]] = {
+                    "public_key": r["public_key"], "allowed_ips": r["address_cidr"],
+                    "preshared_key": r.get("preshared_key") or None,
+                    "keepalive": r.get("persistent_keepalive_s") or None}
+        return out
+
+    # ---- diff ----
+    def plan(self, desired, live_peers):
+        add, remove = [], []
+        for pub, want in desired.items():
+            have = live_peers.get(pub)
+            if (have is None
+                    or _norm_ips(have.allowed_ips) != _norm_ips(want["allowed_ips"])
+                    or (have.persistent_keepalive or None) != want["keepalive"]):
+                add.append(want)
+        if self.prune:
+            remove = [pub for pub in live_peers if pub not in desired]
+        return add, remove
+
+    def tick(self, conn, dry_run=False):
+        """One reconcile pass; returns the plan that was (or would be) applied."""
+        t0 = time.perf_counter()
+        try:
+            self.refresh(conn)
+            want = self.desired()
+            add, remove = [], []
+            for iface in self.interfaces():
+                # One site's failure (interface down, wg error) must not stop
+                # the others; it is retried on the next pass.
+                try:
+                    snap = wg_live.snapshot(iface, max_age=1)
+                    a, r = self.plan(want.get(iface, {}), snap.peers)
+                    if not dry_run and (a or r):
+                        try:
+                            if r:
+                                wg.get_backend().remove_peers(iface, r)
+                            if a:
+                                wg.get_backend().set_peers(iface, a)
+                        finally:
+                            wg_live.invalidate(iface)
+                        self.metrics["added"] += len(a)
+                        self.metrics["removed"] += len(r)
+                except Exception:
+                    self.metrics["errors"] += 1
+                    log.exception("reconcile: %s failed", iface)
+                    continue
+                add += a
+                remove += r
+            self.metrics["last_plan"] = {"add": len(add), "remove": len(remove)}
+            return {"add": add, "remove": remove, "dry_run": dry_run}
+        except Exception:
+            self.metrics["errors"] += 1
+            raise
+        finally:
+            ms = (time.perf_counter() - t0) * 1000.0
+            self.metrics["ticks"] += 1
+            self.metrics["last_tick_ms"] = round(ms, 3)
+            self.metrics["max_tick_ms"] = round(max(self.metrics["max_tick_ms"], ms), 3)
@@ -0,0 +1,204 @@
+# app/schedule.py
+# Weekly access schedules (deny_schedules.policy_json) compiled to minute
+# bitmaps.
+#
+# A policy such as {"mon": [["09:00", "17:00"]], "fri": [["22:00", "02:00"]]}
+# becomes a 10,080-bit mask (one bit per minute of the week, Monday 00:00 =
+# bit 0; a range that ends before it starts runs past midnight). Bits are
+# *denied* minutes -- the table is deny_schedules and the scope's default is
+# "always allowed" -- unless the policy says {"mode": "allow", ...}, in which
+# case it is inverted: only the listed ranges are allowed.
+#
+# Every active schedule that applies to a (site, user) -- the user's own rows
+# plus site-wide rows (user_id NULL) -- is OR-ed into one profile, and
+# identical profiles are shared. Evaluating a tick is then one minute-of-week
+# per site timezone and one byte lookup per user; next_transition() finds the
+# next boundary with a rotate + lowest-set-bit so the worker can sleep until
+# it.
+
+import datetime, json, logging, time
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+log = logging.getLogger(__name__)
+
+WEEK_MINUTES = 7 * 24 * 60
+_MASK = (1 << WEEK_MINUTES) - 1
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+SQL_SCHEDULES = (
+    "SELECT d.id, d.site_id, d.user_id, d.policy_json, s.timezone "
+    "FROM deny_schedules d JOIN sites s ON s.id=d.site_id WHERE d.active=1"
+)
+SQL_FINGERPRINT = (
+    "SELECT (SELECT COUNT(*) FROM deny_schedules) AS n, "
+    "(SELECT MAX(updated_at) FROM deny_schedules) AS d, "
+    "(SELECT MAX(updated_at) FROM sites) AS s"
+)
+
+
+@lru_cache(maxsize=2048)
+def _minute(hhmm: str) -> int:
+    h, _, m = str(hhmm).strip().partition(":")
+    h, m = int(h), int(m or 0)
+    if not (0 <= h <= 24 and 0 <= m < 60) or (h == 24 and m):
+        raise ValueError(f"bad time {hhmm!r}")
+    return h * 60 + m
+
+def compile_policy(policy) -> int:
+    """policy (dict or JSON text) -> deny bitmap as an int of WEEK_MINUTES bits."""
+    if isinstance(policy, (str, bytes)):
+        policy = json.loads(policy)
+    if not isinstance(policy, dict):
+        raise ValueError("policy must be an object")
+    bits = 0
+    for day, ranges in policy.items():
+        if day == "mode":
+            continue
+        if day not in DAYS:
+            raise ValueError(f"unknown day {day!r}")
+        base = DAYS.index(day) * 1440
+        for rng in ranges or ():
+            start, end = _minute(rng[0]), _minute(rng[1])
+            if end <= start:
+                end += 1440          # past midnight
+            a, b = base + start, base + end
+            bits |= ((1 << (b - a)) - 1) << a
+    bits = (bits | (bits >> WEEK_MINUTES)) & _MASK      # Sunday night -> Monday
+    mode = policy.get("mode", "deny")
+    if mode == "allow":
+        return ~bits & _MASK
+    if mode != "deny":
+        raise ValueError(f"unknown mode {mode!r}")
+    return bits
+
+
+@lru_cache(maxsize=4096)
+def _compile_text(text: str) -> int:
+    # Many users share a policy; compile each distinct JSON text once.
+    return compile_policy(json.loads(text))
+
+
+def minute_of_week(ts: float, tz) -> int:
+    local = datetime.datetime.fromtimestamp(ts, tz)
+    return local.weekday() * 1440 + local.hour * 60 + local.minute
+
+def next_transition(bits: int, ts: float, tz):
+    """Epoch of the next minute whose allow/deny state differs, or None."""
+    if bits in (0, _MASK):
+        return None
+    m = minute_of_week(ts, tz)
+    rot = ((bits >> m) | (bits << (WEEK_MINUTES - m))) & _MASK
+    diff = (~rot if rot & 1 else rot) & _MASK
+    off = (diff & -diff).bit_length() - 1          # minutes ahead (>= 1)
+    # Wall-clock arithmetic, then back to UTC: a DST jump moves the boundary
+    # with local time, which is what a weekly grid means.
+    local = datetime.datetime.fromtimestamp(ts, tz).replace(second=0, microsecond=0, tzinfo=None)
+    target = (local + datetime.timedelta(minutes=off)).replace(tzinfo=tz)
+    return target.timestamp()
+
+
+class _Profile:
+    __slots__ = ("bits", "raw", "tz")
+
+    def __init__(self, bits, tz):
+        self.bits = bits
+        self.raw = bits.to_bytes(WEEK_MINUTES // 8, "little")
+        self.tz = tz
+
+
+class ScheduleBook:
+    """All active schedules, compiled; reloaded when the tables change."""
+
+    def __init__(self):
+        self.profiles = {}       # (site_id, user_id) -> _Profile (user_id None = site-wide)
+        self.fingerprint = None
+        self._next = None        # cached next_boundary(); valid until it passes
+        self.metrics = {"loads": 0, "bad_policies": 0, "profiles": 0, "distinct": 0}
+
+    def refresh(self, conn):
+        with conn.cursor() as cur:
+            cur.execute(SQL_FINGERPRINT)
+            fp = cur.fetchone()
+            fp = (fp["n"], fp["d"], fp["s"])
+            if fp == self.fingerprint:
+                return False
+            cur.execute(SQL_SCHEDULES)
+            self.load(cur.fetchall())
+        self.fingerprint = fp
+        return True
+
+    def load(self, rows):
+        site_bits, user_bits, tzs = {}, {}, {}
+        for r in rows:
+            try:
+                pol = r["policy_json"]
+                bits = _compile_text(pol) if isinstance(pol, str) else compile_policy(pol)
+            except (ValueError, TypeError, KeyError, IndexError) as e:
+                # Fail open: a broken deny schedule must not lock people out.
+                self.metrics["bad_policies"] += 1
+                log.warning("deny_schedules %s ignored: %s", r["id"], e)
+                continue
+            tzs[r["site_id"]] = r.get("timezone") or "UTC"
+            key = (r["site_id"], r["user_id"])
+            target = user_bits if r["user_id"] is not None else site_bits
+            target[key] = target.get(key, 0) | bits
+
+        zones = {sid: ZoneInfo(name) for sid, name in tzs.items()}
+        shared = {}                  # (bits, site) -> _Profile, so equal grids share one
+        def profile(site_id, bits):
+            p = shared.get((bits, site_id))
+            if p is None:
+                p = shared[(bits, site_id)] = _Profile(bits, zones[site_id])
+            return p
+        profiles = {k: profile(k[0], b) for k, b in site_bits.items()}
+        for (site_id, uid), bits in user_bits.items():
+            profiles[(site_id, uid)] = profile(site_id, bits | site_bits.get((site_id, None), 0))
+        self.profiles = profiles
+        self._next = None
+        self.metrics.update(loads=self.metrics["loads"] + 1, profiles=len(profiles),
+                            distinct=len(shared))
+
+    def _profile(self, site_id, user_id):
+        p = self.profiles.get((site_id, user_id))
+        return p if p is not None else self.profiles.get((site_id, None))
+
+    def denied(self, site_id, user_id, now=None) -> bool:
+        p = self._profile(site_id, user_id)
+        if p is None:
+            return False
+        m = minute_of_week(now or time.time(), p.tz)
+        return bool(p.raw[m >> 3] >> (m & 7) & 1)
+
+    def denied_set(self, pairs, now=None) -> set:
+        """The (site_id, user_id) pairs that are denied right now."""
+        now = now or time.time()
+        minutes = {}     # tz -> minute of week, computed once per zone
+        out = set()
+        for site_id, uid in pairs:
+            p = self._profile(site_id, uid)
+            if p is None:
+                continue
+            m = minutes.get(p.tz)
+            if m is None:
+                m = minutes[p.tz] = minute_of_week(now, p.tz)
+            if p.raw[m >> 3] >> (m & 7) & 1:
+                out.add((site_id, uid))
+        return out
+
+    def next_transition(self, site_id, user_id, now=None):
+        p = self._profile(site_id, user_id)
+        return next_transition(p.bits, now or time.time(), p.tz) if p else None
+
+    def next_boundary(self, now=None):
+        """Earliest transition of any profile (for the worker's sleep)."""
+        now = now or time.time()
+        if self._next is not None and now < self._next:
+            return self._next     # nothing can flip before the earliest boundary
+        best = None
+        for p in {id(p): p for p in self.profiles.values()}.values():
+            t = next_transition(p.bits, now, p.tz)
+            if t is not None and (best is None or t < best):
+                best = t
+        self._next = best
+        return best
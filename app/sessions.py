@@ -0,0 +1,206 @@
+# app/sessions.py
+# Server-side sessions backed by the `sessions` table.
+#
+# The Flask cookie only carries the session id ("sid"). Once per request
+# load() resolves it to the session row (joined with the user's role) and
+# exposes it as g.session; rows are cached per worker for SESSION_CACHE_TTL
+# seconds, so a revoke made in another worker takes effect within that TTL.
+#
+# Activity tracking is write-behind: a request only records the time in
+# memory, and a background thread writes last_active_at at most once per
+# session per SESSION_TOUCH_SECONDS, coalescing everything due into one
+# flush. Because the DB value can lag by up to two touch intervals, the idle
+# check allows that much slack on top of idle_timeout_seconds.
+
+import atexit, datetime, logging, os, secrets, threading, time
+from flask import g, request, session
+
+from . import audit, data, db, notify
+from .cache import TTLCache
+
+log = logging.getLogger(__name__)
+
+SESSION_IDLE_SECONDS     = int(os.getenv("SESSION_IDLE_SECONDS", "1500"))   # PROJECT_SCOPE 5: 25 min
+SESSION_ABSOLUTE_SECONDS = int(os.getenv("SESSION_ABSOLUTE_SECONDS", "1800"))
+SESSION_CACHE_TTL        = float(os.getenv("SESSION_CACHE_TTL", "5"))
+SESSION_TOUCH_SECONDS    = int(os.getenv("SESSION_TOUCH_SECONDS", "60"))
+IDLE_SLACK = 2 * SESSION_TOUCH_SECONDS
+
+_cache = TTLCache(maxsize=4096, ttl=SESSION_CACHE_TTL)
+_lock = threading.Lock()
+_seen = {}       # sid -> [last activity seen here, last activity queued for write]
+_pending = {}    # sid -> activity time to write
+_wake = threading.Event()
+_flusher = None  # (pid, thread)
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def _epoch(dt):
+    return dt.replace(tzinfo=datetime.timezone.utc).timestamp() if dt else 0.0
+
+def _utc(ts):
+    return datetime.datetime.fromtimestamp(int(ts), datetime.timezone.utc).replace(tzinfo=None)
+
+
+# ---- lifecycle ----
+def start(user_id):
+    """Create the session row for a completed login and bind it to the cookie."""
+    sid = secrets.token_hex(32)
+    now = _utcnow()
+    data.insert_session(sid, user_id, now,
+                        now + datetime.timedelta(seconds=SESSION_ABSOLUTE_SECONDS),
+                        SESSION_IDLE_SECONDS, SESSION_ABSOLUTE_SECONDS,
+                        request.headers.get("X-Real-IP") or request.remote_addr,
+                        request.headers.get("User-Agent"))
+    session["sid"] = sid
+    notify.after_commit("sessions")
+    return sid
+
+def end():
+    """Revoke the current session (logout)."""
+    sid = session.get("sid")
+    if sid:
+        data.revoke_session(sid)
+        uid = (getattr(g, "session", None) or {}).get("user_id") or session.get("user_id")
+        db.on_commit(lambda: audit.audit("logout", user_id=uid, target_type="session",
+                                         details={"session": sid[:8]}))
+        _forget(sid)
+        notify.after_commit("sessions")
+    session.clear()
+    g.session = None
+
+def _forget(sid):
+    _cache.pop(sid)
+    with _lock:
+        _seen.pop(sid, None)
+        _pending.pop(sid, None)
+
+
+# ---- per request ----
+def _fetch(sid):
+    row = data.get_session(sid)
+    if row is None:
+        return None
+    row["last_active_ts"] = _epoch(row["last_active_at"])
+    row["expires_ts"] = _epoch(row["expires_at"])
+    row["issued_ts"] = _epoch(row["issued_at"])
+    return row
+
+def _expired(row, now, last_active):
+    if int(row["revoked"] or 0) or not int(row["is_active"] or 0):
+        return "revoked"
+    absolute = min(row["expires_ts"], row["issued_ts"] + int(row["absolute_timeout_seconds"]))
+    if now >= absolute:
+        return "absolute"
+    if now - last_active > int(row["idle_timeout_seconds"]) + IDLE_SLACK:
+        return "idle"
+    return None
+
+def load():
+    """before_request: resolve the cookie's sid into g.session (or None)."""
+    g.session = None
+    sid = session.get("sid")
+    if not sid:
+        return
+    row = _cache.get(sid)
+    if row is None:
+        row = _fetch(sid)
+        if row is None:
+            session.clear()
+            return
+        _cache.put(sid, row)
+
+    now = time.time()
+    with _lock:
+        seen = _seen.get(sid)
+    last_active = max(row["last_active_ts"], seen[0] if seen else 0.0)
+    reason = _expired(row, now, last_active)
+    if reason:
+        if reason != "revoked":
+            data.revoke_session(sid)
+            notify.after_commit("sessions")
+        _forget(sid)
+        session.clear()
+        return
+
+    _touch(sid, now)
+    g.session = row
+
+
+# ---- write-behind last_active_at ----
+def _touch(sid, now):
+    with _lock:
+        seen = _seen.setdefault(sid, [now, now])
+        seen[0] = now
+        if now - seen[1] < SESSION_TOUCH_SECONDS:
+            return
+        seen[1] = now
+        _pending[sid] = now
+    _ensure_flusher()
+
+def _ensure_flusher():
+    global _flusher
+    pid = os.getpid()
+    if _flusher is not None and _flusher[0] == pid and _flusher[1].is_alive():
+        return
+    with _lock:
+        if _flusher is None or _flusher[0] != pid or not _flusher[1].is_alive():
+            t = threading.Thread(target=_flush_loop, name="session-flush", daemon=True)
+            _flusher = (pid, t)
+            t.start()
+
+def _flush_loop():
+    while True:
+        _wake.wait(SESSION_TOUCH_SECONDS)
+        _wake.clear()
+        try:
+            flush()
+        except Exception:
+            log.exception("session activity flush failed")
+
+def flush():
+    """Write all queued last_active_at values in one transaction."""
+    with _lock:
+        batch = list(_pending.items())
+        _pending.clear()
+        # Drop sessions this worker hasn't seen for longer than any could live.
+        horizon = time.time() - SESSION_ABSOLUTE_SECONDS
+        for sid in [s for s, v in _seen.items() if v[0] < horizon]:
+            del _seen[sid]
+    if not batch:
+        return 0
+    pool = db.get_pool()
+    conn = pool.checkout(autocommit=False)
+    broken = False
+    try:
+        with conn.cursor() as cur:
+            cur.executemany(data.SQL_SESSION_TOUCH, [(_utc(ts), sid) for sid, ts in batch])
+        conn.commit()
+    except Exception:
+        broken = True
+        with _lock:
+            for sid, ts in batch:
+                _pending[sid] = max(ts, _pending.get(sid, 0.0))
+        raise
+    finally:
+        pool.checkin(conn, discard=broken)
+    return len(batch)
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
+
+atexit.register(_flush_at_exit)
+
+
+def stats():
+    with _lock:
+        return {"tracked": len(_seen), "pending": len(_pending), "cache": _cache.stats()}
+
+
+def init_app(app):
+    app.before_request(load)
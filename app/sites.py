@@ -0,0 +1,99 @@
+# app/sites.py
+# In-memory registry of the `sites` table.
+#
+# Every process keeps all site rows (there are a handful) and checks a cheap
+# fingerprint -- COUNT(*), SUM(id), MAX(updated_at) -- at most every
+# SITES_CHECK_SECONDS, reloading the rows only when it moved. Sites are
+# edited outside the portal, so an edit reaches every gunicorn worker and
+# the worker service within that interval, and wgconf's per-site templates
+# (keyed on updated_at) follow.
+#
+# A site's wg_interface routes its peer operations: app.wg add/remove/show
+# and app.wg_live snapshots take the interface. Each site allocates from its
+# own pool (app.ipalloc): pool_range when set, else its wg_interface_ip
+# network. Pools and snapshot refreshes are locked per site/interface, so
+# work on one site never waits for another. The default site -- what the
+# single-site code paths used -- is DEFAULT_SITE_ID, or the lowest id.
+#
+# Rows are shared between threads: treat them as read-only.
+
+import os, threading, time
+
+from . import db, wg
+
+SITES_CHECK_SECONDS = float(os.getenv("SITES_CHECK_SECONDS", "5"))
+DEFAULT_SITE_ID = int(os.getenv("DEFAULT_SITE_ID", "0"))     # 0: lowest id
+
+SQL_SITES = (
+    "SELECT id, name, fqdn, endpoint_host, endpoint_port, wg_interface, wg_interface_ip, "
+    "pool_range, dns_wg_ip, lan_cidrs_json, timezone, updated_at FROM sites ORDER BY id"
+)
+SQL_FINGERPRINT = "SELECT COUNT(*) AS n, COALESCE(SUM(id), 0) AS ids, MAX(updated_at) AS v FROM sites"
+
+_lock = threading.Lock()
+_sites = {}            # id -> row
+_fingerprint = None
+_checked = 0.0         # monotonic time of the last fingerprint check
+_stats = {"checks": 0, "reloads": 0}
+
+
+def _load(conn=None, force=False):
+    global _sites, _fingerprint, _checked
+    if not force and _fingerprint is not None and time.monotonic() - _checked < SITES_CHECK_SECONDS:
+        return _sites
+    with _lock:   # single flight: one check per interval per process
+        if not force and _fingerprint is not None and time.monotonic() - _checked < SITES_CHECK_SECONDS:
+            return _sites
+        with (conn or db.get_conn()).cursor() as cur:
+            cur.execute(SQL_FINGERPRINT)
+            row = cur.fetchone()
+            fp = (int(row["n"]), int(row["ids"]), row["v"])
+            _stats["checks"] += 1
+            if fp != _fingerprint:
+                cur.execute(SQL_SITES)
+                rows = {}
+                for r in cur.fetchall():
+                    r["wg_interface"] = r.get("wg_interface") or wg.WG_IF
+                    rows[r["id"]] = r
+                _sites, _fingerprint = rows, fp
+                _stats["reloads"] += 1
+        _checked = time.monotonic()
+    return _sites
+
+
+def all_sites(conn=None) -> list[dict]:
+    return list(_load(conn).values())
+
+def get(site_id, conn=None):
+    """The site row, or None. An unknown id forces one reload (a new site)."""
+    try:
+        site_id = int(site_id)
+    except (TypeError, ValueError):
+        return None
+    site = _load(conn).get(site_id)
+    if site is None:
+        site = _load(conn, force=True).get(site_id)
+    return site
+
+def default(conn=None):
+    sites = _load(conn)
+    if DEFAULT_SITE_ID and DEFAULT_SITE_ID in sites:
+        return sites[DEFAULT_SITE_ID]
+    return sites[min(sites)] if sites else None
+
+def interfaces(conn=None) -> list[str]:
+    """Distinct wg interfaces of all sites (WG_INTERFACE when there are none)."""
+    out = []
+    for s in _load(conn).values():
+        if s["wg_interface"] not in out:
+            out.append(s["wg_interface"])
+    return out or [wg.WG_IF]
+
+def forget():
+    """Reload on next use (e.g. right after this process edited `sites`)."""
+    global _fingerprint
+    with _lock:
+        _fingerprint = None
+
+def stats():
+    return dict(_stats, sites=len(_sites), check_seconds=SITES_CHECK_SECONDS)
@@ -0,0 +1,157 @@
+# app/telemetry.py
+# Handshake/transfer telemetry: wg snapshot -> peers.last_handshake_at,
+# peers.bytes_rx/bytes_tx and tunnel_started/tunnel_ended rows in peer_events.
+#
+# Write amplification is the constraint (SD card + MariaDB on a Pi), so each
+# sample is diffed in memory and a peer row is only written when
+#   * its tunnel went up or down, or
+#   * it has changed and TELEMETRY_MIN_WRITE_SECONDS passed since its last
+#     write, or its byte counters moved by TELEMETRY_BYTES_THRESHOLD.
+# All due rows go out as one multi-row UPDATE per batch and all events as one
+# multi-row INSERT. The UPDATE joins against a derived table rather than
+# INSERT ... ON DUPLICATE KEY UPDATE so a peer deleted mid-tick is never
+# resurrected, and pins updated_at so telemetry doesn't look like a config
+# change to the reconciler's watermark.
+#
+# bytes_rx/bytes_tx are cumulative: wg counters restart when a peer is
+# re-added, so a counter that goes backwards is treated as a reset.
+
+import datetime, json, logging, os, time
+
+from . import wg
+
+log = logging.getLogger(__name__)
+
+MIN_WRITE_SECONDS = int(os.getenv("TELEMETRY_MIN_WRITE_SECONDS", "300"))
+BYTES_THRESHOLD   = int(os.getenv("TELEMETRY_BYTES_THRESHOLD", str(64 * 1024 * 1024)))
+WRITE_BATCH       = 500
+RELOAD_EVERY      = 20   # samples; also reloads when an unknown key shows up
+
+SQL_PEERS = ("SELECT id, user_id, public_key, last_handshake_at, bytes_rx, bytes_tx "
+             "FROM peers")
+SQL_EVENT = ("INSERT INTO peer_events (user_id, peer_id, action, details_json) "
+             "VALUES (%s, %s, %s, %s)")
+
+
+def _epoch(dt):
+    if not dt:
+        return 0
+    return int(dt.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+def _utc(ts):
+    if not ts:
+        return None
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).replace(tzinfo=None)
+
+
+class _Track:
+    __slots__ = ("peer_id", "user_id", "handshake", "rx_total", "tx_total",
+                 "live_rx", "live_tx", "online", "written_at", "written_rx",
+                 "written_tx", "written_hs")
+
+    def __init__(self, row, now):
+        self.peer_id = row["id"]
+        self.user_id = row["user_id"]
+        self.handshake = _epoch(row["last_handshake_at"])
+        self.rx_total = int(row["bytes_rx"] or 0)
+        self.tx_total = int(row["bytes_tx"] or 0)
+        self.live_rx = self.live_tx = None       # baseline set by first sample
+        self.online = bool(self.handshake) and now - self.handshake < wg.HANDSHAKE_STALE_SECONDS
+        self.written_at = now
+        self.written_rx, self.written_tx, self.written_hs = self.rx_total, self.tx_total, self.handshake
+
+
+class Telemetry:
+    def __init__(self, iface=None):
+        self.iface = iface or wg.WG_IF
+        self.tracks = {}     # public_key -> _Track
+        self.metrics = {"samples": 0, "rows_written": 0, "events": 0,
+                        "last_sample_ms": 0.0, "reloads": 0}
+
+    def _reload(self, conn, now):
+        with conn.cursor() as cur:
+            cur.execute(SQL_PEERS)
+            rows = cur.fetchall()
+        old = self.tracks
+        self.tracks = {}
+        for r in rows:
+            t = old.get(r["public_key"])
+            if t is None or t.peer_id != r["id"]:
+                t = _Track(r, now)
+            t.user_id = r["user_id"]
+            self.tracks[r["public_key"]] = t
+        self.metrics["reloads"] += 1
+
+    def sample(self, conn, snap=None, now=None):
+        """Diff one snapshot against memory; write only what is due."""
+        t0 = time.perf_counter()
+        now = int(now if now is not None else time.time())
+        snap = snap or wg.snapshot(self.iface)
+        if (not self.tracks or self.metrics["samples"] % RELOAD_EVERY == 0
+                or any(pub not in self.tracks for pub in snap.peers)):
+            self._reload(conn, now)
+
+        updates, events = [], []
+        for pub, t in self.tracks.items():
+            p = snap.peers.get(pub)
+            hs = p.latest_handshake if p else 0
+            online = bool(p) and p.online(now)
+
+            if p is not None:
+                if t.live_rx is not None:
+                    t.rx_total += p.rx_bytes - t.live_rx if p.rx_bytes >= t.live_rx else p.rx_bytes
+                    t.tx_total += p.tx_bytes - t.live_tx if p.tx_bytes >= t.live_tx else p.tx_bytes
+                t.live_rx, t.live_tx = p.rx_bytes, p.tx_bytes
+            else:
+                t.live_rx = t.live_tx = None
+            if hs > t.handshake:
+                t.handshake = hs
+
+            transition = online != t.online
+            if transition:
+                events.append((t.user_id, t.peer_id,
+                               "tunnel_started" if online else "tunnel_ended",
+                               json.dumps({"endpoint": p.endpoint if p else None,
+                                           "handshake_at": t.handshake or None,
+                                           "bytes_rx": t.rx_total, "bytes_tx": t.tx_total})))
+                t.online = online
+
+            changed = (t.handshake != t.written_hs or t.rx_total != t.written_rx
+                       or t.tx_total != t.written_tx)
+            if changed and (
+                transition
+                or now - t.written_at >= MIN_WRITE_SECONDS
+                or (t.rx_total - t.written_rx) + (t.tx_total - t.written_tx) >= BYTES_THRESHOLD
+            ):
+                updates.append(t)
+
+        self._write(conn, updates, events, now)
+        self.metrics["samples"] += 1
+        self.metrics["last_sample_ms"] = round((time.perf_counter() - t0) * 1000.0, 3)
+        return len(updates), len(events)
+
+    def _write(self, conn, updates, events, now):
+        if not updates and not events:
+            return
+        with conn.cursor() as cur:
+            for i in range(0, len(updates), WRITE_BATCH):
+                batch = updates[i:i + WRITE_BATCH]
+                derived = " UNION ALL ".join(
+                    ["SELECT %s AS id, %s AS hs, %s AS rx, %s AS tx"] * len(batch))
+                args = []
+                for t in batch:
+                    args += [t.peer_id, _utc(t.handshake), t.rx_total, t.tx_total]
+                cur.execute(
+                    f"UPDATE peers p JOIN ({derived}) v ON v.id = p.id "
+                    "SET p.last_handshake_at = v.hs, p.bytes_rx = v.rx, p.bytes_tx = v.tx, "
+                    "p.updated_at = p.updated_at",
+                    args,
+                )
+            if events:
+                cur.executemany(SQL_EVENT, events)
+        conn.commit()
+        for t in updates:
+            t.written_at, t.written_hs = now, t.handshake
+            t.written_rx, t.written_tx = t.rx_total, t.tx_total
+        self.metrics["rows_written"] += len(updates)
+        self.metrics["events"] += len(events)
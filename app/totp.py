@@ -7,14 +7,25 @@ import hmac
 import os
 import struct
 import time
-from typing import Optional
+from typing import Iterable, Optional
+
+from .cache import TTLCache
 
 _DEFAULT_PERIOD = 30
 _DEFAULT_DIGITS = 6
 _DEFAULT_ALGO = hashlib.sha1  # widely supported by authenticator apps
 
+_ALGORITHMS = {"SHA1": hashlib.sha1, "SHA256": hashlib.sha256, "SHA512": hashlib.sha512}
+
+_pack_counter = struct.Struct(">Q").pack
+
+# Verifiers are cached under a SHA-256 of the secret (never the secret) for at
+# most TOTP_VERIFIER_TTL seconds; forget() drops a user's on MFA reset/disable.
+TOTP_VERIFIER_TTL = float(os.getenv("TOTP_VERIFIER_TTL", "300"))
+_verifiers = TTLCache(maxsize=1024, ttl=TOTP_VERIFIER_TTL)
+
 def _int_to_bytes(counter: int) -> bytes:
-    return struct.pack(">Q", counter)
+    return _pack_counter(counter)
 
 def _dynamic_truncate(hmac_digest: bytes) -> int:
     offset = hmac_digest[-1] & 0x0F
@@ -48,23 +59,117 @@ def totp_now(secret_b32: str, timestamp: Optional[int] = None,
     counter = int(timestamp // period)
     return _hotp(secret_b32, counter, digits=digits, algo=algo)
 
+class TotpVerifier:
+    """
+    TOTP checker for one secret. The base32 secret is decoded and the HMAC
+    key schedule computed once; each step then costs one hmac.copy() plus
+    a counter update instead of a decode and a fresh HMAC.
+    """
+    __slots__ = ("_mac", "period", "digits", "window", "algorithm", "_mod")
+
+    def __init__(self, secret_b32: str, period: int = _DEFAULT_PERIOD,
+                 digits: int = _DEFAULT_DIGITS, window: int = 1,
+                 algorithm: str = "SHA1"):
+        algo = _ALGORITHMS.get(algorithm.upper())
+        if algo is None:
+            raise ValueError(f"Unsupported TOTP algorithm: {algorithm}")
+        key = base64.b32decode(_b32_normalize(secret_b32))
+        self._mac = hmac.new(key, digestmod=algo)
+        self.period = period
+        self.digits = digits
+        self.window = window
+        self.algorithm = algorithm.upper()
+        self._mod = 10 ** digits
+
+    def code_at(self, counter: int) -> int:
+        m = self._mac.copy()
+        m.update(_pack_counter(counter))
+        return _dynamic_truncate(m.digest()) % self._mod
+
+    def now(self, timestamp: Optional[int] = None) -> str:
+        if timestamp is None:
+            timestamp = int(time.time())
+        return str(self.code_at(int(timestamp // self.period))).zfill(self.digits)
+
+    def match(self, code: str, timestamp: Optional[int] = None) -> Optional[int]:
+        """Time-step counter the code is valid for, or None."""
+        code = (code or "").strip()
+        if len(code) != self.digits or not code.isdigit():
+            return None
+        if timestamp is None:
+            timestamp = int(time.time())
+        counter = int(timestamp // self.period)
+        want = code.encode("ascii")
+        found = None
+        # Check every step in the window (no early exit) and compare in
+        # constant time so timing doesn't reveal which step matched.
+        for off in range(-self.window, self.window + 1):
+            got = str(self.code_at(counter + off)).zfill(self.digits).encode("ascii")
+            if hmac.compare_digest(got, want) and found is None:
+                found = counter + off
+        return found
+
+    def verify(self, code: str, timestamp: Optional[int] = None) -> bool:
+        return self.match(code, timestamp) is not None
+
+
+def get_verifier(secret_b32: str, period: int = _DEFAULT_PERIOD,
+                 digits: int = _DEFAULT_DIGITS, window: int = 1,
+                 algorithm: str = "SHA1", user_id=None) -> TotpVerifier:
+    """Shared verifier per (user, secret, parameters); verifiers are immutable."""
+    if not isinstance(secret_b32, str):
+        raise TypeError("TOTP secret must be a base32 string")
+    key = (user_id, hashlib.sha256(secret_b32.encode("utf-8")).digest(),
+           period, digits, window, algorithm.upper())
+    v = _verifiers.get(key)
+    if v is None:
+        v = TotpVerifier(secret_b32, period=period, digits=digits, window=window,
+                         algorithm=algorithm)
+        _verifiers.put(key, v)
+    return v
+
+def forget(user_id=None) -> None:
+    """Drop cached verifiers of user_id (every one when None)."""
+    if user_id is None:
+        _verifiers.clear()
+    else:
+        _verifiers.discard_if(lambda k: k[0] == user_id)
+
 def verify_totp(secret_b32: str, code: str, period: int = _DEFAULT_PERIOD,
                 digits: int = _DEFAULT_DIGITS, window: int = 1,
                 timestamp: Optional[int] = None, algo=_DEFAULT_ALGO) -> bool:
+    algorithm = next((k for k, v in _ALGORITHMS.items() if v is algo), None)
+    if algorithm is None:
+        raise ValueError("Unsupported TOTP algorithm")
     try:
-        code_int = int(code)
-    except ValueError:
+        v = get_verifier(secret_b32, period, digits, window, algorithm)
+    except (ValueError, TypeError):   # undecodable secret
         return False
+    return v.verify(code, timestamp)
+
+def verify_batch(items: Iterable[tuple], timestamp: Optional[int] = None,
+                 period: int = _DEFAULT_PERIOD, digits: int = _DEFAULT_DIGITS,
+                 window: int = 1, algorithm: str = "SHA1") -> list:
+    """
+    Verify many (secret_b32, code) pairs at one instant (worker/admin
+    tooling). Returns a list of bools in input order.
+    """
     if timestamp is None:
         timestamp = int(time.time())
-    counter = int(timestamp // period)
-    for off in range(-window, window + 1):
-        if _hotp(secret_b32, counter + off, digits=digits, algo=algo) == code_int:
-            return True
-    return False
+    out = []
+    for secret_b32, code in items:
+        try:
+            v = get_verifier(secret_b32, period, digits, window, algorithm)
+        except (ValueError, TypeError):
+            out.append(False)
+            continue
+        out.append(v.match(code, timestamp) is not None)
+    return out
 
-def build_otpauth_uri(secret_b32: str, account_label: str, issuer: str) -> str:
+def build_otpauth_uri(secret_b32: str, account_label: str, issuer: str,
+                      algorithm: str = "SHA1", digits: int = _DEFAULT_DIGITS,
+                      period: int = _DEFAULT_PERIOD) -> str:
     from urllib.parse import quote
     label = quote(f"{issuer}:{account_label}")
-    params = f"secret={secret_b32}&issuer={quote(issuer)}&algorithm=SHA1&digits={_DEFAULT_DIGITS}&period={_DEFAULT_PERIOD}"
+    params = f"secret={secret_b32}&issuer={quote(issuer)}&algorithm={algorithm.upper()}&digits={digits}&period={period}"
     return f"otpauth://totp/{label}?{params}"
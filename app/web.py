@@ -1,12 +1,21 @@
 # app/web.py
-from flask import Blueprint, session, redirect, url_for, render_template_string
+import os, threading, time
+
+from flask import Blueprint, abort, g, jsonify, redirect, url_for, render_template_string
+
+from . import db, peerstream, sites, wg_live
 
 bp = Blueprint("web", __name__)
 
+START_TS = time.time()
+READYZ_TTL = float(os.getenv("READYZ_TTL", "5"))
+_ready = {"at": 0.0, "result": None}
+_ready_lock = threading.Lock()
+
 @bp.route("/")
 def home():
     # If not logged in, send to login
-    if not session.get("user_id"):
+    if not g.session:
         return redirect(url_for("auth.login"))
 
     # Minimal placeholder for now (redirect target after MFA)
@@ -19,3 +28,53 @@ def home():
         "<p>You are logged in. This is <strong>web.home</strong>.</p>"
         "</div></body>"
     )
+
+@bp.get("/live/token")
+def live_token():
+    # Short-lived pass for the live peer status stream (app.peerstream), which
+    # is served by vpn-portal-worker and can't read Flask sessions itself.
+    if not g.session:
+        abort(401)
+    token = peerstream.issue_token(g.session["user_id"], g.session.get("is_superadmin"))
+    resp = jsonify(url=f"{peerstream.LIVE_PATH}?token={token}", ttl=peerstream.TOKEN_TTL)
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
+@bp.get("/healthz")
+def healthz():
+    # Liveness: process is up
+    return jsonify(status="ok", uptime_seconds=round(time.time() - START_TS, 1))
+
+def _check_ready():
+    checks = {}
+    try:
+        pool = db.get_pool()
+        conn = pool.checkout()
+        ok = False
+        try:
+            conn.ping(reconnect=True)
+            ok = True
+        finally:
+            pool.checkin(conn, discard=not ok)
+        checks["db"] = "ok"
+    except Exception as e:
+        checks["db"] = f"error: {type(e).__name__}"
+    try:
+        # Every site's interface; shared, cached dumps: no extra `wg show`
+        bad = [i for i in sites.interfaces() if not wg_live.snapshot(i).public_key]
+        checks["wg"] = f"error: no key on {', '.join(bad)}" if bad else "ok"
+    except Exception as e:
+        checks["wg"] = f"error: {type(e).__name__}"
+    return all(v == "ok" for v in checks.values()), checks
+
+@bp.get("/readyz")
+def readyz():
+    # Readiness: DB ping + wg interface, cached READYZ_TTL per worker so
+    # frequent probes cost nothing.
+    now = time.monotonic()
+    with _ready_lock:
+        if _ready["result"] is None or now - _ready["at"] >= READYZ_TTL:
+            _ready["result"], _ready["at"] = _check_ready(), now
+        ok, checks = _ready["result"]
+    return jsonify(status="ready" if ok else "not ready", checks=checks), (200 if ok else 503)
@@ -1,87 +1,529 @@
-import ipaddress, subprocess, json, os, re
+import base64, contextlib, ipaddress, socket, subprocess, json, os, re, tempfile, threading, time
 from .db import get_conn
+from . import metrics, wgkeys
 
 WG_BIN = os.getenv("WG_BIN", "/usr/bin/wg")
+WG_SUDO = os.getenv("WG_SUDO", "sudo")     # empty: run WG_BIN directly (bench/loadtest.py)
 WG_IF  = os.getenv("WG_INTERFACE", "wg0")
+# subprocess | uapi | fake | auto (uapi when its socket exists, else subprocess)
+WG_BACKEND  = os.getenv("WG_BACKEND", "auto").strip().lower()
+WG_UAPI_DIR = os.getenv("WG_UAPI_DIR", "/var/run/wireguard")
 
 def _sudo(*args):
     # All calls use full paths; sudo is NOPASSWD for allowed subcommands.
-    cmd = ["sudo", WG_BIN] + list(args)
+    cmd = ([WG_SUDO] if WG_SUDO else []) + [WG_BIN] + list(args)
+    t0 = time.perf_counter()
     p = subprocess.run(cmd, text=True, capture_output=True)
+    sub = (args[0] if args else "") + (" dump" if "dump" in args else "")
+    metrics.observe("wg_call_duration_seconds", (("cmd", sub),), time.perf_counter() - t0)
+    metrics.inc("wg_calls_total", (("cmd", sub), ("ok", int(p.returncode == 0))))
     if p.returncode != 0:
         raise RuntimeError(f"wg error: {' '.join(cmd)} :: {p.stderr.strip() or p.stdout.strip()}")
     return p.stdout
 
-def show():
-    return _sudo("show")
-
-def show_json():
-    # Parse "wg show" into a dict (minimal fields we care about)
-    out = _sudo("show")
-    data = {"peers": {}}
-    cur_peer = None
-    for line in out.splitlines():
-        if line.startswith("peer: "):
-            cur_peer = line.split("peer: ",1)[1].strip()
-            data["peers"][cur_peer] = {}
-        elif cur_peer:
-            if "endpoint:" in line: data["peers"][cur_peer]["endpoint"] = line.split("endpoint:",1)[1].strip()
-            if "allowed ips:" in line: data["peers"][cur_peer]["allowed_ips"] = line.split("allowed ips:",1)[1].strip()
-            if "latest handshake:" in line: data["peers"][cur_peer]["latest_handshake"] = line.split("latest handshake:",1)[1].strip()
-            if "transfer:" in line: data["peers"][cur_peer]["transfer"] = line.split("transfer:",1)[1].strip()
-    return data
-
-def add_peer(public_key:str, allowed_ips:str, preshared_key:str|None=None, keepalive:int|None=None):
-    args = ["set", WG_IF, "peer", public_key, "allowed-ips", allowed_ips]
-    if keepalive is not None:
-        args += ["persistent-keepalive", str(keepalive)]
-    # NOTE: preshared_key can be set later if desired; skipping for now.
-    _sudo(*args)
+
+# --------------------
+# Backends
+# --------------------
+# Every backend speaks the same four calls. `dump` returns the tab-separated
+# `wg show <if> dump` format (interface line, then one line per peer) so all
+# backends can be parsed the same way; `show` is the human-readable text.
+#
+#   show(iface) -> str
+#   dump(iface) -> str
+#   set_peer(iface, public_key, allowed_ips, preshared_key=None, keepalive=None)
+#   remove_peer(iface, public_key)
+#   set_peers(iface, peers)          peers: dicts with set_peer's keyword names
+#   remove_peers(iface, public_keys)
+#
+# The batch calls apply many peers in one `wg set` / one UAPI request.
+
+# Peers per `wg set` invocation; keeps argv far below ARG_MAX.
+SET_BATCH = int(os.getenv("WG_SET_BATCH", "256"))
+
+def _chunks(seq, n):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+@contextlib.contextmanager
+def _psk_files(keys):
+    """{key: path} of 0600 files holding each preshared key, removed on exit.
+
+    `wg set ... preshared-key` only takes a file; argv would expose the key
+    to every local user via /proc.
+    """
+    with tempfile.TemporaryDirectory(prefix="wg-psk-") as d:    # 0700
+        paths = {}
+        for key in dict.fromkeys(k for k in keys if k):
+            fd, path = tempfile.mkstemp(dir=d)                   # 0600
+            with os.fdopen(fd, "w") as f:
+                f.write(key + "\n")
+            paths[key] = path
+        yield paths
+
+class SubprocessBackend:
+    """The original path: `sudo wg ...` per operation."""
+    name = "subprocess"
+
+    def show(self, iface):
+        return _sudo("show", iface)
+
+    def dump(self, iface):
+        return _sudo("show", iface, "dump")
+
+    def set_peer(self, iface, public_key, allowed_ips, preshared_key=None, keepalive=None):
+        self.set_peers(iface, [{"public_key": public_key, "allowed_ips": allowed_ips,
+                                "preshared_key": preshared_key, "keepalive": keepalive}])
+
+    def remove_peer(self, iface, public_key):
+        _sudo("set", iface, "peer", public_key, "remove")
+
+    def set_peers(self, iface, peers):
+        for chunk in _chunks(list(peers), SET_BATCH):
+            with _psk_files(p.get("preshared_key") for p in chunk) as psk:
+                args = ["set", iface]
+                for p in chunk:
+                    args += ["peer", p["public_key"], "allowed-ips", p["allowed_ips"]]
+                    if p.get("preshared_key"):
+                        args += ["preshared-key", psk[p["preshared_key"]]]
+                    if p.get("keepalive") is not None:
+                        args += ["persistent-keepalive", str(p["keepalive"])]
+                _sudo(*args)
+
+    def remove_peers(self, iface, public_keys):
+        for chunk in _chunks(list(public_keys), SET_BATCH):
+            args = ["set", iface]
+            for pub in chunk:
+                args += ["peer", pub, "remove"]
+            _sudo(*args)
+
+
+def _b64_to_hex(key):
+    return base64.b64decode(key).hex()
+
+def _hex_to_b64(key):
+    return base64.b64encode(bytes.fromhex(key)).decode("ascii")
+
+
+class UapiBackend:
+    """
+    WireGuard cross-platform UAPI over a unix socket
+    (<WG_UAPI_DIR>/<iface>.sock), as served by wireguard-go/boringtun or a
+    privileged helper. One persistent connection per interface, reused for
+    every operation and re-opened once if the peer end went away.
+    """
+    name = "uapi"
+
+    def __init__(self, sock_dir=WG_UAPI_DIR, timeout=5.0):
+        self.sock_dir = sock_dir
+        self.timeout = timeout
+        self._socks = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def socket_path(self, iface):
+        return os.path.join(self.sock_dir, f"{iface}.sock")
+
+    def available(self, iface):
+        return os.path.exists(self.socket_path(iface))
+
+    def _lock(self, iface):
+        with self._guard:
+            return self._locks.setdefault(iface, threading.Lock())
+
+    def _connect(self, iface):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(self.timeout)
+        s.connect(self.socket_path(iface))
+        return s, s.makefile("rb")
+
+    def _request(self, iface, payload):
+        """Send one UAPI operation; return its key=value lines (errno checked)."""
+        with self._lock(iface):
+            for attempt in (0, 1):
+                chan = self._socks.get(iface)
+                try:
+                    if chan is None:
+                        chan = self._socks[iface] = self._connect(iface)
+                    sock, rfile = chan
+                    sock.sendall(payload.encode("ascii"))
+                    lines = []
+                    while True:
+                        raw = rfile.readline()
+                        if not raw:
+                            raise ConnectionError("UAPI socket closed")
+                        line = raw.decode("ascii").rstrip("\n")
+                        if not line:
+                            break
+                        lines.append(line)
+                    break
+                except OSError:
+                    self._close(iface)
+                    if attempt:
+                        raise
+        errno = lines.pop() if lines and lines[-1].startswith("errno=") else "errno=0"
+        if errno != "errno=0":
+            raise RuntimeError(f"wg uapi error on {iface}: {errno}")
+        return lines
+
+    def _close(self, iface):
+        chan = self._socks.pop(iface, None)
+        if chan:
+            try:
+                chan[1].close()
+                chan[0].close()
+            except OSError:
+                pass
+
+    def dump(self, iface):
+        iface_kv = {}
+        peers = []
+        cur = None
+        for line in self._request(iface, "get=1\n\n"):
+            k, _, v = line.partition("=")
+            if k == "public_key":
+                cur = {"public_key": v, "allowed_ip": []}
+                peers.append(cur)
+            elif cur is None:
+                iface_kv[k] = v
+            elif k == "allowed_ip":
+                cur["allowed_ip"].append(v)
+            else:
+                cur[k] = v
+        priv = iface_kv.get("private_key")
+        priv_b64 = _hex_to_b64(priv) if priv else None
+        out = ["\t".join([
+            priv_b64 or "(none)",
+            wgkeys.pubkey(priv_b64) if priv_b64 else "(none)",
+            iface_kv.get("listen_port", "0"),
+            iface_kv.get("fwmark", "0") if iface_kv.get("fwmark", "0") != "0" else "off",
+        ])]
+        for p in peers:
+            psk = p.get("preshared_key")
+            ka = p.get("persistent_keepalive_interval", "0")
+            out.append("\t".join([
+                _hex_to_b64(p["public_key"]),
+                _hex_to_b64(psk) if psk and psk.strip("0") else "(none)",
+                p.get("endpoint") or "(none)",
+                ",".join(p["allowed_ip"]) or "(none)",
+                p.get("last_handshake_time_sec", "0"),
+                p.get("rx_bytes", "0"),
+                p.get("tx_bytes", "0"),
+                ka if ka != "0" else "off",
+            ]))
+        return "\n".join(out) + "\n"
+
+    def show(self, iface):
+        return _render_show(iface, self.dump(iface))
+
+    @staticmethod
+    def _peer_lines(public_key, allowed_ips, preshared_key=None, keepalive=None):
+        req = [f"public_key={_b64_to_hex(public_key)}", "replace_allowed_ips=true"]
+        if preshared_key:
+            req.append(f"preshared_key={_b64_to_hex(preshared_key)}")
+        if keepalive is not None:
+            req.append(f"persistent_keepalive_interval={int(keepalive)}")
+        for cidr in allowed_ips.split(","):
+            if cidr.strip():
+                req.append(f"allowed_ip={cidr.strip()}")
+        return req
+
+    def set_peer(self, iface, public_key, allowed_ips, preshared_key=None, keepalive=None):
+        self.set_peers(iface, [dict(public_key=public_key, allowed_ips=allowed_ips,
+                                    preshared_key=preshared_key, keepalive=keepalive)])
+
+    def remove_peer(self, iface, public_key):
+        self.remove_peers(iface, [public_key])
+
+    def set_peers(self, iface, peers):
+        req = ["set=1"]
+        for p in peers:
+            req += self._peer_lines(p["public_key"], p["allowed_ips"],
+                                    p.get("preshared_key"), p.get("keepalive"))
+        if len(req) > 1:
+            self._request(iface, "\n".join(req) + "\n\n")
+
+    def remove_peers(self, iface, public_keys):
+        req = ["set=1"]
+        for pub in public_keys:
+            req += [f"public_key={_b64_to_hex(pub)}", "remove=true"]
+        if len(req) > 1:
+            self._request(iface, "\n".join(req) + "\n\n")
+
+
+class FakeBackend:
+    """In-process stand-in for a wg interface (tests, benchmarks, dev boxes)."""
+    name = "fake"
+
+    def __init__(self, private_key="(none)", public_key="(none)", listen_port=51820):
+        self.iface_line = (private_key, public_key, str(listen_port), "off")
+        self.peers = {}   # iface -> {public_key: [psk, endpoint, allowed, handshake, rx, tx, keepalive]}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _table(self, iface):
+        return self.peers.setdefault(iface, {})
+
+    def dump(self, iface):
+        with self._lock:
+            self.calls += 1
+            rows = ["\t".join(self.iface_line)]
+            for pub, p in self._table(iface).items():
+                rows.append("\t".join([pub] + [str(x) for x in p]))
+        return "\n".join(rows) + "\n"
+
+    def show(self, iface):
+        return _render_show(iface, self.dump(iface))
+
+    def set_peer(self, iface, public_key, allowed_ips, preshared_key=None, keepalive=None):
+        allowed = ",".join(c.strip() for c in allowed_ips.split(",") if c.strip()) or "(none)"
+        with self._lock:
+            self.calls += 1
+            p = self._table(iface).setdefault(
+                public_key, ["(none)", "(none)", "(none)", 0, 0, 0, "off"])
+            p[2] = allowed
+            if preshared_key:
+                p[0] = preshared_key
+            if keepalive is not None:
+                p[6] = int(keepalive) or "off"
+
+    def remove_peer(self, iface, public_key):
+        with self._lock:
+            self.calls += 1
+            self._table(iface).pop(public_key, None)
+
+    def set_peers(self, iface, peers):
+        for p in peers:
+            self.set_peer(iface, p["public_key"], p["allowed_ips"],
+                          preshared_key=p.get("preshared_key"), keepalive=p.get("keepalive"))
+
+    def remove_peers(self, iface, public_keys):
+        for pub in public_keys:
+            self.remove_peer(iface, pub)
+
+
+class AutoBackend:
+    """UAPI when the interface exposes a socket, otherwise `sudo wg`."""
+    name = "auto"
+
+    def __init__(self):
+        self.uapi = UapiBackend()
+        self.subprocess = SubprocessBackend()
+
+    def _pick(self, iface):
+        return self.uapi if self.uapi.available(iface) else self.subprocess
+
+    def _call(self, method, iface, *args, **kw):
+        b = self._pick(iface)
+        try:
+            return getattr(b, method)(iface, *args, **kw)
+        except OSError:
+            if b is self.subprocess:
+                raise
+            return getattr(self.subprocess, method)(iface, *args, **kw)
+
+    def show(self, iface):
+        return self._call("show", iface)
+
+    def dump(self, iface):
+        return self._call("dump", iface)
+
+    def set_peer(self, iface, public_key, allowed_ips, preshared_key=None, keepalive=None):
+        return self._call("set_peer", iface, public_key, allowed_ips,
+                          preshared_key=preshared_key, keepalive=keepalive)
+
+    def remove_peer(self, iface, public_key):
+        return self._call("remove_peer", iface, public_key)
+
+    def set_peers(self, iface, peers):
+        return self._call("set_peers", iface, peers)
+
+    def remove_peers(self, iface, public_keys):
+        return self._call("remove_peers", iface, public_keys)
+
+
+_BACKENDS = {"subprocess": SubprocessBackend, "uapi": UapiBackend,
+             "fake": FakeBackend, "auto": AutoBackend}
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if WG_BACKEND not in _BACKENDS:
+                    raise RuntimeError(f"Unknown WG_BACKEND: {WG_BACKEND}")
+                _backend = _BACKENDS[WG_BACKEND]()
+    return _backend
+
+def set_backend(backend):
+    """Swap the process-wide backend (tests/benchmarks); returns the old one."""
+    global _backend
+    with _backend_lock:
+        old, _backend = _backend, backend
+    return old
+
+
+def _fmt_bytes(n):
+    n = float(n)
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if n < 1024 or unit == "TiB":
+            return f"{n:.2f} {unit}" if unit != "B" else f"{int(n)} B"
+        n /= 1024
+
+def _render_show(iface, dump_text):
+    """Human `wg show` text from dump lines (backends without a `wg` binary)."""
+    lines = dump_text.splitlines()
+    if not lines:
+        return ""
+    _, pub, port, _ = (lines[0].split("\t") + ["", "", "", ""])[:4]
+    out = [f"interface: {iface}", f"  public key: {pub}", "  private key: (hidden)",
+           f"  listening port: {port}"]
+    now = int(time.time())
+    for line in lines[1:]:
+        f = line.split("\t")
+        if len(f) < 8:
+            continue
+        out += ["", f"peer: {f[0]}"]
+        if f[2] != "(none)":
+            out.append(f"  endpoint: {f[2]}")
+        out.append(f"  allowed ips: {f[3]}")
+        if f[4] != "0":
+            out.append(f"  latest handshake: {max(0, now - int(f[4]))} seconds ago")
+        if f[5] != "0" or f[6] != "0":
+            out.append(f"  transfer: {_fmt_bytes(f[5])} received, {_fmt_bytes(f[6])} sent")
+        if f[7] != "off":
+            out.append(f"  persistent keepalive: every {f[7]} seconds")
+    return "\n".join(out) + "\n"
+
+
+def show(iface=None):
+    return get_backend().show(iface or WG_IF)
+
+# --------------------
+# Typed live state (parsed from `wg show <if> dump`)
+# --------------------
+HANDSHAKE_STALE_SECONDS = 180   # REJECT_AFTER_TIME; no handshake since => offline
+
+class PeerState:
+    """One peer line of `wg show <if> dump`; handshake is epoch seconds (0 = never)."""
+    __slots__ = ("public_key", "endpoint", "allowed_ips", "latest_handshake",
+                 "rx_bytes", "tx_bytes", "persistent_keepalive", "has_psk")
+
+    def __init__(self, public_key, endpoint, allowed_ips, latest_handshake,
+                 rx_bytes, tx_bytes, persistent_keepalive, has_psk):
+        self.public_key = public_key
+        self.endpoint = endpoint
+        self.allowed_ips = allowed_ips
+        self.latest_handshake = latest_handshake
+        self.rx_bytes = rx_bytes
+        self.tx_bytes = tx_bytes
+        self.persistent_keepalive = persistent_keepalive
+        self.has_psk = has_psk
+
+    def online(self, now=None, stale=HANDSHAKE_STALE_SECONDS):
+        if not self.latest_handshake:
+            return False
+        return (now if now is not None else time.time()) - self.latest_handshake < stale
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return f"PeerState({self.public_key!r}, hs={self.latest_handshake}, rx={self.rx_bytes}, tx={self.tx_bytes})"
+
+
+class Snapshot:
+    """Interface public key/port plus peers keyed by public key."""
+    __slots__ = ("interface", "public_key", "listen_port", "peers", "taken_at")
+
+    def __init__(self, interface, public_key, listen_port, peers, taken_at):
+        self.interface = interface
+        self.public_key = public_key
+        self.listen_port = listen_port
+        self.peers = peers
+        self.taken_at = taken_at
+
+    def as_dict(self):
+        return {"interface": self.interface, "public_key": self.public_key,
+                "listen_port": self.listen_port, "taken_at": self.taken_at,
+                "peers": {k: p.as_dict() for k, p in self.peers.items()}}
+
+
+def parse_dump(text, iface=WG_IF, taken_at=None):
+    """
+    Parse `wg show <if> dump`: first line is the interface
+    (private-key, public-key, listen-port, fwmark), then one line per peer
+    (public-key, preshared-key, endpoint, allowed-ips, latest-handshake,
+    transfer-rx, transfer-tx, persistent-keepalive), tab separated.
+    """
+    lines = text.split("\n")
+    head = lines[0].split("\t") if lines and lines[0] else None
+    peers = {}
+    for line in lines[1:]:
+        f = line.split("\t")
+        if len(f) != 8:
+            continue
+        pub, psk, ep, aips, hs, rx, tx, ka = f
+        peers[pub] = PeerState(
+            pub,
+            None if ep == "(none)" else ep,
+            "" if aips == "(none)" else aips,
+            int(hs), int(rx), int(tx),
+            0 if ka == "off" else int(ka),
+            psk != "(none)",
+        )
+    if head and len(head) >= 3:
+        pub = None if head[1] == "(none)" else head[1]
+        port = int(head[2]) if head[2].isdigit() else 0
+    else:
+        pub, port = None, 0
+    return Snapshot(iface, pub, port, peers, taken_at if taken_at is not None else time.time())
+
+def snapshot(iface=None):
+    """Current typed state of the interface."""
+    iface = iface or WG_IF
+    return parse_dump(get_backend().dump(iface), iface=iface)
+
+def show_json(iface=None):
+    # JSON-safe view of snapshot(): ints for handshakes/bytes, keyed by public key
+    return snapshot(iface).as_dict()
+
+# iface: the peer's site interface (app.sites); None is WG_INTERFACE.
+def add_peer(public_key:str, allowed_ips:str, preshared_key:str|None=None, keepalive:int|None=None,
+             iface:str|None=None):
+    get_backend().set_peer(iface or WG_IF, public_key, allowed_ips, preshared_key=preshared_key,
+                           keepalive=keepalive)
+    return True
+
+def remove_peer(public_key:str, iface:str|None=None):
+    get_backend().remove_peer(iface or WG_IF, public_key)
     return True
 
-def remove_peer(public_key:str):
-    _sudo("set", WG_IF, "peer", public_key, "remove")
+def add_peers(peers:list[dict], iface:str|None=None):
+    # dicts with add_peer's keyword names; one batched `wg set` per SET_BATCH peers
+    if peers:
+        get_backend().set_peers(iface or WG_IF, peers)
+    return True
+
+def remove_peers(public_keys:list[str], iface:str|None=None):
+    if public_keys:
+        get_backend().remove_peers(iface or WG_IF, public_keys)
     return True
 
 def genkeypair():
-    # wg genkey/pubkey do not require root; run without sudo
-    p = subprocess.run([WG_BIN, "genkey"], text=True, capture_output=True)
-    if p.returncode != 0:
-        raise RuntimeError(p.stderr.strip() or p.stdout.strip())
-    priv = p.stdout.strip()
-    p2 = subprocess.run([WG_BIN, "pubkey"], text=True, input=priv, capture_output=True)
-    if p2.returncode != 0:
-        raise RuntimeError(p2.stderr.strip() or p2.stdout.strip())
-    pub = p2.stdout.strip()
-    return priv, pub
-
-def _site_cidr_and_base(conn):
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, wg_interface_ip FROM sites ORDER BY id ASC LIMIT 1")
-        row = cur.fetchone()
-    if not row:
+    # In-process X25519 (app.wgkeys); no `wg genkey`/`wg pubkey` forks
+    return wgkeys.genkeypair()
+
+def genkeypairs(n:int, psk:bool=False):
+    return wgkeys.genkeypairs(n, psk=psk)
+
+def next_available_address_cidr(conn, site=None)->str:
+    # Indexed allocator; locks the site row until the caller's transaction ends
+    from . import ipalloc, sites
+    site = site or sites.default(conn)
+    if not site:
         raise RuntimeError("No site configured in 'sites' table")
-    # e.g., '10.88.0.1/24'
-    net = ipaddress.ip_network(row["wg_interface_ip"], strict=False)
-    gw  = ipaddress.ip_interface(row["wg_interface_ip"]).ip
-    return row["id"], net, gw
-
-def next_available_address_cidr(conn)->str:
-    site_id, net, gw = _site_cidr_and_base(conn)
-    used = set()
-    with conn.cursor() as cur:
-        cur.execute("SELECT address_cidr FROM peers WHERE site_id=%s", (site_id,))
-        for r in cur.fetchall():
-            try:
-                used.add(ipaddress.ip_interface(r["address_cidr"]).ip)
-            except Exception:
-                pass
-    # reserve the gateway
-    used.add(gw)
-    # start at .2 (skip .1 gw)
-    for host in net.hosts():
-        if int(host) <= int(gw):  # skip .1
-            continue
-        if host not in used:
-            return f"{str(host)}/32"
-    raise RuntimeError("No free addresses left in pool")
+    return ipalloc.allocate(conn, site["id"], site["wg_interface_ip"],
+                            range_spec=site.get("pool_range"))[0]
@@ -1,86 +1,209 @@
 import os, json
-from flask import Blueprint, render_template, request, redirect, url_for, g, abort, flash
-from .db import get_conn
-from .wg import show_json, genkeypair, add_peer, remove_peer, next_available_address_cidr
+from flask import (Blueprint, render_template, request, redirect, url_for, g, abort, flash, jsonify,
+                   Response, stream_with_context)
+from . import audit, data, notify, provision, qr, sites, wg_live, wgconf
+from .db import get_conn, on_commit
+from .wg import genkeypairs, add_peer, remove_peer, next_available_address_cidr
 
 bp = Blueprint("wgadmin", __name__, url_prefix="/peers")
 
+def _audit(action, peer_ids, **details):
+    # Queued once the change has committed; a rolled-back request leaves no trail.
+    if not peer_ids:
+        return
+    uid = g.session["user_id"]
+    def record():
+        audit.audit(f"peer_{action}", user_id=uid, target_type="peer",
+                    target_id=peer_ids[0] if len(peer_ids) == 1 else None,
+                    details=dict(details, count=len(peer_ids)))
+        for pid in peer_ids:
+            audit.peer_event(action, peer_id=pid, user_id=uid)
+    on_commit(record)
+
+@bp.errorhandler(wgconf.SealUnavailable)
+def _seal_unavailable(e):
+    # No sealing key on this install: nothing was created or rendered.
+    if request.is_json or request.path.endswith("/bulk"):
+        return jsonify(error=str(e)), 503
+    return Response(f"{e}\n", status=503, mimetype="text/plain")
+
 def _require_superadmin():
-    # g.session is set by before_request in app/__init__.py
+    # g.session is set by before_request in app/sessions.py
     if not getattr(g, "session", None):
         abort(403)
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute("SELECT is_superadmin FROM users WHERE id=%s", (g.session["user_id"],))
-        row = cur.fetchone()
-    if not row or int(row.get("is_superadmin") or 0) != 1:
+    # The session row already carries the role (joined from users and cached
+    # with the session), so this costs no query.
+    if not int(g.session.get("is_superadmin") or 0):
         abort(403)
 
+def _site(site_id):
+    # Requested site (form/query `site`), else the default one (app.sites)
+    site = data.get_site(site_id) if site_id else data.default_site()
+    if not site:
+        abort(404)
+    return site
+
 @bp.get("/")
 def list_peers():
     _require_superadmin()
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute("""
-            SELECT p.id, p.label, p.public_key, p.address_cidr, p.allowed_ips, p.enabled, u.username
-            FROM peers p LEFT JOIN users u ON p.user_id=u.id
-            ORDER BY p.id DESC
-        """)
-        peers = cur.fetchall()
-    live = show_json()
-    return render_template("peers.html", peers=peers, live=live)
+    peers = data.list_peers()
+    live = wg_live.merged(sites.interfaces())
+    return render_template("peers.html", peers=peers, live=live,
+                           multi_site=len(sites.all_sites()) > 1)
 
 @bp.get("/new")
 def new_peer_form():
     _require_superadmin()
-    return render_template("peer_new.html")
+    return render_template("peer_new.html", sites=sites.all_sites())
 
 @bp.post("/new")
 def create_peer():
     _require_superadmin()
     label = (request.form.get("label") or "").strip() or "Device"
-    allowed = (request.form.get("allowed_ips") or "0.0.0.0/0, ::/0").strip()
+    try:
+        allowed = provision.normalize_allowed_ips(
+            (request.form.get("allowed_ips") or "").strip() or provision.DEFAULT_ALLOWED)
+    except ValueError as e:
+        abort(400, description=f"allowed_ips: {e}")
     keepalive = request.form.get("keepalive")
     keepalive_i = int(keepalive) if keepalive and keepalive.isdigit() else None
 
+    site = _site(request.form.get("site_id"))
     conn = get_conn()
-    # generate keys & find next /32
-    priv, pub = genkeypair()
-    addr_cidr = next_available_address_cidr(conn)
+    # generate keys (sealed first: no key, no peer) & find next /32 in the site's pool
+    (priv, pub, psk), = genkeypairs(1, psk=True)
+    sealed = wgconf.seal(priv)
+    addr_cidr = next_available_address_cidr(conn, site)
 
-    try:
-        # 1) write to DB first (desired state)
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO peers (site_id, user_id, label, public_key, preshared_key, address_cidr, allowed_ips, dns_servers, persistent_keepalive_s, enabled)
-                VALUES ((SELECT id FROM sites ORDER BY id ASC LIMIT 1), NULL, %s, %s, NULL, %s, %s, NULL, %s, 1)
-            """, (label, pub, addr_cidr, allowed, keepalive_i))
-        # 2) apply live
-        add_peer(public_key=pub, allowed_ips=addr_cidr, preshared_key=None, keepalive=keepalive_i)
-    except Exception as e:
-        # rollback DB entry on failure
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM peers WHERE public_key=%s", (pub,))
-        raise
-
-    # Show private key once for admin to build client config later
+    # 1) write to DB first (desired state)
+    peer_id = data.insert_peer(site["id"], None, label, pub, psk, addr_cidr, allowed, keepalive_i,
+                               private_key_enc=sealed)
+    # 2) apply live; if this raises, the request transaction is rolled back
+    #    so the INSERT above never becomes visible.
+    add_peer(public_key=pub, allowed_ips=addr_cidr, preshared_key=psk, keepalive=keepalive_i,
+             iface=site["wg_interface"])
+    wg_live.invalidate(site["wg_interface"])
+    notify.after_commit("peers")
+    _audit("created", [peer_id], address=addr_cidr)
+
+    # Private key is kept sealed; the client config is at /peers/<id>/config
     return redirect(url_for("wgadmin.list_peers"))
 
 @bp.post("/delete/<int:peer_id>")
 def delete_peer(peer_id: int):
     _require_superadmin()
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute("SELECT public_key FROM peers WHERE id=%s", (peer_id,))
-        row = cur.fetchone()
-    if not row:
+    peer = data.peer_key(peer_id)
+    if not peer:
         return redirect(url_for("wgadmin.list_peers"))
-    pub = row["public_key"]
+    site = data.get_site(peer["site_id"])
+    iface = site["wg_interface"] if site else None
     # live remove first (if it fails, keep DB to retry)
     try:
-        remove_peer(pub)
+        remove_peer(peer["public_key"], iface=iface)
     except Exception:
         pass
-    with conn.cursor() as cur:
-        cur.execute("DELETE FROM peers WHERE id=%s", (peer_id,))
+    data.delete_peer(peer_id)
+    wg_live.invalidate(iface)
+    notify.after_commit("peers")
+    _audit("deleted", [peer_id])
     return redirect(url_for("wgadmin.list_peers"))
+
+def _bulk_input():
+    if request.is_json:
+        return json.dumps(request.get_json()), "json"
+    f = request.files.get("file")
+    if f:
+        try:
+            text = f.read().decode("utf-8-sig")
+        except UnicodeDecodeError as e:
+            raise provision.BulkError(f"upload is not UTF-8 ({e.reason} at byte {e.start})") from None
+        return text, ("json" if f.filename.endswith(".json") else "csv")
+    return request.get_data(as_text=True), "csv"
+
+@bp.post("/bulk")
+def bulk_create_peers():
+    _require_superadmin()
+    site = _site(request.args.get("site"))
+    try:
+        text, fmt = _bulk_input()
+        specs = provision.parse_specs(text, fmt)
+    except ValueError as e:   # BulkError, bad JSON
+        return jsonify(error=str(e)), 400
+    try:
+        result = provision.bulk_create(specs, site=site)
+    except provision.BulkError as e:   # unknown user_id; raised before any write
+        return jsonify(error=str(e)), 400
+    resp = jsonify(result)
+    notify.after_commit("peers")
+    _audit("created", [p["id"] for p in result["created"] if p["id"]], bulk=True)
+    # Contains private keys, shown exactly once.
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+@bp.post("/bulk-delete")
+def bulk_delete_peers():
+    _require_superadmin()
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get("ids") or [], list):
+            return jsonify(error='expected {"ids": [...]}'), 400
+        ids = body.get("ids") or []
+    else:
+        ids = (request.form.get("ids") or "").replace(",", " ").split()
+    try:
+        ids = [int(i) for i in ids]
+    except (TypeError, ValueError):
+        return jsonify(error="ids must be integers"), 400
+    result = provision.bulk_delete(ids)
+    notify.after_commit("peers")
+    _audit("deleted", result["deleted"], bulk=True)
+    return jsonify(result)
+
+
+# ---- client configs (app.wgconf) ----
+def _peer_config(peer_id: int):
+    """(site, peer) for a config download; owners may fetch their own."""
+    if not getattr(g, "session", None):
+        abort(403)
+    peer = data.peer_for_config(peer_id)
+    if not peer:
+        abort(404)
+    if peer["user_id"] != g.session["user_id"] and not int(g.session.get("is_superadmin") or 0):
+        abort(403)
+    return data.get_site(peer["site_id"]), peer
+
+@bp.get("/<int:peer_id>/config")
+def peer_config(peer_id: int):
+    site, peer = _peer_config(peer_id)
+    text = wgconf.render(site, peer)
+    data.mark_config_issued(peer_id)
+    return Response(text, mimetype="text/plain", headers={
+        "Content-Disposition": f'attachment; filename="{wgconf.filename(peer)}"',
+        "Cache-Control": "no-store",
+    })
+
+@bp.get("/<int:peer_id>/config.<fmt>")
+def peer_config_qr(peer_id: int, fmt: str):
+    if fmt not in qr.MIMETYPES:
+        abort(404)
+    site, peer = _peer_config(peer_id)
+    try:
+        resp = qr.response(wgconf.render(site, peer), fmt)
+    except qr.QRUnavailable:
+        abort(501)
+    if resp.status_code == 200:
+        data.mark_config_issued(peer_id)
+    return resp
+
+@bp.get("/export.zip")
+def export_configs():
+    _require_superadmin()
+    site = _site(request.args.get("site"))
+    # Marked before streaming so the UPDATE commits with the request; the
+    # rows themselves are read unbuffered while the zip is being sent.
+    data.mark_site_configs_issued(site["id"])
+    body = wgconf.stream_zip(site, data.iter_site_peer_configs(site["id"]))
+    return Response(stream_with_context(body), mimetype="application/zip", headers={
+        "Content-Disposition": 'attachment; filename="vpn-configs.zip"',
+        "Cache-Control": "no-store",
+    })
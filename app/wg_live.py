@@ -0,0 +1,166 @@
+# app/wg_live.py
+# Shared, cached view of the live wg interface state.
+#
+# Every gunicorn worker (and the worker service) reads the same on-disk dump
+# file under WG_SNAPSHOT_DIR. When it is older than WG_SNAPSHOT_TTL one
+# process, elected with a non-blocking flock, runs the backend `dump` and
+# atomically replaces the file; everyone else keeps serving the previous copy
+# or waits briefly for the fresh one. The file is mode 0600 and carries no
+# secrets: the interface private key and peer preshared keys are blanked
+# before it is written. Inside a process, concurrent callers are
+# coalesced behind a per-interface lock so N threads cost one read/parse per
+# interval, and a slow `wg show` on one site's interface (app.sites) doesn't
+# hold up the others.
+
+import fcntl, os, threading, time
+
+from . import wg
+
+SNAPSHOT_TTL = float(os.getenv("WG_SNAPSHOT_TTL", "5"))
+SNAPSHOT_DIR = os.getenv("WG_SNAPSHOT_DIR", "/run/vpn-portal")
+# How long a non-elected process waits for the refresher before serving stale.
+REFRESH_WAIT = float(os.getenv("WG_SNAPSHOT_WAIT", "2"))
+
+_lock = threading.Lock()   # guards _locks
+_locks = {}   # iface -> Lock
+_cache = {}   # iface -> (mtime, Snapshot)
+_stats = {"hits": 0, "file_reads": 0, "refreshes": 0, "stale_served": 0}
+
+
+def _iface_lock(iface):
+    lock = _locks.get(iface)
+    if lock is None:
+        with _lock:
+            lock = _locks.setdefault(iface, threading.Lock())
+    return lock
+
+def _path(iface):
+    return os.path.join(SNAPSHOT_DIR, f"{iface}.dump")
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+def _redact(text):
+    # The dump's first field is the interface private key and each peer's
+    # second is its preshared key; neither is written to the shared file.
+    lines = text.split("\n")
+    out = []
+    for i, line in enumerate(lines):
+        f = line.split("\t")
+        if i == 0 and len(f) >= 4:
+            f[0] = "(none)"
+        elif len(f) == 8:
+            f[1] = "(none)"
+        out.append("\t".join(f))
+    return "\n".join(out)
+
+def _write_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.unlink(tmp)              # leftover from a crashed writer with our pid
+    except FileNotFoundError:
+        pass
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def _refresh(iface, path, ttl):
+    """
+    Run the backend once if we win the flock. True if the file is fresh,
+    False if another process holds the lock, None if the snapshot directory
+    is not usable (caller reads the backend directly).
+    """
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        lf = open(path + ".lock", "a")
+    except OSError:
+        return None
+    with lf:
+        try:
+            fcntl.flock(lf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        try:
+            # Another process may have refreshed between our stat and the flock.
+            if time.time() - _mtime(path) < ttl:
+                return True
+            _write_atomic(path, _redact(wg.get_backend().dump(iface)))
+            _stats["refreshes"] += 1
+            return True
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+def _wait_fresh(path, ttl, deadline):
+    while time.time() < deadline:
+        if time.time() - _mtime(path) < ttl:
+            return True
+        time.sleep(0.02)
+    return False
+
+def snapshot(iface=None, max_age=None):
+    """A wg.Snapshot no older than `max_age` seconds (default WG_SNAPSHOT_TTL)."""
+    iface = iface or wg.WG_IF
+    ttl = SNAPSHOT_TTL if max_age is None else max_age
+    path = _path(iface)
+
+    cached = _cache.get(iface)
+    if cached and time.time() - cached[0] < ttl:
+        _stats["hits"] += 1
+        return cached[1]
+
+    with _iface_lock(iface):   # single flight within this process
+        cached = _cache.get(iface)
+        if cached and time.time() - cached[0] < ttl:
+            _stats["hits"] += 1
+            return cached[1]
+
+        mtime = _mtime(path)
+        shared = True
+        if time.time() - mtime >= ttl:
+            shared = _refresh(iface, path, ttl)
+            if shared is False:
+                if not _wait_fresh(path, ttl, time.time() + REFRESH_WAIT) and mtime:
+                    _stats["stale_served"] += 1
+            mtime = _mtime(path)
+        if shared is None or not mtime:
+            # Snapshot dir unusable or nobody produced a file: go direct.
+            snap = wg.snapshot(iface)
+            _cache[iface] = (snap.taken_at, snap)
+            return snap
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path) as f:
+            text = f.read()
+        _stats["file_reads"] += 1
+        snap = wg.parse_dump(text, iface=iface, taken_at=mtime)
+        _cache[iface] = (mtime, snap)
+        return snap
+
+def invalidate(iface=None):
+    """Forget cached state after a local change (e.g. add/remove peer)."""
+    iface = iface or wg.WG_IF
+    with _iface_lock(iface):
+        _cache.pop(iface, None)
+        try:
+            os.utime(_path(iface), (0, 0))   # mark the shared file stale too
+        except OSError:
+            pass
+
+def merged(ifaces, max_age=None):
+    """One wg.Snapshot holding the peers of every interface (public keys are unique)."""
+    snaps = [snapshot(i, max_age) for i in ifaces or [None]]
+    if len(snaps) == 1:
+        return snaps[0]
+    peers = {}
+    for s in snaps:
+        peers.update(s.peers)
+    return wg.Snapshot(",".join(s.interface for s in snaps), snaps[0].public_key,
+                       snaps[0].listen_port, peers, min(s.taken_at for s in snaps))
+
+def stats():
+    return dict(_stats, ttl=SNAPSHOT_TTL)
@@ -0,0 +1,173 @@
+# app/wgconf.py
+# Client .conf generation (PROJECT_SCOPE 3 and 13).
+#
+# Everything that comes from the site row -- DNS, the split-tunnel AllowedIPs
+# (VPN subnet + lan_cidrs_json), endpoint and the server public key -- is
+# compiled once per site into a SiteTemplate and reused until sites.updated_at
+# changes, so rendering a peer is a string join with no JSON parsing. Bulk
+# export streams a zip: each config is deflated and handed to the client as
+# it is produced, never holding the whole archive in memory.
+#
+# Client private keys are kept sealed in peers.private_key_enc so configs can
+# be downloaded again later (PROJECT_SCOPE 10): AES-256-GCM under a key
+# derived from CONFIG_KEY or, by default, the installer's secret file
+# CONFIG_KEY_FILE (/etc/vpn-portal/secret, 0600). The secret never touches
+# the DB. Without one -- or without the `cryptography` package -- seal()
+# raises SealUnavailable and no peer is created: there is no built-in
+# fallback key.
+#
+# A config is stale when the site changed after it was last issued
+# (peers.config_issued_at < sites.updated_at): data.list_peers() computes it
+# as config_stale and the peers page badges those rows next to the download.
+
+import base64, hashlib, hmac, ipaddress, json, os, re, threading, zipfile
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:     # optional until a key has to be sealed
+    AESGCM = None
+
+from . import wg_live, wgkeys
+
+DEFAULT_KEEPALIVE = 25
+CONFIG_KEY_FILE = os.getenv("CONFIG_KEY_FILE", "/etc/vpn-portal/secret")
+_SEAL_VERSION = "gcm1:"
+_SEAL_AAD = b"vpn-portal peers.private_key_enc"
+_MIN_SECRET = 16        # bytes
+
+
+class SealUnavailable(RuntimeError):
+    """No usable sealing key: refuse to store client private keys."""
+
+
+# ---- private key sealing ----
+_aead = None
+
+def _cipher():
+    global _aead
+    if _aead is not None:
+        return _aead
+    if AESGCM is None:
+        raise SealUnavailable("python package 'cryptography' is not installed")
+    secret = os.getenv("CONFIG_KEY", "").encode("utf-8")
+    if not secret:
+        try:
+            with open(CONFIG_KEY_FILE, "rb") as f:
+                secret = f.read().strip()
+        except OSError as e:
+            raise SealUnavailable(f"no sealing key: set CONFIG_KEY or create {CONFIG_KEY_FILE} ({e})")
+    if len(secret) < _MIN_SECRET:
+        raise SealUnavailable(f"sealing key shorter than {_MIN_SECRET} bytes")
+    _aead = AESGCM(hmac.new(secret, b"wgconf-aes-gcm", hashlib.sha256).digest())
+    return _aead
+
+def seal(private_key: str) -> str:
+    nonce = os.urandom(12)
+    ct = _cipher().encrypt(nonce, wgkeys.decode(private_key), _SEAL_AAD)
+    return _SEAL_VERSION + base64.b64encode(nonce + ct).decode("ascii")
+
+def unseal(blob: str) -> str:
+    if not blob or not blob.startswith(_SEAL_VERSION):
+        raise ValueError("not a sealed key")
+    data = base64.b64decode(blob[len(_SEAL_VERSION):])
+    try:
+        raw = _cipher().decrypt(data[:12], data[12:], _SEAL_AAD)
+    except InvalidTag:
+        raise ValueError("sealed key failed authentication (CONFIG_KEY changed?)") from None
+    return wgkeys.encode(raw)
+
+
+# ---- per-site template ----
+class SiteTemplate:
+    __slots__ = ("site_id", "version", "dns", "peer_head", "peer_tail")
+
+    def __init__(self, site):
+        self.site_id = site["id"]
+        self.version = site["updated_at"]
+        routes = [str(ipaddress.ip_interface(site["wg_interface_ip"]).network)]
+        for cidr in json.loads(site.get("lan_cidrs_json") or "[]"):
+            cidr = str(ipaddress.ip_network(str(cidr).strip(), strict=False))
+            if cidr not in routes:
+                routes.append(cidr)
+        self.dns = site.get("dns_wg_ip") or None
+        server_pub = (os.getenv("WG_SERVER_PUBLIC_KEY")
+                      or wg_live.snapshot(site.get("wg_interface")).public_key)
+        if not server_pub:
+            raise RuntimeError(f"no public key for interface {site.get('wg_interface')}")
+        self.peer_head = f"\n[Peer]\nPublicKey = {server_pub}\n"
+        self.peer_tail = (f"Endpoint = {site['endpoint_host']}:{site['endpoint_port']}\n"
+                          f"AllowedIPs = {', '.join(routes)}\n")
+
+    def render(self, peer, private_key=None) -> str:
+        dns = peer.get("dns_servers") or self.dns
+        psk = peer.get("preshared_key")
+        keepalive = peer.get("persistent_keepalive_s") or DEFAULT_KEEPALIVE
+        return "".join((
+            f"# {peer.get('label') or 'device'} (peer {peer['id']})\n",
+            "[Interface]\n",
+            f"PrivateKey = {private_key}\n" if private_key
+            else "# PrivateKey = <the key shown when this device was created>\n",
+            f"Address = {peer['address_cidr']}\n",
+            f"DNS = {dns}\n" if dns else "",
+            self.peer_head,
+            f"PresharedKey = {psk}\n" if psk else "",
+            self.peer_tail,
+            f"PersistentKeepalive = {keepalive}\n",
+        ))
+
+
+_templates = {}     # site id -> SiteTemplate
+_lock = threading.Lock()
+
+def template(site) -> SiteTemplate:
+    """Compiled template for `site`; recompiled when its updated_at moves."""
+    t = _templates.get(site["id"])
+    if t is not None and t.version == site["updated_at"]:
+        return t
+    t = SiteTemplate(site)
+    with _lock:
+        _templates[site["id"]] = t
+    return t
+
+
+def render(site, peer) -> str:
+    blob = peer.get("private_key_enc")
+    return template(site).render(peer, unseal(blob) if blob else None)
+
+def filename(peer) -> str:
+    label = re.sub(r"[^A-Za-z0-9_.-]+", "-", peer.get("label") or "device").strip("-.")
+    return f"{peer['id']}-{label or 'device'}.conf"
+
+
+# ---- streamed zip ----
+class _Sink:
+    # Write-only, unseekable: zipfile falls back to data descriptors and
+    # never needs to go back and patch headers.
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        out = b"".join(self.chunks)
+        self.chunks.clear()
+        return out
+
+def stream_zip(site, peers):
+    """Yield a zip of one .conf per peer, chunk by chunk, from any iterable."""
+    t = template(site)
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for peer in peers:
+            blob = peer.get("private_key_enc")
+            zf.writestr(filename(peer), t.render(peer, unseal(blob) if blob else None))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    yield sink.drain()
@@ -0,0 +1,112 @@
+# app/wgkeys.py
+# WireGuard key material without forking `wg genkey` / `wg pubkey` / `wg genpsk`.
+#
+# Keys are Curve25519 (X25519, RFC 7748) as 32 raw bytes, base64 encoded the way
+# `wg` prints them. The `cryptography` package is used when installed; otherwise
+# a pure-Python Montgomery ladder does the scalar multiplication (~1 ms/key on a
+# Pi 5, still far cheaper than two process spawns).
+
+import base64, os
+
+try:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+except Exception:  # pragma: no cover
+    X25519PrivateKey = None  # type: ignore
+
+KEY_LEN = 32
+
+_P = 2 ** 255 - 19
+_A24 = 121665
+_BASE_U = (9).to_bytes(32, "little")
+
+
+def _clamp(k: bytes) -> bytes:
+    b = bytearray(k)
+    b[0] &= 248
+    b[31] &= 127
+    b[31] |= 64
+    return bytes(b)
+
+def _x25519_py(k: bytes, u: bytes) -> bytes:
+    # RFC 7748 section 5, constant structure (not constant time; keys are
+    # generated here, never attacker-timed).
+    k = int.from_bytes(_clamp(k), "little")
+    x1 = int.from_bytes(u, "little") & ((1 << 255) - 1)
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    swap = 0
+    for t in range(254, -1, -1):
+        kt = (k >> t) & 1
+        if swap ^ kt:
+            x2, x3 = x3, x2
+            z2, z3 = z3, z2
+        swap = kt
+        a = x2 + z2
+        aa = a * a % _P
+        b = x2 - z2
+        bb = b * b % _P
+        e = aa - bb
+        c = x3 + z3
+        d = x3 - z3
+        da = d * a % _P
+        cb = c * b % _P
+        x3 = (da + cb) ** 2 % _P
+        z3 = x1 * (da - cb) ** 2 % _P
+        x2 = aa * bb % _P
+        z2 = e * (aa + _A24 * e) % _P
+    if swap:
+        x2, x3 = x3, x2
+        z2, z3 = z3, z2
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+def x25519(k: bytes, u: bytes) -> bytes:
+    """Raw X25519(k, u); used for the RFC 7748 vector checks."""
+    return _x25519_py(k, u)
+
+
+def encode(raw: bytes) -> str:
+    return base64.b64encode(raw).decode("ascii")
+
+def decode(key_b64: str) -> bytes:
+    raw = base64.b64decode(key_b64.strip(), validate=True)
+    if len(raw) != KEY_LEN:
+        raise ValueError("WireGuard keys are 32 bytes")
+    return raw
+
+
+def _public_raw(priv_raw: bytes) -> bytes:
+    if X25519PrivateKey is not None:
+        return X25519PrivateKey.from_private_bytes(priv_raw).public_key().public_bytes(
+            Encoding.Raw, PublicFormat.Raw)
+    return _x25519_py(priv_raw, _BASE_U)
+
+def genkey() -> str:
+    """Like `wg genkey`: 32 random bytes, clamped."""
+    return encode(_clamp(os.urandom(KEY_LEN)))
+
+def pubkey(private_b64: str) -> str:
+    """Like `wg pubkey`."""
+    return encode(_public_raw(decode(private_b64)))
+
+def genpsk() -> str:
+    """Like `wg genpsk`: 32 random bytes, no clamping."""
+    return encode(os.urandom(KEY_LEN))
+
+def genkeypair() -> tuple[str, str]:
+    priv = _clamp(os.urandom(KEY_LEN))
+    return encode(priv), encode(_public_raw(priv))
+
+def genkeypairs(n: int, psk: bool = False) -> list[tuple]:
+    """
+    n (private, public) pairs -- or (private, public, psk) with psk=True.
+    Randomness is drawn in one os.urandom call for the whole batch.
+    """
+    width = KEY_LEN * (2 if psk else 1)
+    pool = os.urandom(width * n)
+    out = []
+    for i in range(n):
+        chunk = pool[i * width:(i + 1) * width]
+        priv = _clamp(chunk[:KEY_LEN])
+        pair = (encode(priv), encode(_public_raw(priv)))
+        out.append(pair + (encode(chunk[KEY_LEN:]),) if psk else pair)
+    return out
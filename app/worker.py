@@ -0,0 +1,142 @@
+# app/worker.py
+# vpn-portal-worker.service entrypoint.
+#
+#   python -m app.worker                 # loop every WORKER_INTERVAL seconds
+#   python -m app.worker --once --dry-run
+#
+# Each tick reconciles every site's wg interface (app.sites) against the
+# enabled rows of `peers` minus users in a denied schedule window or without
+# a live portal session (app.reconcile, app.schedule, app.enforcer), then
+# records handshake/transfer telemetry from the same interface state
+# (app.telemetry). The
+# loop wakes early for the next schedule boundary instead of waiting out the
+# full interval.
+#
+# By default the loop is app.enforcer's asyncio deadline heap, which also
+# expires sessions the moment their idle/absolute deadline passes and reacts
+# to change notifications from the web app; the same loop serves the live
+# peer status stream (app.peerstream). --poll keeps the plain fixed interval
+# loop.
+
+import argparse, asyncio, json, logging, os, signal, threading, time
+
+from . import db, metrics, wg_live
+from .enforcer import ENFORCE_SESSIONS, Enforcer, SessionGate
+from .peerstream import PeerStream
+from .reconcile import Reconciler
+from .schedule import ScheduleBook
+from .telemetry import Telemetry
+
+log = logging.getLogger("vpn-portal-worker")
+
+WORKER_INTERVAL = float(os.getenv("WORKER_INTERVAL", "30"))
+
+
+class Worker:
+    def __init__(self, interval=WORKER_INTERVAL, dry_run=False):
+        self.interval = interval
+        self.dry_run = dry_run
+        self.schedules = ScheduleBook()
+        self.sessions = SessionGate() if ENFORCE_SESSIONS else None
+        self.reconciler = Reconciler(schedules=self.schedules, sessions=self.sessions)
+        self.telemetry = Telemetry()
+        self._conn = None
+        self._stop = threading.Event()
+
+    def conn(self):
+        # One long-lived autocommit connection: every SELECT sees fresh rows.
+        if self._conn is not None:
+            try:
+                self._conn.ping(reconnect=False)
+            except Exception:
+                self._conn = None
+        if self._conn is None:
+            self._conn = db.connect(autocommit=True)
+        return self._conn
+
+    def tick(self):
+        if self.schedules.refresh(self.conn()):
+            log.info("schedules: %d profiles (%d distinct)",
+                     self.schedules.metrics["profiles"], self.schedules.metrics["distinct"])
+        plan = self.reconciler.tick(self.conn(), dry_run=self.dry_run)
+        m = self.reconciler.metrics
+        if plan["add"] or plan["remove"] or self.dry_run:
+            log.info("reconcile%s: +%d -%d in %.1f ms",
+                     " (dry-run)" if self.dry_run else "",
+                     len(plan["add"]), len(plan["remove"]), m["last_tick_ms"])
+        else:
+            log.debug("reconcile: in sync in %.1f ms", m["last_tick_ms"])
+        if not self.dry_run:
+            rows, events = self.telemetry.sample(
+                self.conn(), snap=wg_live.merged(self.reconciler.interfaces(), max_age=1))
+            if rows or events:
+                log.info("telemetry: %d rows, %d events in %.1f ms",
+                         rows, events, self.telemetry.metrics["last_sample_ms"])
+        return plan
+
+    def run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.tick()
+            except Exception:
+                log.exception("worker tick failed")
+                self._conn = None
+            wait = self.interval - (time.monotonic() - started)
+            boundary = self.schedules.next_boundary()
+            if boundary is not None:
+                # +1 s so the new minute has started when we look again.
+                wait = min(wait, boundary - time.time() + 1.0)
+            self._stop.wait(max(0.0, wait))
+
+    def stop(self, *_):
+        self._stop.set()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m app.worker")
+    ap.add_argument("--once", action="store_true", help="run a single tick and exit")
+    ap.add_argument("--dry-run", action="store_true", help="print the plan, change nothing")
+    ap.add_argument("--interval", type=float, default=WORKER_INTERVAL)
+    ap.add_argument("--poll", action="store_true", help="fixed-interval loop, no deadline enforcer")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    metrics.set_role("worker")
+    w = Worker(interval=args.interval, dry_run=args.dry_run)
+    if args.once:
+        plan = w.tick()
+        if args.dry_run:
+            print(json.dumps({"add": [p["public_key"] for p in plan["add"]],
+                              "remove": plan["remove"],
+                              "metrics": w.reconciler.metrics}, indent=2, default=str))
+        return
+    if args.poll:
+        signal.signal(signal.SIGTERM, w.stop)
+        signal.signal(signal.SIGINT, w.stop)
+        w.run()
+        return
+
+    enforcer = Enforcer(w)
+    stream = enforcer.stream = PeerStream(enforcer._call, w.conn)
+
+    def _stop():
+        enforcer.stop()
+        stream.stop()
+
+    async def _run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, _stop)
+        live = asyncio.create_task(stream.run())
+        try:
+            await enforcer.run()
+        finally:
+            stream.stop()
+            await live
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
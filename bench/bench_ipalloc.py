@@ -0,0 +1,69 @@
+# bench/bench_ipalloc.py
+# Address allocation on large pools: app.ipalloc.PoolIndex vs the previous
+# "parse every address_cidr, walk net.hosts()" approach.
+#
+#   python bench/bench_ipalloc.py [--cidr 10.88.0.1/16] [--fill 0.9] [--allocs 2000]
+import argparse, ipaddress, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.ipalloc import AddressPool, PoolIndex, _parse_ip  # noqa: E402
+
+
+def legacy_next(rows, wg_interface_ip):
+    net = ipaddress.ip_network(wg_interface_ip, strict=False)
+    gw = ipaddress.ip_interface(wg_interface_ip).ip
+    used = {ipaddress.ip_interface(r).ip for r in rows}
+    used.add(gw)
+    for host in net.hosts():
+        if int(host) <= int(gw):
+            continue
+        if host not in used:
+            return f"{host}/32"
+    raise RuntimeError("No free addresses left in pool")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="ipalloc benchmark")
+    ap.add_argument("--cidr", default="10.88.0.1/16")
+    ap.add_argument("--fill", type=float, default=0.9)
+    ap.add_argument("--allocs", type=int, default=2000)
+    ap.add_argument("--legacy-allocs", type=int, default=20)
+    args = ap.parse_args()
+
+    pool = AddressPool.for_interface(args.cidr, range_spec="")
+    rnd = random.Random(7)
+    taken = rnd.sample(range(pool.first, pool.last + 1), int(pool.size * args.fill))
+    rows = [pool.cidr(ip) for ip in taken]
+    print(f"pool {args.cidr}: {pool.size} addresses, {len(rows)} in use")
+
+    t0 = time.perf_counter()
+    for _ in range(args.legacy_allocs):
+        rows.append(legacy_next(rows, args.cidr))
+    legacy = (time.perf_counter() - t0) / args.legacy_allocs
+    del rows[-args.legacy_allocs:]
+    print(f"legacy scan            {legacy * 1e3:10.3f} ms/alloc")
+
+    t0 = time.perf_counter()
+    idx = PoolIndex(pool, (_parse_ip(r) for r in rows))
+    print(f"index build            {(time.perf_counter() - t0) * 1e3:10.3f} ms (once per fingerprint change)")
+
+    for strategy in ("sequential", "random"):
+        i = PoolIndex(pool, taken)
+        n = min(args.allocs, i.free)
+        t0 = time.perf_counter()
+        for _ in range(n):
+            i.pick(strategy)
+        dt = (time.perf_counter() - t0) / n
+        print(f"index pick {strategy:<11} {dt * 1e6:10.3f} us/alloc  ({n} allocs)")
+
+    v6 = AddressPool.for_interface("fd00:88::1/64", range_spec="")
+    i = PoolIndex(v6)
+    t0 = time.perf_counter()
+    for _ in range(args.allocs):
+        i.pick("random")
+    print(f"ipv6 /64 random        {(time.perf_counter() - t0) / args.allocs * 1e6:10.3f} us/alloc  (sparse index)")
+
+
+if __name__ == "__main__":
+    main()
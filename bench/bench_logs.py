@@ -0,0 +1,179 @@
+# bench/bench_logs.py
+# Log listing, retention and CSV export on a few million synthetic
+# login_events rows: OFFSET vs keyset pages, one-shot DELETE vs the chunked
+# keyset purge (longest single statement = longest lock hold), and export
+# memory. Runs app.logs' own SQL against SQLite with the indexes from
+# db/migrations/002_log_indexes.sql, so the numbers show rows touched and
+# statement sizes rather than MariaDB timings.
+#
+#   python bench/bench_logs.py [--rows 2000000] [--page 200]
+import argparse, datetime, os, random, re, sqlite3, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import logs  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE login_events (id INTEGER PRIMARY KEY, user_id INTEGER, username_attempted TEXT,
+  success INTEGER NOT NULL, reason TEXT, ip_address TEXT, user_agent TEXT, created_at DATETIME NOT NULL);
+CREATE INDEX ix_login_created ON login_events (created_at, id);
+CREATE INDEX ix_login_user_created ON login_events (user_id, created_at, id);
+CREATE INDEX ix_login_success_created ON login_events (success, created_at, id);
+CREATE TABLE audit_log (id INTEGER PRIMARY KEY, user_id INTEGER, action TEXT, target_type TEXT,
+  target_id INTEGER, ip_address TEXT, user_agent TEXT, details_json TEXT, created_at DATETIME NOT NULL);
+CREATE INDEX ix_audit_created ON audit_log (created_at, id);
+CREATE TABLE peer_events (id INTEGER PRIMARY KEY, user_id INTEGER, peer_id INTEGER, action TEXT,
+  details_json TEXT, created_at DATETIME NOT NULL);
+CREATE INDEX ix_peer_events_created ON peer_events (created_at, id);
+"""
+
+
+class Cursor:
+    # Just enough of a PyMySQL cursor for app.logs: %s params, tuple
+    # expansion for IN %s, dict rows unless a cursor class was asked for.
+    def __init__(self, db, as_dict, timings):
+        self.db, self.as_dict, self.timings = db, as_dict, timings
+        self.cur = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, sql, args=()):
+        flat = []
+        def expand(m, it=iter(args)):
+            v = next(it)
+            if isinstance(v, tuple):
+                flat.extend(v)
+                return "(" + ",".join("?" * len(v)) + ")"
+            flat.append(v.strftime("%Y-%m-%d %H:%M:%S") if isinstance(v, datetime.datetime) else v)
+            return "?"
+        t0 = time.perf_counter()
+        self.cur = self.db.execute(re.sub("%s", expand, sql), flat)
+        self.timings.append(time.perf_counter() - t0)
+
+    def _row(self, r):
+        return {d[0]: v for d, v in zip(self.cur.description, r)} if self.as_dict else r
+
+    def fetchone(self):
+        r = self.cur.fetchone()
+        return None if r is None else self._row(r)
+
+    def fetchall(self):
+        return [self._row(r) for r in self.cur.fetchall()]
+
+    def __iter__(self):
+        return (self._row(r) for r in self.cur)
+
+
+class Conn:
+    def __init__(self, db):
+        self.db, self.timings = db, []
+
+    def cursor(self, cursorclass=None):
+        return Cursor(self.db, cursorclass is None, self.timings)
+
+
+def populate(db, n, days):
+    rng = random.Random(3)
+    start = datetime.datetime(2026, 1, 1)
+    step = days * 86400 / n
+    reasons = ("password_ok", "bad_password", "mfa_ok", "mfa_bad_code", "locked")
+    def rows():
+        for i in range(1, n + 1):
+            ok = rng.random() < 0.8
+            yield (i, rng.randrange(1, 500), f"user{rng.randrange(1, 600)}", int(ok),
+                   rng.choice(reasons), f"203.0.113.{rng.randrange(1, 255)}", "Mozilla/5.0",
+                   (start + datetime.timedelta(seconds=i * step)).strftime("%Y-%m-%d %H:%M:%S"))
+    db.executemany("INSERT INTO login_events VALUES (?,?,?,?,?,?,?,?)", rows())
+    db.commit()
+    return start + datetime.timedelta(days=days)
+
+
+def timed(fn, *a):
+    t0 = time.perf_counter()
+    out = fn(*a)
+    return out, (time.perf_counter() - t0) * 1000.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="log retention / listing / export benchmark")
+    ap.add_argument("--rows", type=int, default=2_000_000)
+    ap.add_argument("--days", type=int, default=180, help="time span of the synthetic rows")
+    ap.add_argument("--page", type=int, default=200, help="page number to fetch")
+    args = ap.parse_args()
+
+    sqlite3.register_converter("DATETIME", lambda b: datetime.datetime.fromisoformat(b.decode()))
+    db = sqlite3.connect(":memory:", isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES)
+    db.executescript(SCHEMA)
+    t0 = time.perf_counter()
+    now = populate(db, args.rows, args.days)
+    print(f"{args.rows} login_events over {args.days} days (loaded in {time.perf_counter() - t0:.1f} s)")
+    conn = Conn(db)
+    filters = {"user_id": 42, "since": (now - datetime.timedelta(days=120)).strftime("%Y-%m-%d")}
+
+    # -- listing: page N by OFFSET vs by keyset cursor --
+    # Walk to --page, or to the last page when there are fewer.
+    size = logs.LOG_PAGE_SIZE
+    cursor, page = None, 0
+    while page < args.page:
+        sql, a = logs.build("login_events", {"success": 0}, cursor, size)
+        with conn.cursor() as cur:
+            cur.execute(sql, a)
+            rows = cur.fetchall()
+        if len(rows) < size:
+            break
+        cursor, page = logs.encode_cursor(rows[-1]), page + 1
+    sql, a = logs.build("login_events", {"success": 0})
+    with conn.cursor() as cur:
+        _, t_off = timed(cur.execute, sql + f" LIMIT {size} OFFSET {size * page}", a)
+        cur.fetchall()
+    sql, a = logs.build("login_events", {"success": 0}, cursor, size)
+    with conn.cursor() as cur:
+        _, t_key = timed(lambda: (cur.execute(sql, a), cur.fetchall()))
+    print(f"  page {page} (success=0)   OFFSET {t_off:8.2f} ms   keyset {t_key:8.2f} ms")
+
+    sql, a = logs.build("login_events", filters, None, size)
+    with conn.cursor() as cur:
+        _, t_f = timed(lambda: (cur.execute(sql, a), cur.fetchall()))
+    print(f"  user + since, page 1        {t_f:8.2f} ms")
+
+    # -- export: streamed vs materialised (memory measured on a second pass;
+    #    tracemalloc slows allocation too much to time under it) --
+    t0 = time.perf_counter()
+    n_bytes = sum(len(c) for c in logs.iter_csv("login_events", {"success": 1}, conn=conn))
+    t_csv = time.perf_counter() - t0
+    tracemalloc.start()
+    for _ in logs.iter_csv("login_events", {"success": 1}, conn=conn):
+        pass
+    peak_stream = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    sql, a = logs.build("login_events", {"success": 1})
+    with conn.cursor(object) as cur:
+        cur.execute(sql, a)
+        everything = cur.fetchall()
+    peak_all = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del everything
+    print(f"  CSV export  {n_bytes / 1e6:7.1f} MB in {t_csv:.2f} s   peak {peak_stream / 1e6:6.2f} MB"
+          f"   (fetchall alone: {peak_all / 1e6:.0f} MB)")
+
+    # -- retention: chunked keyset purge vs a single DELETE --
+    db.execute("SAVEPOINT s")
+    cutoff = (now - datetime.timedelta(days=logs.LOG_RETENTION_DAYS)).strftime("%Y-%m-%d %H:%M:%S")
+    _, t_one = timed(db.execute, "DELETE FROM login_events WHERE created_at < ?", (cutoff,))
+    n_one = db.execute("SELECT changes()").fetchone()[0]
+    db.execute("ROLLBACK TO s")
+    db.execute("RELEASE s")
+    conn.timings.clear()
+    out, t_chunked = timed(lambda: logs.purge(conn, pause=0, now=now))
+    worst = max(conn.timings) * 1000.0
+    print(f"  purge {n_one} rows   one DELETE {t_one:8.1f} ms (one lock hold)   "
+          f"chunked {t_chunked:8.1f} ms total, longest statement {worst:.1f} ms")
+    assert out["login_events"] == n_one, out
+
+
+if __name__ == "__main__":
+    main()
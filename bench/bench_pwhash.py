@@ -0,0 +1,98 @@
+# bench/bench_pwhash.py
+# Login hashing under contention: gunicorn-like processes x threads hammer
+# password checks, inline (as /login used to) vs through app.pwhash, while a
+# probe process times a small fixed piece of work the way /healthz or a peer
+# page would. Reports logins/s, latency percentiles, 429s and probe latency.
+#
+#   python bench/bench_pwhash.py [--procs 9] [--threads 2] [--seconds 10] [--rounds 12]
+import argparse, multiprocessing as mp, os, sys, tempfile, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bcrypt  # noqa: E402
+
+from app import pwhash  # noqa: E402
+
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))] * 1000.0 if xs else float("nan")
+
+
+def client_proc(mode, threads, seconds, stored, out):
+    lat, busy = [], [0]
+    stop = time.monotonic() + seconds
+    def run():
+        while time.monotonic() < stop:
+            t0 = time.monotonic()
+            if mode == "inline":
+                pwhash._check(stored, "correct horse")
+            else:
+                try:
+                    pwhash.verify(stored, "correct horse")
+                except pwhash.Busy:
+                    busy[0] += 1
+                    time.sleep(0.05)       # a client backing off after 429
+                    continue
+            lat.append(time.monotonic() - t0)
+    ts = [threading.Thread(target=run) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    out.put((lat, busy[0]))
+
+
+def probe_proc(seconds, out):
+    lat = []
+    stop = time.monotonic() + seconds
+    while time.monotonic() < stop:
+        t0 = time.monotonic()
+        sum(i * i for i in range(20000))       # ~1 ms of request work
+        lat.append(time.monotonic() - t0)
+        time.sleep(0.02)
+    out.put(lat)
+
+
+def run(mode, args, stored):
+    out, pout = mp.Queue(), mp.Queue()
+    procs = [mp.Process(target=client_proc, args=(mode, args.threads, args.seconds, stored, out))
+             for _ in range(args.procs)]
+    probe = mp.Process(target=probe_proc, args=(args.seconds, pout))
+    for p in procs + [probe]:
+        p.start()
+    lat, busy = [], 0
+    for _ in procs:
+        l, b = out.get()
+        lat += l
+        busy += b
+    plat = pout.get()
+    for p in procs + [probe]:
+        p.join()
+    print(f"  {mode:7s} {len(lat) / args.seconds:7.1f} logins/s   p50 {pct(lat, .5):7.1f} ms"
+          f"   p99 {pct(lat, .99):7.1f} ms   429s {busy:5d}   probe p50 {pct(plat, .5):6.2f} ms"
+          f"   p99 {pct(plat, .99):6.2f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="password hashing admission benchmark")
+    ap.add_argument("--procs", type=int, default=2 * (os.cpu_count() or 2) + 1)
+    ap.add_argument("--threads", type=int, default=2)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--rounds", type=int, default=12, help="bcrypt cost of the stored hash")
+    args = ap.parse_args()
+    pwhash.PWHASH_LOCK_DIR = tempfile.mkdtemp()
+    pwhash.PWHASH_BCRYPT_ROUNDS = args.rounds      # no upgrades during the run
+    stored = bcrypt.hashpw(b"correct horse", bcrypt.gensalt(args.rounds)).decode()
+    t0 = time.perf_counter()
+    pwhash._check(stored, "correct horse")
+    print(f"{args.procs} procs x {args.threads} threads, bcrypt cost {args.rounds} "
+          f"({(time.perf_counter() - t0) * 1000:.0f} ms/hash), {os.cpu_count()} cores, "
+          f"{pwhash.PWHASH_SLOTS} slots, queue {pwhash.PWHASH_QUEUE}")
+    mp.set_start_method("fork")
+    run("inline", args, stored)
+    run("pwhash", args, stored)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# bench/bench_qr.py
+# QR render cost for an otpauth:// URI and a WireGuard client config:
+# matrix encoding vs PNG/SVG rasterising (app.qr), the old qrcode.make()+PIL
+# PNG path, and a cache hit.
+#
+#   python bench/bench_qr.py [--n 50]
+import argparse, os, sys, time, zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import qr  # noqa: E402
+
+OTPAUTH = ("otpauth://totp/CITS%20VPN%20Portal:alice?secret=JBSWY3DPEHPK3PXPJBSWY3DPEHPK3PXP"
+           "&issuer=CITS%20VPN%20Portal&algorithm=SHA1&digits=6&period=30")
+CONF = """[Interface]
+PrivateKey = yAnz5TF+lXXJte14tji3zlMNq+hd2rYUIgJBgB3fBmk=
+Address = 10.8.0.42/32
+DNS = 10.8.0.1
+
+[Peer]
+PublicKey = xTIBA5rboUvnH4htodjb6e697QjLERt1NAB4mZqp8Dg=
+PresharedKey = 6D4Sh2mRzV2e3m0s0iJvJ9cH1p0l0r6W7Yx8k3Zq1aE=
+Endpoint = vpn.example.com:51820
+AllowedIPs = 0.0.0.0/0, ::/0
+PersistentKeepalive = 25
+"""
+
+
+def timeit(fn, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) / n * 1000.0
+
+
+def check_png(png, m, scale):
+    # Decode our 1-bit PNG and compare every module with the matrix.
+    assert png[:8] == b"\x89PNG\r\n\x1a\n"
+    size = len(m) * scale
+    idat = png[png.index(b"IDAT") + 4:png.index(b"IEND") - 8]
+    raw = zlib.decompress(idat)
+    stride = 1 + (size + 7) // 8
+    assert len(raw) == stride * size
+    for y, row in enumerate(m):
+        line = raw[y * scale * stride + 1:(y * scale + 1) * stride]
+        for x, dark in enumerate(row):
+            px = (line[x * scale // 8] >> (7 - x * scale % 8)) & 1
+            assert px == (0 if dark else 1), (x, y)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="QR PNG vs SVG render benchmark")
+    ap.add_argument("--n", type=int, default=50)
+    args = ap.parse_args()
+    try:
+        import qrcode
+    except Exception:
+        print("qrcode is not installed; nothing to measure")
+        return
+
+    for name, payload in (("otpauth", OTPAUTH), ("wg .conf", CONF)):
+        m = qr.matrix(payload)
+        png, svg = qr.to_png(m), qr.to_svg(m)
+        check_png(png, m, qr.QR_SCALE)
+        print(f"{name}: {len(m) - 2 * qr.QR_BORDER} modules/side, "
+              f"png {len(png)} B, svg {len(svg)} B")
+        print(f"  matrix encode        {timeit(lambda: qr.matrix(payload), args.n):8.3f} ms")
+        print(f"  png from matrix      {timeit(lambda: qr.to_png(m), args.n):8.3f} ms")
+        print(f"  svg from matrix      {timeit(lambda: qr.to_svg(m), args.n):8.3f} ms")
+        try:
+            import io
+            import PIL  # noqa: F401
+
+            def legacy():
+                buf = io.BytesIO()
+                qrcode.make(payload).save(buf, format="PNG")
+            print(f"  qrcode.make+PIL png  {timeit(legacy, args.n):8.3f} ms   (old /mfa/qr.png)")
+        except ImportError:
+            print("  qrcode.make+PIL png       n/a   (Pillow not installed)")
+        from qrcode.image.svg import SvgPathImage
+        print(f"  qrcode SvgPathImage  "
+              f"{timeit(lambda: qrcode.make(payload, image_factory=SvgPathImage).to_string(), args.n):8.3f} ms")
+        qr.render(payload, "svg")
+        print(f"  cached render        {timeit(lambda: qr.render(payload, 'svg'), args.n * 100):8.4f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# bench/bench_schedule.py
+# Schedule evaluation for N users: compile + load of deny_schedules rows,
+# one worker tick (denied_set), next boundary, vs evaluating the JSON ranges
+# directly every tick.
+#
+#   python bench/bench_schedule.py [--users 10000] [--distinct 0]
+import argparse, datetime, json, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from zoneinfo import ZoneInfo  # noqa: E402
+
+from app import schedule  # noqa: E402
+
+TZ = "America/New_York"
+
+
+def random_policy(rng):
+    pol = {}
+    for day in schedule.DAYS:
+        if rng.random() < 0.6:
+            ranges = []
+            for _ in range(rng.randint(1, 3)):
+                a = rng.randrange(0, 24 * 60, 15)
+                b = (a + rng.randrange(30, 10 * 60, 15)) % (24 * 60)
+                ranges.append([f"{a // 60:02d}:{a % 60:02d}", f"{b // 60:02d}:{b % 60:02d}"])
+            pol[day] = ranges
+    if rng.random() < 0.3:
+        pol["mode"] = "allow"
+    return pol
+
+
+def naive_denied(policy, ts, tz):
+    # What a worker without the engine does: parse and walk the ranges.
+    policy = json.loads(policy)
+    local = datetime.datetime.fromtimestamp(ts, tz)
+    m = local.hour * 60 + local.minute
+    day = local.weekday()
+    hit = False
+    for d, ranges in policy.items():
+        if d == "mode":
+            continue
+        di = schedule.DAYS.index(d)
+        for a, b in ranges:
+            a, b = schedule._minute(a), schedule._minute(b)
+            if a < b:
+                hit |= di == day and a <= m < b
+            else:   # past midnight
+                hit |= (di == day and m >= a) or ((di + 1) % 7 == day and m < b)
+    return (not hit) if policy.get("mode") == "allow" else hit
+
+
+def main():
+    ap = argparse.ArgumentParser(description="schedule engine benchmark")
+    ap.add_argument("--users", type=int, default=10000)
+    ap.add_argument("--distinct", type=int, default=0,
+                    help="number of distinct policies (0 = every user unique)")
+    args = ap.parse_args()
+    rng = random.Random(7)
+    pool = [json.dumps(random_policy(rng)) for _ in range(args.distinct or args.users)]
+    rows = [{"id": i, "site_id": 1, "user_id": i, "timezone": TZ,
+             "policy_json": pool[i % len(pool)]} for i in range(args.users)]
+    pairs = [(1, i) for i in range(args.users)]
+    tz = ZoneInfo(TZ)
+
+    book = schedule.ScheduleBook()
+    t0 = time.perf_counter()
+    book.load(rows)
+    t_load = time.perf_counter() - t0
+    print(f"{args.users} users, {book.metrics['distinct']} distinct profiles")
+    print(f"  compile+load          {t_load * 1000:9.2f} ms")
+
+    now = time.time()
+    n = 20
+    t0 = time.perf_counter()
+    for k in range(n):
+        denied = book.denied_set(pairs, now + k * 60)
+    t_tick = (time.perf_counter() - t0) / n
+    print(f"  tick (denied_set)     {t_tick * 1000:9.2f} ms   "
+          f"({t_tick / args.users * 1e9:.0f} ns/user, {len(denied)} denied)")
+
+    t0 = time.perf_counter()
+    naive = {(1, r["user_id"]) for r in rows if naive_denied(r["policy_json"], now + (n - 1) * 60, tz)}
+    t_naive = time.perf_counter() - t0
+    assert naive == denied, "engine disagrees with the JSON ranges"
+    print(f"  tick (parse ranges)   {t_naive * 1000:9.2f} ms   (results match)")
+
+    book._next = None
+    t0 = time.perf_counter()
+    nb = book.next_boundary(now)
+    t_nb = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(1000):
+        book.next_boundary(now)
+    t_nb_cached = (time.perf_counter() - t0) / 1000
+    print(f"  next_boundary         {t_nb * 1000:9.2f} ms   (then {t_nb_cached * 1e6:.2f} us cached;"
+          f" in {nb - now:.0f} s)")
+    t0 = time.perf_counter()
+    for uid in range(1000):
+        book.next_transition(1, uid, now)
+    print(f"  next_transition/user  {(time.perf_counter() - t0) / 1000 * 1e6:9.2f} us")
+
+
+if __name__ == "__main__":
+    main()
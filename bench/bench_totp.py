@@ -0,0 +1,73 @@
+# bench/bench_totp.py
+# TOTP verifications/sec: the previous per-step decode+HMAC path vs
+# app.totp.TotpVerifier (decode once, hmac.copy() per step) and verify_batch.
+#
+#   python bench/bench_totp.py [--n 20000]
+import argparse, base64, hashlib, hmac, os, struct, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import totp  # noqa: E402
+
+# RFC 6238 appendix B (T=59, 8 digits).
+RFC6238 = [
+    (b"12345678901234567890", "SHA1", "94287082"),
+    (b"12345678901234567890123456789012", "SHA256", "46119246"),
+    (b"1234567890123456789012345678901234567890123456789012345678901234", "SHA512", "90693936"),
+]
+
+
+def legacy_verify(secret_b32, code, timestamp, window=1, digits=6, period=30):
+    # app.totp.verify_totp before TotpVerifier: decode + new HMAC per step
+    def hotp(counter):
+        key = base64.b32decode(totp._b32_normalize(secret_b32))
+        h = hmac.new(key, struct.pack(">Q", counter), hashlib.sha1).digest()
+        return totp._dynamic_truncate(h) % (10 ** digits)
+    code_int = int(code)
+    counter = int(timestamp // period)
+    for off in range(-window, window + 1):
+        if hotp(counter + off) == code_int:
+            return True
+    return False
+
+
+def check_vectors():
+    for key, algo, want in RFC6238:
+        b32 = base64.b32encode(key).decode("ascii")
+        v = totp.TotpVerifier(b32, digits=8, algorithm=algo, window=0)
+        assert v.now(59) == want, (algo, v.now(59), want)
+        assert v.verify(want, 59)
+    print("RFC 6238 vectors ok (SHA1/SHA256/SHA512)")
+
+
+def rate(label, n, fn):
+    t0 = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t0
+    print(f"{label:<34} {n / dt:12.0f} verifications/s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="TOTP verification benchmark")
+    ap.add_argument("--n", type=int, default=20000)
+    args = ap.parse_args()
+
+    check_vectors()
+    now = int(time.time())
+    secrets = [totp.generate_base32_secret() for _ in range(256)]
+    # Worst case for the window loop: a wrong code checks all three steps.
+    codes = [("000000" if i % 2 else totp.TotpVerifier(s).now(now)) for i, s in enumerate(secrets)]
+    items = [(secrets[i % 256], codes[i % 256]) for i in range(args.n)]
+
+    rate("legacy (decode + HMAC per step)", args.n,
+         lambda: [legacy_verify(s, c, now) for s, c in items])
+    totp.forget()
+    rate("verify_totp (cached verifier)", args.n,
+         lambda: [totp.verify_totp(s, c, timestamp=now) for s, c in items])
+    rate("verify_batch", args.n, lambda: totp.verify_batch(items, timestamp=now))
+    assert totp.verify_batch(items[:256], timestamp=now) == [
+        legacy_verify(s, c, now) for s, c in items[:256]]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# bench/bench_wg_dump.py
+# Parse time of `wg show <if> dump` into app.wg.Snapshot for synthetic peer sets.
+#
+#   python bench/bench_wg_dump.py [--peers 250,10000] [--repeat 50]
+import argparse, base64, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.wg import parse_dump  # noqa: E402
+
+
+def synth_dump(n, seed=1):
+    rnd = random.Random(seed)
+    key = lambda: base64.b64encode(rnd.randbytes(32)).decode("ascii")
+    now = int(time.time())
+    rows = ["\t".join([key(), key(), "51820", "off"])]
+    for i in range(n):
+        online = rnd.random() < 0.6
+        rows.append("\t".join([
+            key(),
+            key() if rnd.random() < 0.5 else "(none)",
+            f"198.51.100.{i % 254 + 1}:{rnd.randint(1024, 65535)}" if online else "(none)",
+            f"10.{88 + (i >> 16)}.{(i >> 8) & 255}.{i & 255}/32",
+            str(now - rnd.randint(0, 300)) if online else "0",
+            str(rnd.randint(0, 1 << 34)),
+            str(rnd.randint(0, 1 << 34)),
+            "25" if rnd.random() < 0.3 else "off",
+        ]))
+    return "\n".join(rows) + "\n"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="wg dump parse benchmark")
+    ap.add_argument("--peers", default="250,10000")
+    ap.add_argument("--repeat", type=int, default=50)
+    args = ap.parse_args()
+
+    for n in (int(x) for x in args.peers.split(",")):
+        text = synth_dump(n)
+        snap = parse_dump(text)
+        assert len(snap.peers) == n
+        best = float("inf")
+        t_all = time.perf_counter()
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            parse_dump(text)
+            best = min(best, time.perf_counter() - t0)
+        mean = (time.perf_counter() - t_all) / args.repeat
+        print(f"{n:>6} peers  {len(text) / 1024:8.1f} KiB  "
+              f"best {best * 1e3:8.3f} ms  mean {mean * 1e3:8.3f} ms  "
+              f"({n / best / 1e6:.2f} M peers/s)")
+
+
+if __name__ == "__main__":
+    main()
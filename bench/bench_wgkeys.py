@@ -0,0 +1,83 @@
+# bench/bench_wgkeys.py
+# Checks app.wgkeys against RFC 7748 / `wg` vectors, then times in-process key
+# generation against the old `wg genkey | wg pubkey` subprocess pair.
+#
+#   python bench/bench_wgkeys.py [--n 200] [--wg /usr/bin/wg]
+import argparse, base64, os, shutil, subprocess, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import wgkeys  # noqa: E402
+
+# RFC 7748 section 6.1 (Alice/Bob) and section 5.2 (single scalar mult).
+RFC7748 = [
+    ("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a",
+     "0900000000000000000000000000000000000000000000000000000000000000",
+     "8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a"),
+    ("5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb",
+     "0900000000000000000000000000000000000000000000000000000000000000",
+     "de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f"),
+    ("a546e36bf0527c9d3b16154b82465edd62144c0ac1fc5a18506a2244ba449ac4",
+     "e6db6867583030db3594c1a424b15f7c726624ec26b3353b10a903a6d0ab1c4c",
+     "c3da55379de9c6908e94ea4df28d084f32eccf03491c71f754b4075577a28552"),
+]
+# `wg pubkey` output for a fixed private key (RFC 7748 Alice, base64).
+WG_VECTOR = ("dwdtCnMYpX08FsFyUbJmRd9ML4frwJkqsXf7pR25LCo=",
+             "hSDwCYkwp1R0i33ctD73Wg2/Og0mOBr066SpjqqbTmo=")
+
+
+def check_vectors():
+    for k, u, want in RFC7748:
+        got = wgkeys.x25519(bytes.fromhex(k), bytes.fromhex(u)).hex()
+        assert got == want, (k, got, want)
+    priv, pub = WG_VECTOR
+    assert wgkeys.pubkey(priv) == pub, wgkeys.pubkey(priv)
+    assert wgkeys.encode(wgkeys._x25519_py(wgkeys.decode(priv), wgkeys._BASE_U)) == pub
+    a_priv, a_pub = wgkeys.genkeypair()
+    assert wgkeys.pubkey(a_priv) == a_pub
+    assert len(base64.b64decode(wgkeys.genpsk())) == 32
+    print(f"vectors ok (backend: {'cryptography' if wgkeys.X25519PrivateKey else 'pure python'})")
+
+
+def subprocess_pair(wg_bin):
+    priv = subprocess.run([wg_bin, "genkey"], text=True, capture_output=True, check=True).stdout.strip()
+    pub = subprocess.run([wg_bin, "pubkey"], text=True, input=priv, capture_output=True, check=True).stdout.strip()
+    return priv, pub
+
+
+def rate(label, n, fn):
+    t0 = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t0
+    print(f"{label:<28} {n / dt:10.0f} keypairs/s  ({dt / n * 1e6:9.1f} us each)")
+    return dt
+
+
+def main():
+    ap = argparse.ArgumentParser(description="wg key generation benchmark")
+    ap.add_argument("--n", type=int, default=200)
+    ap.add_argument("--wg", default=os.getenv("WG_BIN", "/usr/bin/wg"))
+    args = ap.parse_args()
+
+    check_vectors()
+    rate("wgkeys.genkeypair", args.n, lambda: [wgkeys.genkeypair() for _ in range(args.n)])
+    rate("wgkeys.genkeypairs(batch)", args.n, lambda: wgkeys.genkeypairs(args.n))
+    saved = wgkeys.X25519PrivateKey
+    wgkeys.X25519PrivateKey = None
+    try:
+        rate("pure-python fallback", args.n, lambda: wgkeys.genkeypairs(args.n))
+    finally:
+        wgkeys.X25519PrivateKey = saved
+
+    wg_bin = shutil.which(args.wg) or (args.wg if os.path.exists(args.wg) else None)
+    if wg_bin:
+        n = min(args.n, 50)
+        priv, pub = subprocess_pair(wg_bin)
+        assert wgkeys.pubkey(priv) == pub, "in-process pubkey disagrees with wg"
+        rate("wg genkey + wg pubkey", n, lambda: [subprocess_pair(wg_bin) for _ in range(n)])
+    else:
+        print(f"{args.wg} not found; skipping subprocess comparison")
+
+
+if __name__ == "__main__":
+    main()
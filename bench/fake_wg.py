@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# bench/fake_wg.py
+# Stand-in for /usr/bin/wg (WG_BIN) backed by a JSON state file, for
+# bench/loadtest.py: thousands of peers without a kernel interface or root.
+#
+#   FAKE_WG_STATE=/tmp/wg.json bench/fake_wg.py show wg0 dump
+#
+# Understands what app.wg's subprocess backend runs: `show <if> [dump]` and
+# `set <if> peer K [remove] [allowed-ips X] [persistent-keepalive N] ...`
+# (several peers per call). Handshakes and transfer counters are derived from
+# each key and the clock, so ~60% of peers look online and bytes keep growing.
+# FAKE_WG_DELAY adds a fixed per-call latency (seconds) to mimic a slow box.
+import base64, fcntl, json, os, sys, time, zlib
+
+STATE = os.getenv("FAKE_WG_STATE", "/tmp/fake-wg.json")
+DELAY = float(os.getenv("FAKE_WG_DELAY", "0"))
+
+
+def new_state(port=51820):
+    key = lambda: base64.b64encode(os.urandom(32)).decode("ascii")
+    return {"private_key": key(), "public_key": key(), "listen_port": port, "peers": {}}
+
+
+def load_state(path=None):
+    try:
+        with open(path or STATE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return new_state()
+
+
+def save_state(state, path=None):
+    path = path or STATE
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def _telemetry(pub, now):
+    h = zlib.crc32(pub.encode("ascii"))
+    if h % 10 >= 6:
+        return "(none)", 0, 0, 0
+    endpoint = f"198.51.100.{h % 254 + 1}:{1024 + h % 60000}"
+    rate = 1 + (h >> 8) % 4096                      # bytes/s
+    return endpoint, now - (h >> 4) % 170, rate * (now % 86400), rate * 3 * (now % 86400)
+
+
+def dump(state):
+    now = int(time.time())
+    out = ["\t".join([state["private_key"], state["public_key"], str(state["listen_port"]), "off"])]
+    for pub, p in state["peers"].items():
+        endpoint, hs, rx, tx = _telemetry(pub, now)
+        out.append("\t".join([pub, p.get("preshared_key") or "(none)", endpoint,
+                              p.get("allowed_ips") or "(none)", str(hs), str(rx), str(tx),
+                              str(p.get("keepalive") or "off")]))
+    return "\n".join(out) + "\n"
+
+
+def show(state, iface):
+    now = int(time.time())
+    out = [f"interface: {iface}", f"  public key: {state['public_key']}",
+           "  private key: (hidden)", f"  listening port: {state['listen_port']}", ""]
+    for pub, p in state["peers"].items():
+        endpoint, hs, rx, tx = _telemetry(pub, now)
+        out.append(f"peer: {pub}")
+        if endpoint != "(none)":
+            out.append(f"  endpoint: {endpoint}")
+        out.append(f"  allowed ips: {p.get('allowed_ips') or '(none)'}")
+        if hs:
+            out.append(f"  latest handshake: {now - hs} seconds ago")
+            out.append(f"  transfer: {rx} B received, {tx} B sent")
+        if p.get("keepalive"):
+            out.append(f"  persistent keepalive: every {p['keepalive']} seconds")
+        out.append("")
+    return "\n".join(out)
+
+
+def apply_set(state, args):
+    i, peer = 0, None
+    while i < len(args):
+        a = args[i]
+        if a == "peer":
+            peer = args[i + 1]
+            state["peers"].setdefault(peer, {})
+            i += 2
+        elif a == "remove" and peer is not None:
+            state["peers"].pop(peer, None)
+            peer = None
+            i += 1
+        elif a == "listen-port":
+            state["listen_port"] = int(args[i + 1])
+            i += 2
+        elif peer is not None and a in ("allowed-ips", "persistent-keepalive", "endpoint",
+                                         "preshared-key"):
+            v = args[i + 1]
+            if a == "preshared-key":      # like wg: a file holding the key
+                with open(v) as f:
+                    v = f.read().strip()
+            if a == "persistent-keepalive":
+                state["peers"][peer]["keepalive"] = None if v == "off" else int(v)
+            else:
+                state["peers"][peer][a.replace("-", "_")] = v
+            i += 2
+        else:
+            raise ValueError(f"Invalid argument: {a}")
+
+
+def main(argv):
+    if DELAY:
+        time.sleep(DELAY)
+    if len(argv) < 2 or argv[0] not in ("show", "set"):
+        print("Usage: fake_wg.py show <if> [dump] | set <if> peer <key> ...", file=sys.stderr)
+        return 1
+    with open(STATE + ".lock", "a") as lf:
+        fcntl.flock(lf, fcntl.LOCK_SH if argv[0] == "show" else fcntl.LOCK_EX)
+        state = load_state()
+        if argv[0] == "show":
+            sys.stdout.write(dump(state) if argv[2:3] == ["dump"] else show(state, argv[1]))
+            return 0
+        try:
+            apply_set(state, argv[2:])
+        except (IndexError, ValueError) as e:
+            print(f"Unable to modify interface: {e}", file=sys.stderr)
+            return 1
+        save_state(state)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
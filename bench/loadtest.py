@@ -0,0 +1,354 @@
+# bench/loadtest.py
+# End-to-end load test of the real app (app.create_app) without a Pi: a
+# throwaway MariaDB seeded from db/vpn_portal_schema.sql (+ db/migrations) and
+# bench/fake_wg.py as WG_BIN, driven by scripted scenarios from client threads
+# (one process, like a single gunicorn gthread worker). Reports req/s, p50/p99
+# and DB queries per request (from the Server-Timing header) per request type.
+#
+#   python bench/loadtest.py [--scenarios login,peers250,peers5k,bulk,poll]
+#                            [--threads 8] [--seconds 10] [--db-url mysql+pymysql://...]
+#                            [--json out.json] [--baseline previous.json]
+#
+# Without --db-url, mariadb-install-db/mariadbd (or the mysql_* equivalents)
+# must be on PATH; the instance lives in a temp dir and is killed at exit.
+# --db-url points at an empty scratch database instead: it is DROPPED and
+# reloaded. With --baseline, exits 1 when a request type got slower than
+# --tolerance (p99 or req/s) or issues more queries than before.
+import argparse, base64, getpass, json, os, shutil, socket, subprocess, sys, tempfile, \
+    threading, time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH)
+
+import pymysql  # noqa: E402
+from pymysql.constants import CLIENT  # noqa: E402
+
+import fake_wg  # noqa: E402
+
+SCENARIOS = ("login", "peers250", "peers5k", "bulk", "poll")
+PASSWORD = "loadtest-password"
+
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))] * 1000.0 if xs else float("nan")
+
+
+# ---- database ----
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_mariadb(root):
+    install = shutil.which("mariadb-install-db") or shutil.which("mysql_install_db")
+    server = next((p for p in (shutil.which("mariadbd"), shutil.which("mysqld"),
+                               "/usr/sbin/mariadbd", "/usr/sbin/mysqld") if p and os.path.exists(p)), None)
+    if not install or not server:
+        sys.exit("loadtest: no mariadbd/mariadb-install-db on PATH; pass --db-url")
+    datadir = os.path.join(root, "mysql")
+    user = [f"--user={getpass.getuser()}"] if os.geteuid() == 0 else []
+    subprocess.run([install, "--no-defaults", f"--datadir={datadir}", "--skip-test-db",
+                    "--auth-root-authentication-method=normal"] + user,
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    port = _free_port()
+    log = open(os.path.join(root, "mariadbd.log"), "w")
+    proc = subprocess.Popen([server, "--no-defaults", f"--datadir={datadir}",
+                             f"--socket={os.path.join(root, 'mysql.sock')}", f"--port={port}",
+                             "--bind-address=127.0.0.1", "--skip-grant-tables", "--skip-log-bin",
+                             "--innodb-buffer-pool-size=256M", "--max-connections=500"] + user,
+                            stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            pymysql.connect(host="127.0.0.1", port=port, user="root").close()
+            break
+        except pymysql.err.OperationalError:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                sys.exit(f"loadtest: mariadbd did not start, see {log.name}")
+            time.sleep(0.2)
+    return proc, f"mysql+pymysql://root@127.0.0.1:{port}/vpn_portal_bench"
+
+def load_schema(url):
+    from app.db import _parse_mysql_url
+    cfg = _parse_mysql_url(url)
+    name = cfg.pop("database")
+    conn = pymysql.connect(client_flag=CLIENT.MULTI_STATEMENTS, autocommit=True,
+                           charset="utf8mb4", **cfg)
+    with conn.cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS `{name}`")
+        cur.execute(f"CREATE DATABASE `{name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+        cur.execute(f"USE `{name}`")
+        files = [os.path.join(ROOT, "db", "vpn_portal_schema.sql")]
+        mig = os.path.join(ROOT, "db", "migrations")
+        files += sorted(os.path.join(mig, f) for f in os.listdir(mig) if f.endswith(".sql"))
+        for path in files:
+            with open(path) as f:
+                cur.execute(f.read())
+            while cur.nextset():
+                pass
+    conn.close()
+
+
+# ---- environment and seed data ----
+def setup_env(root, url, args):
+    run = os.path.join(root, "run")
+    os.makedirs(run)
+    wrapper = os.path.join(root, "wg")
+    with open(wrapper, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH, "fake_wg.py")}" "$@"\n')
+    os.chmod(wrapper, 0o755)
+    os.environ.update({
+        "DATABASE_URL": url, "WG_BACKEND": "subprocess", "WG_BIN": wrapper, "WG_SUDO": "",
+        "WG_INTERFACE": "wg0", "FAKE_WG_STATE": os.path.join(root, "wg0.json"),
+        "WG_SNAPSHOT_DIR": run, "LIMITER_DB": os.path.join(run, "limiter.sqlite3"),
+        "AUDIT_SPILL_DIR": os.path.join(root, "audit-spill"),
+        "METRICS_DIR": os.path.join(run, "metrics"),
+        "WORKER_NOTIFY_SOCK": os.path.join(run, "worker.sock"),
+        "LIVE_SOCK": os.path.join(run, "live.sock"),
+    })
+    os.environ.setdefault("SECRET_KEY", "loadtest")
+    os.environ.setdefault("CONFIG_KEY", "loadtest-sealing-key")
+    os.environ.setdefault("PWHASH_BCRYPT_ROUNDS", str(args.rounds))    # no upgrades mid-run
+    os.environ.setdefault("DB_POOL_SIZE", str(max(4, args.threads)))
+    os.environ.setdefault("LOCKOUT_IP_THRESHOLD", "1000000")         # every client is 127.0.0.1
+    fake_wg.STATE = os.environ["FAKE_WG_STATE"]
+    fake_wg.save_state(fake_wg.new_state())
+
+def seed_users(conn, args):
+    import bcrypt
+    from app.totp import generate_base32_secret
+    stored = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(args.rounds)).decode("ascii")
+    users = {"admin": [], "user": []}
+    rows = []
+    for kind, n in (("admin", args.threads), ("user", args.logins + args.poll_clients)):
+        for i in range(n):
+            secret = generate_base32_secret()
+            users[kind].append((f"{kind}{i}", secret))
+            rows.append((f"{kind}{i}", stored, int(kind == "admin"), secret))
+    with conn.cursor() as cur:
+        cur.executemany("INSERT INTO users (username, password_bcrypt, is_active, is_superadmin, "
+                        "mfa_enabled, totp_secret) VALUES (%s, %s, 1, %s, 1, %s)", rows)
+        cur.execute("INSERT INTO sites (name, fqdn, endpoint_host, wg_interface_ip, lan_cidrs_json) "
+                    "VALUES ('bench', 'vpn.bench.test', 'vpn.bench.test', '10.88.0.1/16', '[]')")
+    conn.commit()
+    return users
+
+def seed_peers(conn, n):
+    """Exactly n peers, in the DB and on the fake wg0."""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM peers")
+        cur.execute("SELECT id FROM sites ORDER BY id LIMIT 1")
+        site_id = cur.fetchone()[0]
+        state = fake_wg.load_state()
+        state["peers"] = {}
+        rows = []
+        for i in range(n):
+            pub = base64.b64encode(os.urandom(32)).decode("ascii")
+            addr = f"10.88.{(i + 2) >> 8}.{(i + 2) & 255}/32"
+            rows.append((site_id, f"device-{i}", pub, addr))
+            state["peers"][pub] = {"allowed_ips": addr, "keepalive": 25 if i % 3 == 0 else None}
+        cur.executemany("INSERT INTO peers (site_id, label, public_key, address_cidr, allowed_ips) "
+                        "VALUES (%s, %s, %s, %s, '0.0.0.0/0, ::/0')", rows)
+    conn.commit()
+    fake_wg.save_state(state)
+    from app import wg_live
+    wg_live.invalidate()
+
+
+# ---- clients ----
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}       # label -> [(seconds, status, queries)]
+
+    def call(self, label, fn, *a, **kw):
+        t0 = time.perf_counter()
+        r = fn(*a, **kw)
+        dt = time.perf_counter() - t0
+        q = 0
+        for st in r.headers.getlist("Server-Timing"):
+            if st.startswith("db;") and 'desc="' in st:
+                q = int(st.split('desc="', 1)[1].split()[0])
+        with self.lock:
+            self.samples.setdefault(label, []).append((dt, r.status_code, q))
+        return r
+
+
+def login(app, rec, username, secret, label=None):
+    """A fresh client signed in as `username` (each user once: TOTP codes are single-use)."""
+    from app.totp import totp_now
+    c = app.test_client()
+    post = (lambda lbl, *a, **kw: rec.call(lbl, c.post, *a, **kw)) if label else \
+           (lambda lbl, *a, **kw: c.post(*a, **kw))
+    r = post(f"{label} POST /login", "/login", data={"username": username, "password": PASSWORD})
+    if r.status_code != 302:
+        return None
+    r = post(f"{label} POST /mfa", "/mfa", data={"code": f"{totp_now(secret):06d}"})
+    return c if r.status_code == 302 else None
+
+def run_threads(n, target, seconds):
+    stop = time.monotonic() + seconds
+    ts = [threading.Thread(target=target, args=(i, stop)) for i in range(n)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return time.perf_counter() - t0
+
+
+# ---- scenarios ----
+def sc_login(app, conn, rec, users, admins, args):
+    todo = list(users["user"][:args.logins])
+    lock = threading.Lock()
+    def worker(i, stop):
+        while True:
+            with lock:
+                if not todo:
+                    return
+                u = todo.pop()
+            login(app, rec, *u, label="login")
+    return run_threads(args.threads, worker, float("inf"))
+
+def _peers(n):
+    def sc(app, conn, rec, users, admins, args):
+        seed_peers(conn, n)
+        def worker(i, stop):
+            while time.monotonic() < stop:
+                rec.call(f"peers{'5k' if n == 5000 else n} GET /peers/", admins[i].get, "/peers/")
+        return run_threads(args.threads, worker, args.seconds)
+    return sc
+
+def sc_bulk(app, conn, rec, users, admins, args):
+    seed_peers(conn, 250)
+    def worker(i, stop):
+        c = admins[i]
+        while time.monotonic() < stop:
+            specs = [{"label": f"bulk-{i}-{k}"} for k in range(args.bulk_size)]
+            r = rec.call("bulk POST /peers/bulk", c.post, "/peers/bulk", json=specs)
+            if r.status_code != 200:
+                continue
+            ids = [p["id"] for p in r.get_json()["created"]]
+            rec.call("bulk POST /peers/bulk-delete", c.post, "/peers/bulk-delete", json={"ids": ids})
+    return run_threads(args.threads, worker, args.seconds)
+
+def sc_poll(app, conn, rec, users, admins, args):
+    seed_peers(conn, 250)
+    clients = [c for c in (login(app, rec, *u) for u in users["user"][args.logins:]) if c]
+    paths = ("/", "/live/token", "/healthz", "/readyz")
+    def worker(i, stop):
+        c, k = clients[i], i
+        while time.monotonic() < stop:
+            path = paths[k % len(paths)]
+            rec.call(f"poll GET {path}", c.get, path)
+            k += 1
+    return run_threads(len(clients), worker, args.seconds)
+
+RUN = {"login": sc_login, "peers250": _peers(250), "peers5k": _peers(5000),
+       "bulk": sc_bulk, "poll": sc_poll}
+
+
+# ---- report ----
+def summarize(rec, wall):
+    out = {}
+    for label, xs in rec.samples.items():
+        lat = [s[0] for s in xs]
+        out[label] = {"n": len(xs), "rps": round(len(xs) / wall[label.split()[0]], 1),
+                      "p50_ms": round(pct(lat, .5), 2), "p99_ms": round(pct(lat, .99), 2),
+                      "queries": round(sum(s[2] for s in xs) / len(xs), 2),
+                      "errors": sum(1 for s in xs if s[1] >= 400)}
+    return out
+
+def compare(cur, base, tol):
+    bad = []
+    for label, b in base.items():
+        c = cur.get(label)
+        if c is None:
+            continue
+        if c["p99_ms"] > b["p99_ms"] * (1 + tol):
+            bad.append(f"{label}: p99 {b['p99_ms']} -> {c['p99_ms']} ms")
+        if c["rps"] < b["rps"] / (1 + tol):
+            bad.append(f"{label}: {b['rps']} -> {c['rps']} req/s")
+        if c["queries"] > b["queries"] + 0.05:
+            bad.append(f"{label}: {b['queries']} -> {c['queries']} queries/request")
+    return bad
+
+
+def main():
+    ap = argparse.ArgumentParser(description="end-to-end load test against local MariaDB and fake wg")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--logins", type=int, default=64, help="users signed in by the login scenario")
+    ap.add_argument("--poll-clients", type=int, default=32)
+    ap.add_argument("--bulk-size", type=int, default=50)
+    ap.add_argument("--rounds", type=int, default=12, help="bcrypt cost of the seeded users")
+    ap.add_argument("--db-url", help="scratch database to use (dropped and reloaded)")
+    ap.add_argument("--json", help="write results here")
+    ap.add_argument("--baseline", help="results of an earlier run to compare with")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args()
+    chosen = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(chosen) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    root = tempfile.mkdtemp(prefix="vpn-portal-loadtest-")
+    db_proc = None
+    try:
+        if args.db_url:
+            url = args.db_url
+        else:
+            db_proc, url = start_mariadb(root)
+        load_schema(url)
+        setup_env(root, url, args)
+
+        from app import create_app
+        from app.db import _parse_mysql_url
+        app = create_app()
+        seed = pymysql.connect(charset="utf8mb4", **_parse_mysql_url(url))
+        users = seed_users(seed, args)
+        seed_peers(seed, 0)
+        rec = Recorder()
+        admins = [login(app, rec, *u) for u in users["admin"]]
+        if not all(admins):
+            sys.exit("loadtest: admin login failed (check the app log)")
+
+        print(f"{args.threads} threads, {args.seconds:g} s per timed scenario, bcrypt cost "
+              f"{args.rounds}, {os.cpu_count()} cores, db {url.rsplit('@', 1)[-1]}")
+        wall = {}
+        for name in chosen:
+            wall[name] = RUN[name](app, seed, rec, users, admins, args)
+        results = summarize(rec, wall)
+
+        print(f"{'request':34s} {'n':>6s} {'req/s':>8s} {'p50 ms':>8s} {'p99 ms':>8s} "
+              f"{'q/req':>6s} {'errors':>6s}")
+        for label, r in results.items():
+            print(f"{label:34s} {r['n']:6d} {r['rps']:8.1f} {r['p50_ms']:8.2f} {r['p99_ms']:8.2f} "
+                  f"{r['queries']:6.2f} {r['errors']:6d}")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"args": vars(args), "results": results}, f, indent=2)
+        if args.baseline:
+            with open(args.baseline) as f:
+                bad = compare(results, json.load(f)["results"], args.tolerance)
+            for line in bad:
+                print(f"REGRESSION {line}")
+            if bad:
+                sys.exit(1)
+    finally:
+        if db_proc is not None:
+            db_proc.terminate()
+            try:
+                db_proc.wait(30)
+            except subprocess.TimeoutExpired:
+                db_proc.kill()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
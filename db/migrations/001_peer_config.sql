@@ -0,0 +1,9 @@
+-- db/migrations/001_peer_config.sql
+-- Client config downloads (app/wgconf.py): sealed client private key and the
+-- time the current config was last issued (stale when < sites.updated_at).
+
+ALTER TABLE `peers`
+  ADD COLUMN `private_key_enc` varchar(128) DEFAULT NULL AFTER `preshared_key`,
+  ADD COLUMN `config_issued_at` datetime DEFAULT NULL AFTER `private_key_enc`;
+
+INSERT INTO `schema_migrations` (`name`) VALUES ('001_peer_config');
@@ -0,0 +1,31 @@
+-- db/migrations/002_log_indexes.sql
+-- Composite indexes for the log filters in app/logs.py. Each filter column is
+-- paired with created_at (InnoDB appends the id), so "filter + time range,
+-- newest first" is one index range read in order, and keyset pages resume
+-- with a seek. The single-column user_id/username keys are superseded (the
+-- composites still back the foreign keys). peer_events gains the created_at
+-- index the retention purge needs.
+
+ALTER TABLE `audit_log`
+  ADD KEY `ix_audit_user_created` (`user_id`, `created_at`),
+  ADD KEY `ix_audit_action_created` (`action`, `created_at`),
+  ADD KEY `ix_audit_target_created` (`target_type`, `target_id`, `created_at`),
+  ADD KEY `ix_audit_ip_created` (`ip_address`, `created_at`),
+  DROP KEY `ix_audit_user`;
+
+ALTER TABLE `login_events`
+  ADD KEY `ix_login_user_created` (`user_id`, `created_at`),
+  ADD KEY `ix_login_username_created` (`username_attempted`, `created_at`),
+  ADD KEY `ix_login_success_created` (`success`, `created_at`),
+  ADD KEY `ix_login_ip_created` (`ip_address`, `created_at`),
+  DROP KEY `ix_login_user`,
+  DROP KEY `ix_login_events_username`;
+
+ALTER TABLE `peer_events`
+  ADD KEY `ix_peer_events_created` (`created_at`),
+  ADD KEY `ix_peer_events_user_created` (`user_id`, `created_at`),
+  ADD KEY `ix_peer_events_peer_created` (`peer_id`, `created_at`),
+  DROP KEY `ix_peer_events_user`,
+  DROP KEY `ix_peer_events_peer`;
+
+INSERT INTO `schema_migrations` (`name`) VALUES ('002_log_indexes');
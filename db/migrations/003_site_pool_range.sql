@@ -0,0 +1,9 @@
+-- db/migrations/003_site_pool_range.sql
+-- Per-site peer address pool (app/ipalloc.py): "first-last" inside the site's
+-- wg_interface_ip network, e.g. '10.88.0.10-10.88.0.254'. NULL derives the
+-- pool from the network (WG_POOL_OFFSET up to the last host).
+
+ALTER TABLE `sites`
+  ADD COLUMN `pool_range` varchar(100) DEFAULT NULL AFTER `wg_interface_ip`;
+
+INSERT INTO `schema_migrations` (`name`) VALUES ('003_site_pool_range');
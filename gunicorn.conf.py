@@ -9,3 +9,10 @@ keepalive = 5
 accesslog = "-"
 errorlog = "-"
 loglevel = os.getenv("LOG_LEVEL", "info").lower()
+
+
+def worker_exit(server, worker):
+    # Flush queued audit/login/peer events before the worker goes away;
+    # harmless if app.audit's atexit hook runs afterwards.
+    from app import audit
+    audit.shutdown()
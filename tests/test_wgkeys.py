@@ -0,0 +1,88 @@
+# tests/test_wgkeys.py
+# app.wgkeys against RFC 7748 and `wg pubkey` vectors, for both the
+# cryptography backend (when installed) and the pure-Python fallback.
+#
+#   python -m pytest tests   (or: python -m unittest discover tests)
+import base64, os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import wgkeys  # noqa: E402
+
+# RFC 7748 section 6.1 (Alice/Bob public keys) and section 5.2 (scalar mult).
+RFC7748 = [
+    ("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a",
+     "0900000000000000000000000000000000000000000000000000000000000000",
+     "8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a"),
+    ("5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb",
+     "0900000000000000000000000000000000000000000000000000000000000000",
+     "de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f"),
+    ("a546e36bf0527c9d3b16154b82465edd62144c0ac1fc5a18506a2244ba449ac4",
+     "e6db6867583030db3594c1a424b15f7c726624ec26b3353b10a903a6d0ab1c4c",
+     "c3da55379de9c6908e94ea4df28d084f32eccf03491c71f754b4075577a28552"),
+]
+# RFC 7748 section 6.1 shared secret: Alice's private key x Bob's public key.
+SHARED = ("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a",
+          "de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f",
+          "4a5d9d5ba4ce2de1728e3bf480350f25e07e21c947d19e3376f09b3c1e161742")
+# `wg pubkey` output for a fixed private key (RFC 7748 Alice, base64).
+WG_VECTOR = ("dwdtCnMYpX08FsFyUbJmRd9ML4frwJkqsXf7pR25LCo=",
+             "hSDwCYkwp1R0i33ctD73Wg2/Og0mOBr066SpjqqbTmo=")
+
+
+class Vectors:
+    def test_rfc7748(self):
+        for k, u, want in RFC7748 + [SHARED]:
+            self.assertEqual(wgkeys.x25519(bytes.fromhex(k), bytes.fromhex(u)).hex(), want)
+
+    def test_wg_pubkey(self):
+        priv, pub = WG_VECTOR
+        self.assertEqual(wgkeys.pubkey(priv), pub)
+
+    def test_genkeypair_roundtrip(self):
+        priv, pub = wgkeys.genkeypair()
+        self.assertEqual(wgkeys.pubkey(priv), pub)
+        raw = wgkeys.decode(priv)
+        self.assertEqual(raw[0] & 7, 0)           # clamped like `wg genkey`
+        self.assertEqual(raw[31] & 0xC0, 0x40)
+
+    def test_genkeypairs_psk(self):
+        rows = wgkeys.genkeypairs(5, psk=True)
+        self.assertEqual(len(rows), 5)
+        for priv, pub, psk in rows:
+            self.assertEqual(wgkeys.pubkey(priv), pub)
+            self.assertEqual(len(base64.b64decode(psk)), 32)
+        self.assertEqual(len({psk for _, _, psk in rows}), 5)
+
+    def test_decode_rejects_bad_keys(self):
+        for bad in ("", "not base64!", base64.b64encode(b"short").decode()):
+            with self.assertRaises(ValueError):
+                wgkeys.decode(bad)
+
+
+class NativeBackend(Vectors, unittest.TestCase):
+    def setUp(self):
+        if wgkeys.X25519PrivateKey is None:
+            self.skipTest("cryptography is not installed")
+
+
+class PurePythonBackend(Vectors, unittest.TestCase):
+    def setUp(self):
+        self._saved = wgkeys.X25519PrivateKey
+        wgkeys.X25519PrivateKey = None
+
+    def tearDown(self):
+        wgkeys.X25519PrivateKey = self._saved
+
+    def test_matches_native(self):
+        if self._saved is None:
+            self.skipTest("cryptography is not installed")
+        k = os.urandom(32)
+        wgkeys.X25519PrivateKey = self._saved
+        native = wgkeys.encode(wgkeys._public_raw(wgkeys._clamp(k)))
+        wgkeys.X25519PrivateKey = None
+        self.assertEqual(wgkeys.encode(wgkeys._public_raw(wgkeys._clamp(k))), native)
+
+
+if __name__ == "__main__":
+    unittest.main()